@@ -1,35 +1,174 @@
 from kivy.app import App
+from kivy.clock import Clock
+from kivy.storage.jsonstore import JsonStore
 from kivy.uix.boxlayout import BoxLayout
-from kivy.properties import StringProperty, ListProperty, DictProperty
+from kivy.properties import StringProperty, ListProperty, DictProperty, BooleanProperty
+from datetime import date, datetime
+import os
+import queue
+import re
+import threading
 import requests
 
+SERVER_URL = os.environ.get('WFB_SERVER_URL', 'http://localhost:5000')
+# (connect, read) timeouts in seconds
+TIMEOUT = (5, 30)
+POLL_SECONDS = 2
+
+class ApiClient:
+    # Sends requests from one background thread over a single keep-alive session and hands each
+    # response (or exception) to its callback on the UI thread through the Kivy clock.
+    # requests asks for gzip and decompresses it.
+    def __init__(self, base_url):
+        self.base_url = base_url
+        self.session = requests.Session()
+        self._queue = queue.Queue()
+        threading.Thread(target=self._run, name='wfb-api', daemon=True).start()
+
+    def request(self, method, path, on_response, on_error, **kwargs):
+        self._queue.put((method, path, on_response, on_error, kwargs))
+
+    def close(self):
+        self._queue.put(None)
+
+    def _run(self):
+        while True:
+            item = self._queue.get()
+            if item is None:
+                break
+            method, path, on_response, on_error, kwargs = item
+            try:
+                response = self.session.request(method, self.base_url + path, timeout=TIMEOUT, **kwargs)
+            except requests.RequestException as e:
+                Clock.schedule_once(lambda dt, e=e: on_error(e))
+                continue
+            Clock.schedule_once(lambda dt, response=response: on_response(response))
+        self.session.close()
+
+def parse_work_hours(text):
+    # "9AM-5PM" or "9:00 AM - 5:30 PM" -> ("9:00 AM", "5:30 PM"); None if it is not two times
+    times = re.findall(r'(\d{1,2})(?::(\d{2}))?\s*([AaPp][Mm])', text)
+    if len(times) != 2:
+        return None
+    return tuple(f"{int(hour)}:{minute or '00'} {period.upper()}" for hour, minute, period in times)
+
+def slot_start(slot_time):
+    # "01:00 PM" or "06:00 PM-07:30 PM" -> a sortable start time
+    return datetime.strptime(slot_time.split('-')[0].strip(), '%I:%M %p').time()
+
 class UserForm(BoxLayout):
     gender = StringProperty("Male")
     workouts = ListProperty([])
     meals = ListProperty([])
     schedule = DictProperty({})
+    schedule_text = StringProperty("")
+    status = StringProperty("")
+    busy = BooleanProperty(False)
+
+    def __init__(self, api, store, **kwargs):
+        super().__init__(**kwargs)
+        self.api = api
+        self.store = store
+        # Show the last plan right away, then ask the server whether it is still current
+        if self.store.exists('plan'):
+            self.show_week(self.store.get('plan')['schedule'])
+            self.refresh_plan()
 
     def submit_form(self):
+        if self.busy:
+            return
         data = {
             "age": self.ids.age.text,
             "weight": self.ids.weight.text,
             "height": self.ids.height.text,
             "gender": self.gender,
             "goal": self.ids.goal.text,
-            "schedule": self.ids.schedule.text
         }
-        try:
-            response = requests.post("http://localhost:5000/submit", json=data)
-            result = response.json()
-            self.workouts = result.get('workouts', [])
-            self.meals = result.get('meals', [])
-            self.schedule = result.get('schedule', {})
-        except Exception as e:
-            print(f"Error: {e}")
+        work_hours = parse_work_hours(self.ids.schedule.text)
+        if work_hours:
+            data["work_start"], data["work_end"] = work_hours
+        self.busy = True
+        self.status = "Planning your week..."
+        self.api.request('POST', '/submit', self.on_submitted, self.on_error, json=data)
+
+    def on_submitted(self, response):
+        if response.status_code not in (200, 202):
+            return self.on_failed(response)
+        result = response.json()
+        self.show_day(result.get('schedule', {}))
+        if result.get('user_id') is None:
+            # The server finishes the week in the background; ask again until it is stored
+            Clock.schedule_once(lambda dt: self.poll_submission(result['status_url']), POLL_SECONDS)
+            return
+        self.store.put('user', user_id=result['user_id'], week_start=date.today().isoformat())
+        self.refresh_plan()
+
+    def poll_submission(self, status_url):
+        self.api.request('GET', status_url, lambda response: self.on_submission_status(response, status_url),
+                         self.on_error)
+
+    def on_submission_status(self, response, status_url):
+        if response.status_code == 202:
+            Clock.schedule_once(lambda dt: self.poll_submission(status_url), POLL_SECONDS)
+            return
+        if response.status_code != 200:
+            return self.on_failed(response)
+        self.store.put('user', user_id=response.json()['user_id'], week_start=date.today().isoformat())
+        self.refresh_plan()
+
+    def refresh_plan(self):
+        if not self.store.exists('user'):
+            return
+        headers = {}
+        if self.store.exists('plan'):
+            headers['If-None-Match'] = self.store.get('plan')['etag']
+        self.busy = True
+        self.api.request('GET', f"/plan/{self.store.get('user')['user_id']}", self.on_plan, self.on_error,
+                         headers=headers)
+
+    def on_plan(self, response):
+        if response.status_code == 304:
+            self.busy = False
+            self.status = ""
+            return
+        if response.status_code != 200:
+            return self.on_failed(response)
+        schedule = response.json()['schedule']
+        self.store.put('plan', etag=response.headers.get('ETag', ''), schedule=schedule)
+        self.show_week(schedule)
+        self.busy = False
+        self.status = ""
+
+    def on_failed(self, response):
+        self.busy = False
+        self.status = f"Server error {response.status_code}"
+
+    def on_error(self, error):
+        self.busy = False
+        self.status = "Offline, showing your saved plan" if self.store.exists('plan') else f"Error: {error}"
+
+    def show_week(self, schedule):
+        # Days are numbered from the day the plan was made
+        week_start = date.fromisoformat(self.store.get('user')['week_start']) if self.store.exists('user') else date.today()
+        day = str((date.today() - week_start).days % 7)
+        self.show_day(schedule.get(day, schedule.get('0', {})))
+
+    def show_day(self, schedule):
+        # The server sends the slots keyed by time in no particular order
+        slots = sorted(schedule.items(), key=lambda item: slot_start(item[0]))
+        self.schedule = schedule
+        self.meals = [slot for _, slot in slots if slot['type'] == 'meal']
+        self.workouts = [w for _, slot in slots if slot['type'] == 'workout' for w in slot['details']]
+        self.schedule_text = "\n".join(f"{time}: {slot['name']}" for time, slot in slots)
 
 class WfbApp(App):
     def build(self):
-        return UserForm()
+        self.api = ApiClient(SERVER_URL)
+        store = JsonStore(os.path.join(self.user_data_dir, 'wfb.json'))
+        return UserForm(self.api, store)
+
+    def on_stop(self):
+        self.api.close()
 
 if __name__ == "__main__":
-    WfbApp().run()
\ No newline at end of file
+    WfbApp().run()
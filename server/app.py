@@ -1,222 +1,556 @@
-from flask import Flask, request, jsonify
-import sqlite3
+from flask import Flask, request, jsonify, g, Response, stream_with_context
+import os
+import gzip
 import json
-from datetime import datetime, timedelta
-import numpy as np
-from sklearn.metrics.pairwise import cosine_similarity
+import atexit
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from datetime import datetime
+from dotenv import load_dotenv
 import logging
+from catalog import open_catalog, catalog_changed, build_meal_index
+from planner import (user_profile, parse_time, recommend, plan_week, schedule_slots, slot_times, changed_stages,
+                     render_schedule)
+from plan_table import load_plan_table, lookup_week
+from storage import (init_db, save_catalog, encode_plan, decode_plan, store_submission, submission_user,
+                     load_plan, load_user, load_plan_rows, update_plan, plan_revision, USER_FIELDS, WriteQueue,
+                     WriteQueueFull, PlanConflict)
+from jobs import PlanJobs, PlanJobsFull, CohortPlanner
+import metrics
+from metrics import Span, Counter, Histogram, RequestProfiler
 
-# Set up logging
-logging.basicConfig(level=logging.DEBUG)
+load_dotenv()
+
+# Set up logging; per-request debug messages only with WFB_LOG_LEVEL=DEBUG
+logging.basicConfig(level=os.environ.get('WFB_LOG_LEVEL', 'INFO').upper())
 logger = logging.getLogger(__name__)
 
 app = Flask(__name__)
 logger.debug("Flask app initialized")
 
-# Load datasets
-logger.debug("Loading workouts.json")
-with open('workouts.json', 'r') as f:
-    workouts = json.load(f)
-logger.debug(f"Loaded {len(workouts)} workouts")
-
-logger.debug("Loading meals.json")
-with open('meals.json', 'r') as f:
-    meals = json.load(f)
-logger.debug(f"Loaded {len(meals)} meals")
-
-def get_db_connection():
-    conn = sqlite3.connect('data.sqlite', timeout=30)  # Increased timeout
-    conn.row_factory = sqlite3.Row
-    return conn
-
-def init_db():
-    logger.debug("Initializing database")
-    with get_db_connection() as conn:
-        c = conn.cursor()
-        c.execute('DROP TABLE IF EXISTS users')
-        c.execute('DROP TABLE IF EXISTS weekly_plan')
-        c.execute('''CREATE TABLE users
-                     (id INTEGER PRIMARY KEY, age TEXT, weight TEXT, height TEXT,
-                      gender TEXT, diet TEXT, goal TEXT, work_start TEXT,
-                      work_end TEXT, lunch_time TEXT)''')
-        c.execute('''CREATE TABLE weekly_plan
-                     (user_id INTEGER, day INTEGER, schedule TEXT,
-                      FOREIGN KEY(user_id) REFERENCES users(id))''')
-        conn.commit()
-    logger.debug("Database initialized")
-
-init_db()
-
-def calculate_bmi(weight, height):
-    weight = float(weight) if weight else 70
-    height = float(height) / 100 if height else 1.7
-    return weight / (height ** 2)
-
-def parse_time(time_str):
-    return datetime.strptime(time_str, '%I:%M %p') if time_str else datetime.strptime('9:00 AM', '%I:%M %p')
-
-def recommend(user_data, items, item_type, day_of_week, used_workouts):
-    logger.debug(f"Recommending {item_type} for day {day_of_week}")
-    goal = user_data.get('goal', 'fitness').lower()
-    gender = user_data.get('gender', 'male').lower()
-    diet = user_data.get('diet', 'non-vegetarian').lower()
-    age = float(user_data.get('age', '30'))
-    bmi = calculate_bmi(user_data.get('weight', '70'), user_data.get('height', '170'))
-    work_start = parse_time(user_data.get('work_start', '9:00 AM'))
-    work_end = parse_time(user_data.get('work_end', '10:00 PM'))
-    work_duration = (work_end - work_start).seconds / 3600
-
-    weekly_split = {0: 'push', 1: 'pull', 2: 'legs', 3: 'rest', 4: 'push', 5: 'pull', 6: 'legs'}
-    target_split = weekly_split.get(day_of_week, 'rest')
-    if target_split == 'rest' and item_type == 'workout':
-        return []
-
-    user_vector = [
-        1 if goal == 'fitness' else 0.5,
-        min(bmi / 30, 1.0) if bmi < 30 else 0.5,
-        1 - (work_duration / 12) if work_duration < 12 else 0.3,
-        1 - (age / 50) if age <= 50 else 0.4,
-        1 if gender == 'male' else 0.9,
-        1 if diet == 'vegetarian' else 0.8,
-        0.8 if bmi > 25 else 1.0,
-        1.0 if age < 35 else 0.7,
-        1.0 if goal == 'fitness' and bmi < 25 else 0.6
-    ]
+# Load datasets; either path may also be a columnar catalog directory (workouts.wfb, meals.wfb)
+workouts_path = os.environ.get('WFB_WORKOUTS_PATH', 'workouts.json')
+meals_path = os.environ.get('WFB_MEALS_PATH', 'meals.json')
+plan_table_path = os.environ.get('WFB_PLAN_TABLE')
+
+def load_snapshot(previous=None):
+    snapshot = open_catalog(workouts_path, meals_path, previous)
+    # Optional precomputed plans (see build_plan_table.py). Profiles are matched to a bucket, so
+    # plans are approximate within a band; only used when WFB_PLAN_TABLE names a table.
+    snapshot['plan_table'] = None
+    if plan_table_path:
+        plan_table = load_plan_table(plan_table_path)
+        if plan_table['catalog_version'] == snapshot['version']:
+            snapshot['plan_table'] = plan_table
+        else:
+            logger.warning("Ignoring plan table built for catalog %s", plan_table['catalog_version'])
+    snapshot['loaded_at'] = datetime.now().isoformat(timespec='seconds')
+    return snapshot
+
+# The published catalog snapshot, loaded by start(). Requests read it once and use that snapshot
+# throughout, and reload_catalog() replaces it with a single assignment, so in-flight requests
+# finish on the version they started with.
+catalog = None
+
+_reload_lock = threading.Lock()
+
+def reload_catalog():
+    global catalog
+    if not _reload_lock.acquire(blocking=False):
+        return False
+    try:
+        previous = catalog
+        snapshot = load_snapshot(previous)
+        # Stored plans reference catalog positions, so the version is saved before it is served
+        save_catalog(snapshot['version'], snapshot['workouts'], snapshot['meals'])
+        catalog = snapshot
+        if snapshot['version'] != previous['version']:
+            logger.info("Catalog reloaded: version %s -> %s", previous['version'], snapshot['version'])
+    except Exception:
+        logger.exception("Catalog reload failed; still serving version %s", catalog['version'])
+    finally:
+        _reload_lock.release()
+    return True
+
+def watch_catalog(interval):
+    while True:
+        time.sleep(interval)
+        if catalog_changed(catalog):
+            reload_catalog()
+
+# Optional write-behind mode (WFB_WRITE_QUEUE=1): /submit hands its rows to one writer thread
+# that commits many users per transaction instead of one transaction per request
+write_queue = None
+
+class PlanCache:
+    # In-process LRU/TTL cache of weekly plans, dropped whenever a plan for a new catalog version is
+    # stored. Lookups for any other version miss without touching the entries, so requests still
+    # finishing on the previous snapshot cannot wipe plans cached for the current one.
+    def __init__(self, max_size=1024, ttl=3600):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.version = None
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _check_version(self, version):
+        if version != self.version:
+            if self._entries:
+                self.invalidations += 1
+            self._entries.clear()
+            self.version = version
+
+    def get(self, key, version):
+        with self._lock:
+            entry = self._entries.get(key) if version == self.version else None
+            if entry is None:
+                self.misses += 1
+                return None
+            stored_at, value = entry
+            if time.monotonic() - stored_at > self.ttl:
+                del self._entries[key]
+                self.evictions += 1
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def put(self, key, version, value):
+        with self._lock:
+            self._check_version(version)
+            self._entries[key] = (time.monotonic(), value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def stats(self):
+        with self._lock:
+            return {'size': len(self._entries), 'max_size': self.max_size, 'hits': self.hits,
+                    'misses': self.misses, 'evictions': self.evictions, 'invalidations': self.invalidations}
 
-    item_vectors = []
-    for item in items:
-        goal_score = bmi_score = duration_score = age_score = gender_score = diet_score = intensity_score = split_score = volume_score = 0
-        if item_type == 'workout':
-            if goal == 'fitness' and item['type'] in ['strength', 'bodyweight']:
-                goal_score = 1.3 if item['intensity'] == 'high' else 1.0
-            bmi_score = 1.0 if bmi < 25 and item['calories_burned'] > 150 else 0.7
-            duration = item.get('duration_minutes', 20)
-            duration_score = 1.0 if duration <= 30 and work_duration > 8 else 0.6
-            age_score = 1.0 if age < 40 and item['intensity'] != 'high' else 0.5
-            gender_score = 1.0 if gender == 'male' and item['muscle_group'] in ['chest', 'back', 'legs'] else 0.9
-            intensity_score = 1.0 if item['intensity'] == 'medium' and bmi > 25 else 0.8
-            split_score = 2.0 if target_split == item['split'] else 0.05
-            volume_score = 1.0 if item['sets'] >= 3 else 0.7
-            if item['id'] in used_workouts:
-                split_score *= 0.01
-        elif item_type == 'meal':
-            if goal == 'fitness' and item['protein'] >= 15:
-                goal_score = 1.3 if item['protein'] >= 25 else 1.0
-            bmi_score = 1.0 if bmi < 25 or item['calories'] < 600 else 0.6
-            prep_time = item.get('prep_time_minutes', 30)
-            duration_score = 1.0 if prep_time <= 20 and work_duration > 8 else 0.7
-            age_score = 1.0 if age < 40 else 0.8
-            gender_score = 1.0 if gender == 'male' and item['protein'] > 20 else 0.9
-            diet_score = 2.0 if item['type'] == diet else 0.0
-            intensity_score = 1.0
-            split_score = 1.0
-            volume_score = 1.0
-        item_vectors.append([goal_score, bmi_score, duration_score, age_score, gender_score, diet_score, intensity_score, split_score, volume_score])
-
-    if not item_vectors:
-        return []
-    similarities = cosine_similarity([user_vector], item_vectors)[0]
-    ranked = sorted(zip(similarities, items), key=lambda x: x[0], reverse=True)[:3]
-    return [item for _, item in ranked]
-
-def create_schedule(user_data, workouts, meals):
-    work_start = parse_time(user_data.get('work_start', '9:00 AM'))
+plan_cache = None
+if os.environ.get('WFB_PLAN_CACHE', '1') != '0':
+    plan_cache = PlanCache(max_size=int(os.environ.get('WFB_PLAN_CACHE_SIZE', '1024')),
+                           ttl=float(os.environ.get('WFB_PLAN_CACHE_TTL', '3600')))
+
+def plan_cache_key(user_data, week_start):
+    # Everything the weekly plan depends on, normalized so equivalent submissions share an entry
+    profile = user_profile(user_data)
     work_end = parse_time(user_data.get('work_end', '10:00 PM'))
     lunch_time = parse_time(user_data.get('lunch_time', '1:00 PM'))
-    work_hours = []
-    current = work_start
-    while current < work_end:
-        work_hours.append(current.hour)
-        current += timedelta(hours=1)
-
-    meal_plan = [
-        {"time": "7:00 AM", "calories": 350, "protein": 10, "carbs": 50, "fat": 10, "meal_type": "breakfast", "purpose": "High-carb for energy"},
-        {"time": lunch_time.strftime('%I:%M %p'), "calories": 600, "protein": 30, "carbs": 70, "fat": 20, "meal_type": "lunch", "purpose": "High-protein for recovery"},
-        {"time": "8:00 PM", "calories": 600, "protein": 30, "carbs": 70, "fat": 20, "meal_type": "dinner", "purpose": "High-protein for recovery"}
-    ]
+    return (profile['goal'], profile['gender'], profile['diet'], profile['age'], profile['bmi'],
+            profile['work_duration'], work_end.strftime('%H:%M'), lunch_time.strftime('%H:%M'),
+            week_start.weekday())
+
+def build_weekly_slots(user_data, week_start, snapshot, days=7):
+    # Slots for the first `days` days of the week; a cached or precomputed week is returned whole
+    if plan_cache is not None:
+        key = plan_cache_key(user_data, week_start)
+        weekly_slots = plan_cache.get(key, snapshot['version'])
+        if weekly_slots is not None:
+            return weekly_slots
+
+    workouts, meals = snapshot['workouts'], snapshot['meals']
+    weekly_slots = {}
+    week = None
+    if snapshot['plan_table'] is not None:
+        week = lookup_week(snapshot['plan_table'], user_data, week_start, workouts, meals)
+    if week is None:
+        week = plan_week(user_data, week_start, workouts, meals, snapshot['workout_classes'], snapshot['meal_classes'],
+                         days=range(days))
+    with Span('schedule'):
+        # Every day gets the same ranked meals, so their slot index is built once per week
+        meal_index = build_meal_index(week[0][1])
+        for day, (selected_workouts, selected_meals) in enumerate(week):
+            weekly_slots[day] = schedule_slots(user_data, selected_workouts, selected_meals, meal_index)
+
+    # A request that started before a reload must not fill the cache for the new version
+    if plan_cache is not None and snapshot is catalog and len(weekly_slots) == 7:
+        plan_cache.put(key, snapshot['version'], weekly_slots)
+    return weekly_slots
+
+# Optional fast-response mode (WFB_SUBMIT_MODE=async): /submit plans and returns the first day,
+# and a worker pool (WFB_SUBMIT_EXECUTOR=thread, process or asyncio) plans the rest of the week
+# and stores it. GET /submit/<submission_id> reports progress and returns the full week. Process
+# workers open the catalog files themselves and keep the last two versions they opened; a
+# submission whose version a worker no longer has after a reload gets its whole week planned on
+# the current catalog, so its stored first day can differ from the one /submit returned.
+plan_jobs = None
+
+def cache_completed_week(task, catalog_version, rows):
+    # Weeks completed in the background are cached like the ones /submit plans whole
+    snapshot = catalog
+    if plan_cache is not None and catalog_version == snapshot['version']:
+        plan_cache.put(plan_cache_key(task['user_data'], task['week_start']), catalog_version,
+                       decode_plan(rows, snapshot['workouts'], snapshot['meals']))
+
+# Bulk onboarding (POST /cohort). Unique profiles are planned in the request thread, or in
+# WFB_COHORT_WORKERS processes when set, and users are stored WFB_COHORT_BATCH_SIZE per transaction.
+cohort_planner = None
+
+# Per-request timing and the optional sampled profiler. WFB_PROFILE_SAMPLE_RATE is the share
+# of requests profiled; profiles of those slower than WFB_PROFILE_SLOW_MS go to WFB_PROFILE_DIR.
+REQUESTS = Counter('wfb_requests_total', 'Requests handled', ('endpoint', 'status'))
+REQUEST_SECONDS = Histogram('wfb_request_seconds', 'Request latency', ('endpoint',))
+PROFILES = Counter('wfb_slow_request_profiles_total', 'Slow request profiles written', ('endpoint',))
+PROFILE_UPDATES = Counter('wfb_profile_updates_total', 'Profile edits by how much of the plan was recomputed',
+                          ('replan',))
+
+profiler = None
+if float(os.environ.get('WFB_PROFILE_SAMPLE_RATE', '0')) > 0:
+    profiler = RequestProfiler(float(os.environ['WFB_PROFILE_SAMPLE_RATE']),
+                               float(os.environ.get('WFB_PROFILE_SLOW_MS', '500')) / 1000,
+                               os.environ.get('WFB_PROFILE_DIR', 'profiles'))
+
+@app.before_request
+def start_timer():
+    g.started = time.perf_counter()
+    g.profile = profiler.start() if profiler is not None else None
+
+@app.after_request
+def record_request(response):
+    elapsed = time.perf_counter() - g.started
+    endpoint = request.url_rule.rule if request.url_rule is not None else 'unmatched'
+    REQUESTS.inc(endpoint, str(response.status_code))
+    REQUEST_SECONDS.observe(elapsed, endpoint)
+    if g.profile is not None:
+        path = profiler.stop(g.profile, endpoint, elapsed)
+        g.profile = None
+        if path:
+            PROFILES.inc(endpoint)
+            logger.warning("Slow request %s took %.0f ms; profile written to %s", endpoint, elapsed * 1000, path)
+    return response
+
+# JSON responses of at least GZIP_MIN_BYTES are gzipped for clients that accept it (WFB_GZIP=0 turns it off)
+GZIP_MIN_BYTES = 1024
+gzip_responses = os.environ.get('WFB_GZIP', '1') != '0'
 
-    daily_schedule = {}
-    for meal in meal_plan:
-        time = meal['time']
-        target_calories = meal['calories']
-        target_protein = meal['protein']
-        target_carbs = meal['carbs']
-        target_fat = meal['fat']
-        meal_type = meal['meal_type']
-        purpose = meal['purpose']
-        suitable_meals = [m for m in meals if m.get('meal_type') == meal_type and 
-                         m.get('type') == user_data.get('diet', 'non-vegetarian').lower() and 
-                         'purpose' in m and
-                         abs(m['calories'] - target_calories) <= 150 and 
-                         abs(m['protein'] - target_protein) <= 15 and 
-                         abs(m['carbs'] - target_carbs) <= 30]
-        if not suitable_meals:
-            suitable_meals = [m for m in meals if m.get('meal_type') == meal_type and 
-                             m.get('type') == user_data.get('diet', 'non-vegetarian').lower() and 
-                             'purpose' in m]
-        if not suitable_meals:
-            suitable_meals = [m for m in meals if m.get('meal_type') in ['main course', 'breakfast', 'snack'] and 
-                             'purpose' in m]
-        selected_meal = suitable_meals[0] if suitable_meals else meals[0]
-        daily_schedule[time] = {
-            "type": "meal",
-            "name": selected_meal['name'],
-            "calories": selected_meal['calories'],
-            "protein": selected_meal['protein'],
-            "carbs": selected_meal['carbs'],
-            "fat": selected_meal['fat'],
-            "purpose": selected_meal.get('purpose', purpose)
-        }
-
-    if workouts:
-        workout_time = (work_end + timedelta(hours=1)).strftime('%I:%M %p')
-        workout_end = (work_end + timedelta(hours=2, minutes=30)).strftime('%I:%M %p')
-        warmup = "5 min dynamic stretches (leg swings, arm circles)"
-        detailed_workouts = [
-            {
-                **w,
-                "instructions": f"Use 70-80% 1RM, rest {90 if w['intensity'] == 'high' else 60}s."
-            } for w in workouts
-        ]
-        daily_schedule[f"{workout_time}-{workout_end}"] = {
-            "type": "workout",
-            "name": f"{workouts[0]['split'].capitalize()} Day",
-            "details": detailed_workouts,
-            "warmup": warmup
-        }
-
-    return daily_schedule
+@app.after_request
+def compress_response(response):
+    if (not gzip_responses or response.status_code != 200 or response.direct_passthrough or response.is_streamed
+            or response.mimetype != 'application/json' or 'Content-Encoding' in response.headers
+            or 'gzip' not in request.accept_encodings):
+        return response
+    data = response.get_data()
+    if len(data) >= GZIP_MIN_BYTES:
+        response.set_data(gzip.compress(data, compresslevel=6))
+        response.headers['Content-Encoding'] = 'gzip'
+        response.vary.add('Accept-Encoding')
+    return response
+
+@app.teardown_request
+def release_profiler(exc):
+    # A request that failed before after_request still gives the profiler back
+    if g.get('profile') is not None:
+        profiler.stop(g.profile, 'failed', 0)
 
 @app.route('/submit', methods=['POST'])
 def submit():
     logger.debug("Received /submit request")
     user_data = request.json
-    with get_db_connection() as conn:
-        c = conn.cursor()
-        c.execute('''INSERT INTO users (age, weight, height, gender, diet, goal, work_start, work_end, lunch_time)
-                     VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)''',
-                  (user_data.get('age'), user_data.get('weight'), user_data.get('height'),
-                   user_data.get('gender'), user_data.get('diet'), user_data.get('goal'),
-                   user_data.get('work_start'), user_data.get('work_end'), user_data.get('lunch_time')))
-        user_id = c.lastrowid
-
-        week_start = datetime.now()
-        weekly_schedule = {}
-        used_workouts = set()
-        for day in range(7):
-            current_day = (week_start + timedelta(days=day)).weekday()
-            selected_workouts = recommend(user_data, workouts, 'workout', current_day, used_workouts)
-            for w in selected_workouts:
-                used_workouts.add(w['id'])
-            selected_meals = recommend(user_data, meals, 'meal', current_day, used_workouts)
-            daily_schedule = create_schedule(user_data, selected_workouts, selected_meals)
-            weekly_schedule[day] = daily_schedule
-            c.execute('INSERT INTO weekly_plan (user_id, day, schedule) VALUES (?, ?, ?)',
-                      (user_id, day, json.dumps(daily_schedule)))
-        conn.commit()
-    logger.debug(f"Stored schedule for user_id {user_id}")
-    return jsonify({'schedule': weekly_schedule[0]})
+    # Retries that carry the same Idempotency-Key get the original submission, not a new user
+    submission_key = request.headers.get('Idempotency-Key')
+    if plan_jobs is not None:
+        return submit_first_day(user_data, submission_key or uuid.uuid4().hex)
+    if submission_key:
+        user_id = submission_user(submission_key)
+        if user_id is not None:
+            return jsonify({'user_id': user_id, 'schedule': load_plan(user_id)[0]})
+
+    snapshot = catalog
+    week_start = datetime.now()
+    weekly_slots = build_weekly_slots(user_data, week_start, snapshot)
+    plan_rows = encode_plan(weekly_slots, snapshot['positions'])
+    with Span('db_commit'):
+        if write_queue is not None:
+            try:
+                user_id = write_queue.submit(user_data, snapshot['version'], plan_rows, submission_key,
+                                             week_start).result()
+            except WriteQueueFull:
+                return jsonify({'error': 'Server busy, please retry'}), 503
+        else:
+            user_id = store_submission(user_data, snapshot['version'], plan_rows, submission_key, week_start)
+    logger.debug("Stored schedule for user_id %s", user_id)
+    with Span('serialize'):
+        return jsonify({'user_id': user_id, 'schedule': render_schedule(weekly_slots[0])})
+
+def submission_response(submission_id, state):
+    return jsonify({'submission_id': submission_id, 'status': state['status'], 'user_id': state['user_id'],
+                    'status_url': f'/submit/{submission_id}', 'schedule': state['schedule']}), 202
+
+def submit_first_day(user_data, submission_id):
+    state = plan_jobs.status(submission_id)
+    if state is not None and state['status'] != 'failed':
+        return submission_response(submission_id, state)
+    user_id = submission_user(submission_id)
+    if user_id is not None:
+        return jsonify({'submission_id': submission_id, 'status': 'complete', 'user_id': user_id,
+                        'status_url': f'/submit/{submission_id}', 'schedule': load_plan(user_id)[0]})
+
+    snapshot = catalog
+    week_start = datetime.now()
+    weekly_slots = build_weekly_slots(user_data, week_start, snapshot, days=1)
+    task = {'key': submission_id, 'user_data': user_data, 'week_start': week_start,
+            'catalog_version': snapshot['version'], 'rows': encode_plan(weekly_slots, snapshot['positions'])}
+    with Span('serialize'):
+        schedule = render_schedule(weekly_slots[0])
+    try:
+        state = plan_jobs.submit(submission_id, task, snapshot, schedule)
+    except PlanJobsFull:
+        return jsonify({'error': 'Server busy, please retry'}), 503
+    return submission_response(submission_id, state)
+
+@app.route('/submit/<submission_id>', methods=['GET'])
+def submission_status(submission_id):
+    state = plan_jobs.status(submission_id) if plan_jobs is not None else None
+    if state is not None and state['status'] == 'pending':
+        return jsonify({'submission_id': submission_id, 'status': 'pending'}), 202
+    if state is not None and state['status'] == 'failed':
+        return jsonify({'submission_id': submission_id, 'status': 'failed', 'error': state['error']}), 500
+    user_id = state['user_id'] if state is not None else submission_user(submission_id)
+    if user_id is None:
+        return jsonify({'error': 'No such submission'}), 404
+    with Span('db_read'):
+        weekly_schedule = load_plan(user_id)
+    with Span('serialize'):
+        return jsonify({'submission_id': submission_id, 'status': 'complete', 'user_id': user_id,
+                        'schedule': weekly_schedule})
+
+def ndjson_profiles(lines):
+    for index, line in enumerate(line for line in lines if line.strip()):
+        try:
+            user_data = json.loads(line)
+        except ValueError as e:
+            yield index, None, f"Invalid JSON: {e}"
+            continue
+        if isinstance(user_data, dict):
+            yield index, user_data, None
+        else:
+            yield index, None, "Expected a JSON object"
+
+@app.route('/cohort', methods=['POST'])
+def cohort():
+    # Profiles as NDJSON (Content-Type: application/x-ndjson, read as it arrives) or a JSON list.
+    # Results stream back as NDJSON lines {"index", "user_id"} or {"index", "error"} in the order
+    # they are stored, followed by a {"done": true} summary.
+    if request.mimetype == 'application/x-ndjson':
+        profiles = ndjson_profiles(request.stream)
+    else:
+        user_list = request.get_json(silent=True)
+        if not isinstance(user_list, list):
+            return jsonify({'error': 'Expected a JSON list of profiles or NDJSON'}), 400
+        profiles = ((index, user_data, None) if isinstance(user_data, dict) else (index, None, "Expected a JSON object")
+                    for index, user_data in enumerate(user_list))
+
+    snapshot = catalog
+    week_start = datetime.now()
+    results = cohort_planner.run(profiles, week_start, snapshot, lambda user_data: plan_cache_key(user_data, week_start))
+    return Response(stream_with_context(json.dumps(result) + '\n' for result in results),
+                    mimetype='application/x-ndjson')
+
+@app.route('/plan/<int:user_id>', methods=['GET'])
+def get_plan(user_id):
+    # The ETag changes whenever the plan is edited, so clients revalidate a stored plan with
+    # If-None-Match and get a 304 without the plan being loaded
+    with Span('db_read'):
+        revision = plan_revision(user_id)
+    if revision is None:
+        return jsonify({'error': 'No plan for this user'}), 404
+    etag = f'{user_id}-{revision}'
+    if request.if_none_match.contains_weak(etag):
+        response = Response(status=304)
+    else:
+        with Span('db_read'):
+            weekly_schedule = load_plan(user_id)
+        if not weekly_schedule:
+            return jsonify({'error': 'No plan for this user'}), 404
+        with Span('serialize'):
+            response = jsonify({'user_id': user_id, 'schedule': weekly_schedule})
+    # Weak, since the same plan may be sent gzipped or not
+    response.set_etag(etag, weak=True)
+    response.cache_control.no_cache = True
+    return response
+
+def replan_rows(user, user_data, stages, old_rows, snapshot):
+    # The plan rows after an edit, recomputing only what the changed stages need. Returns the rows,
+    # the catalog version and week start they belong to, and which kind of re-plan it took.
+    catalog_version, week_start = user['catalog_version'], user['week_start']
+    if not stages:
+        return old_rows, catalog_version, week_start, 'none'
+    if ('workouts' in stages or not old_rows or
+            ('meals' in stages and catalog_version != snapshot['version'])):
+        # Whole week on the current catalog; plans stored without a week start begin today
+        week_start = week_start or datetime.now()
+        weekly_slots = build_weekly_slots(user_data, week_start, snapshot)
+        return encode_plan(weekly_slots, snapshot['positions']), snapshot['version'], week_start, 'full'
+    if 'meals' in stages:
+        # New meals around the stored workouts
+        workouts = snapshot['workouts']
+        selected_meals = recommend(user_data, snapshot['meals'], 'meal', 0, [], snapshot['meal_classes'])
+        with Span('schedule'):
+            meal_index = build_meal_index(selected_meals)
+            weekly_slots = {}
+            for day in sorted({row[0] for row in old_rows}):
+                selected_workouts = [workouts[row[4]] for row in old_rows if row[0] == day and row[3] == 'workout']
+                weekly_slots[day] = schedule_slots(user_data, selected_workouts, selected_meals, meal_index)
+        return encode_plan(weekly_slots, snapshot['positions']), catalog_version, week_start, 'meals'
+    # Same items at new times. schedule_slots() puts each day's breakfast, lunch and dinner first.
+    meal_times, workout_slot = slot_times(user_data)
+    rows = [(day, seq, meal_times[seq] if kind == 'meal' else workout_slot, kind, position, overrides)
+            for day, seq, slot, kind, position, overrides in old_rows]
+    return rows, catalog_version, week_start, 'times'
+
+PATCH_ATTEMPTS = 3
+
+@app.route('/user/<int:user_id>', methods=['PATCH'])
+def update_user(user_id):
+    # Partial profile edit. Only the planning stages the changed fields feed are recomputed
+    # (planner.changed_stages), and only the plan rows that come out different are rewritten.
+    changes = request.get_json(silent=True)
+    if not isinstance(changes, dict) or not set(changes) <= set(USER_FIELDS):
+        return jsonify({'error': f"Expected a JSON object with any of {', '.join(USER_FIELDS)}"}), 400
+    # The edit is computed from the rows as read and only stored if no other edit landed in between;
+    # otherwise it is computed again from the newer rows
+    for attempt in range(PATCH_ATTEMPTS):
+        with Span('db_read'):
+            user = load_user(user_id)
+            old_rows = load_plan_rows(user_id) if user is not None else []
+        if user is None:
+            return jsonify({'error': 'No such user'}), 404
+        user_data = {**user['user_data'], **changes}
+        try:
+            stages = changed_stages(user['user_data'], user_data)
+        except (ValueError, TypeError, AttributeError, ZeroDivisionError) as e:
+            return jsonify({'error': f"Invalid profile: {e}"}), 400
+
+        rows, catalog_version, week_start, replan = replan_rows(user, user_data, stages, old_rows, catalog)
+        try:
+            with Span('db_commit'):
+                rows_changed = update_plan(user_id, user, user_data, catalog_version, week_start, old_rows, rows)
+            break
+        except PlanConflict:
+            logger.debug("User %s changed during the edit, attempt %d", user_id, attempt + 1)
+    else:
+        return jsonify({'error': 'The profile is being edited by another request, please retry'}), 409
+    PROFILE_UPDATES.inc(replan)
+    logger.debug("Updated user_id %s: %s re-plan, %d plan rows rewritten", user_id, replan, rows_changed)
+    with Span('db_read'):
+        weekly_schedule = load_plan(user_id)
+    with Span('serialize'):
+        return jsonify({'user_id': user_id, 'stages': sorted(stages), 'rows_changed': rows_changed,
+                        'schedule': weekly_schedule})
+
+def service_metrics():
+    snapshot = catalog
+    samples = [
+        ('wfb_catalog_items', 'gauge', 'Items in the served catalog',
+         [({'kind': 'workout'}, len(snapshot['workouts'])), ({'kind': 'meal'}, len(snapshot['meals']))]),
+        ('wfb_catalog_classes', 'gauge', 'Signature classes scored per request',
+         [({'kind': 'workout'}, len(snapshot['workout_classes']['members'])),
+          ({'kind': 'meal'}, len(snapshot['meal_classes']['members']))]),
+        ('wfb_catalog_info', 'gauge', 'Version of the served catalog', [({'version': snapshot['version']}, 1)]),
+    ]
+    if plan_cache is not None:
+        stats = plan_cache.stats()
+        samples.append(('wfb_plan_cache_entries', 'gauge', 'Plans in the cache', [({}, stats['size'])]))
+        for name in ('hits', 'misses', 'evictions', 'invalidations'):
+            samples.append((f'wfb_plan_cache_{name}_total', 'counter', f'Plan cache {name}', [({}, stats[name])]))
+    if plan_jobs is not None:
+        samples.extend([
+            ('wfb_submit_jobs_pending', 'gauge', 'Submissions waiting for the rest of their week',
+             [({}, plan_jobs.pending)]),
+            ('wfb_submit_jobs_total', 'counter', 'Background week completions',
+             [({'result': 'complete'}, plan_jobs.completed), ({'result': 'failed'}, plan_jobs.failed)]),
+        ])
+    samples.extend([
+        ('wfb_cohort_plans_total', 'counter', 'Unique weeks planned for cohorts', [({}, cohort_planner.planned)]),
+        ('wfb_cohort_users_total', 'counter', 'Cohort profiles handled',
+         [({'result': 'stored'}, cohort_planner.written), ({'result': 'failed'}, cohort_planner.failed)]),
+    ])
+    if write_queue is not None:
+        samples.extend([
+            ('wfb_write_queue_batches_total', 'counter', 'Group commits', [({}, write_queue.batches)]),
+            ('wfb_write_queue_written_total', 'counter', 'Submissions written by group commit',
+             [({}, write_queue.written)]),
+        ])
+    return samples
+
+metrics.register_collector(service_metrics)
+
+@app.route('/metrics', methods=['GET'])
+def prometheus_metrics():
+    return Response(metrics.render(), content_type=metrics.CONTENT_TYPE)
+
+def admin_authorized():
+    # Admin endpoints are off unless WFB_ADMIN_TOKEN is set
+    token = os.environ.get('WFB_ADMIN_TOKEN')
+    return bool(token) and request.headers.get('X-Admin-Token') == token
+
+@app.route('/admin/catalog', methods=['GET'])
+def admin_catalog():
+    if not admin_authorized():
+        return jsonify({'error': 'Forbidden'}), 403
+    snapshot = catalog
+    return jsonify({'catalog_version': snapshot['version'], 'loaded_at': snapshot['loaded_at'],
+                    'workouts': len(snapshot['workouts']), 'meals': len(snapshot['meals']),
+                    'plan_table': snapshot['plan_table'] is not None})
+
+@app.route('/admin/reload', methods=['POST'])
+def admin_reload():
+    if not admin_authorized():
+        return jsonify({'error': 'Forbidden'}), 403
+    # Built in the background; poll /admin/catalog for the new version
+    threading.Thread(target=reload_catalog, name='wfb-catalog-reload', daemon=True).start()
+    return jsonify({'status': 'reloading', 'catalog_version': catalog['version']}), 202
+
+def start():
+    # Loads the catalog and starts the background workers; returns the WSGI app (gunicorn 'app:start()').
+    # Importing this module has no side effects, since spawned worker processes import it again.
+    global catalog, write_queue, plan_jobs, cohort_planner
+    logger.debug("Loading %s and %s", workouts_path, meals_path)
+    catalog = load_snapshot()
+    logger.info("Loaded %d workouts and %d meals, catalog version %s",
+                len(catalog['workouts']), len(catalog['meals']), catalog['version'])
+    logger.debug("Scoring %d workout and %d meal signature classes",
+                 len(catalog['workout_classes']['members']), len(catalog['meal_classes']['members']))
+
+    init_db()
+    save_catalog(catalog['version'], catalog['workouts'], catalog['meals'])
+
+    if float(os.environ.get('WFB_CATALOG_WATCH_SECONDS', '0')) > 0:
+        threading.Thread(target=watch_catalog, args=(float(os.environ['WFB_CATALOG_WATCH_SECONDS']),),
+                         name='wfb-catalog-watch', daemon=True).start()
+
+    if os.environ.get('WFB_WRITE_QUEUE') == '1':
+        write_queue = WriteQueue(batch_size=int(os.environ.get('WFB_WRITE_BATCH_SIZE', '128')),
+                                 max_wait=float(os.environ.get('WFB_WRITE_MAX_WAIT_MS', '5')) / 1000,
+                                 max_pending=int(os.environ.get('WFB_WRITE_QUEUE_SIZE', '4096')))
+        atexit.register(write_queue.close)
+
+    if os.environ.get('WFB_SUBMIT_MODE', 'sync') == 'async':
+        plan_jobs = PlanJobs(executor=os.environ.get('WFB_SUBMIT_EXECUTOR', 'thread'),
+                             workers=int(os.environ.get('WFB_SUBMIT_WORKERS', '4')),
+                             max_pending=int(os.environ.get('WFB_SUBMIT_QUEUE_SIZE', '1024')),
+                             catalog_paths=(workouts_path, meals_path), on_complete=cache_completed_week)
+        atexit.register(plan_jobs.close)
+
+    # Worker processes are opt-in: every server process would otherwise start its own pool
+    cohort_planner = CohortPlanner(workers=int(os.environ.get('WFB_COHORT_WORKERS', '0')),
+                                   chunk_size=int(os.environ.get('WFB_COHORT_CHUNK_SIZE', '16')),
+                                   batch_size=int(os.environ.get('WFB_COHORT_BATCH_SIZE', '1000')),
+                                   catalog_paths=(workouts_path, meals_path))
+    atexit.register(cohort_planner.close)
+    return app
 
 if __name__ == '__main__':
+    start()
     logger.debug("Starting Flask server")
     app.run(host='127.0.0.1', port=5000, debug=False)  # Disable debug to prevent multiple instances
\ No newline at end of file
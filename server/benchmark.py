@@ -0,0 +1,265 @@
+import argparse
+import gc
+import json
+import logging
+import os
+import platform
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime
+import numpy as np
+
+parser = argparse.ArgumentParser(description="Benchmark the planner hot paths over a sweep of catalog sizes.")
+parser.add_argument('--sizes', default='200,2000,20000,200000,1000000',
+                    help="Comma-separated catalog sizes (items per catalog)")
+parser.add_argument('--cases', default='recommend_workout,recommend_meal,plan_week,create_schedule,submit,sqlite_store',
+                    help="Comma-separated subset of the benchmark cases")
+parser.add_argument('--iterations', type=int, default=200, help="Timed warm runs per case")
+parser.add_argument('--warmup', type=int, default=20, help="Untimed runs before the warm measurement")
+parser.add_argument('--cold-runs', type=int, default=3,
+                    help="Fresh catalog opens per size; the first call of each case after each is timed as cold")
+parser.add_argument('--memory-runs', type=int, default=5, help="Runs per case traced with tracemalloc")
+parser.add_argument('--users', type=int, default=1000, help="Distinct generated user profiles to cycle through")
+parser.add_argument('--seed', type=int, default=0)
+parser.add_argument('--work-dir', help="Where generated catalogs and the scratch database live; "
+                                       "catalogs found there are reused (default: a new temp dir)")
+parser.add_argument('--output', default='benchmark_results.json')
+parser.add_argument('--baseline', help="Results file to compare against")
+parser.add_argument('--threshold', type=float, default=10.0, help="Allowed regression in percent")
+parser.add_argument('--metrics', default='p50_ms,p95_ms', help="Metrics compared against the baseline")
+args = parser.parse_args()
+
+# The service reads its database path at import, so point it at a scratch database first
+work_dir = args.work_dir or tempfile.mkdtemp(prefix='wfb-bench-')
+os.makedirs(work_dir, exist_ok=True)
+os.environ['WFB_DB_PATH'] = os.path.join(work_dir, 'bench.sqlite')
+os.environ['WFB_CATALOG_WATCH_SECONDS'] = '0'
+for suffix in ('', '-wal', '-shm'):
+    if os.path.exists(os.environ['WFB_DB_PATH'] + suffix):
+        os.remove(os.environ['WFB_DB_PATH'] + suffix)
+
+import storage
+from catalog import open_catalog, ColumnarCatalogWriter, build_meal_index
+from planner import recommend, plan_week, create_schedule, schedule_slots
+from generate_datasets import GENERATORS, blocks, parse_mix, splits, intensities, meal_types, diet_types, goals
+
+HIGHER_IS_BETTER = {'ops_per_sec'}
+TRAINING_DAYS = [0, 1, 2, 4, 5, 6]
+MIX = {'split': parse_mix('', splits), 'intensity': parse_mix('', intensities),
+       'meal_type': parse_mix('', meal_types), 'diet': parse_mix('', diet_types), 'goal': parse_mix('', goals)}
+
+def build_catalog(kind, size):
+    # Seeded synthetic catalog in the columnar format, generated once per size and seed
+    path = os.path.join(work_dir, f"{kind}s-{size}-seed{args.seed}.wfb")
+    if not os.path.exists(os.path.join(path, 'meta.json')):
+        writer = ColumnarCatalogWriter(path, kind)
+        for task in blocks(args.seed, size, MIX):
+            writer.write(GENERATORS[kind](task))
+        writer.close()
+    return path
+
+def percentiles(times):
+    ms = np.array(times) * 1000
+    return {
+        'runs': len(ms),
+        'ops_per_sec': len(ms) / ms.sum() * 1000 if ms.sum() else 0.0,
+        'mean_ms': float(ms.mean()),
+        'p50_ms': float(np.percentile(ms, 50)),
+        'p95_ms': float(np.percentile(ms, 95)),
+        'p99_ms': float(np.percentile(ms, 99)),
+    }
+
+def timed(op, runs, offset=0):
+    times = []
+    for i in range(offset, offset + runs):
+        start = time.perf_counter()
+        op(i)
+        times.append(time.perf_counter() - start)
+    return times
+
+def traced(op, runs, offset=0):
+    # Peak bytes above the starting point and net new memory blocks per run, both from tracemalloc.
+    # Tracing slows everything down, so this runs separately from the timed loops.
+    if runs <= 0:
+        return {}
+    gc.collect()
+    tracemalloc.start()
+    peaks = []
+    net_blocks = []
+    for i in range(offset, offset + runs):
+        before = tracemalloc.take_snapshot()
+        tracemalloc.reset_peak()
+        current = tracemalloc.get_traced_memory()[0]
+        op(i)
+        peaks.append(tracemalloc.get_traced_memory()[1] - current)
+        after = tracemalloc.take_snapshot()
+        net_blocks.append(sum(stat.count_diff for stat in after.compare_to(before, 'filename')))
+    tracemalloc.stop()
+    return {'peak_bytes': int(max(peaks)), 'net_blocks': float(np.mean(net_blocks))}
+
+selected_cases = args.cases.split(',')
+
+def make_cases(snapshot, users, client):
+    workouts, meals = snapshot['workouts'], snapshot['meals']
+    workout_classes, meal_classes = snapshot['workout_classes'], snapshot['meal_classes']
+    week_start = datetime(2024, 1, 1)
+
+    def user(i):
+        return users[i % len(users)]
+
+    # Inputs for the cases that start part-way through the pipeline are prepared outside the timings
+    prepared = {}
+    def picks(i):
+        key = i % len(users)
+        if key not in prepared:
+            week = plan_week(user(i), week_start, workouts, meals, workout_classes, meal_classes)
+            selected_workouts, selected_meals = week[0]
+            # The whole week is stored, as build_weekly_slots() hands it to /submit
+            meal_index = build_meal_index(selected_meals)
+            weekly_slots = {day: schedule_slots(user(i), day_workouts, day_meals, meal_index)
+                            for day, (day_workouts, day_meals) in enumerate(week)}
+            rows = storage.encode_plan(weekly_slots, snapshot['positions'])
+            prepared[key] = (selected_workouts, selected_meals, rows)
+        return prepared[key]
+
+    def recommend_workout(i):
+        recommend(user(i), workouts, 'workout', TRAINING_DAYS[i % len(TRAINING_DAYS)], [], workout_classes)
+
+    def recommend_meal(i):
+        recommend(user(i), meals, 'meal', i % 7, [], meal_classes)
+
+    def week(i):
+        plan_week(user(i), week_start, workouts, meals, workout_classes, meal_classes)
+
+    def schedule(i):
+        selected_workouts, selected_meals, _ = picks(i)
+        create_schedule(user(i), selected_workouts, selected_meals)
+
+    def submit(i):
+        response = client.post('/submit', json=user(i))
+        if response.status_code != 200:
+            raise RuntimeError(f"/submit returned {response.status_code}")
+
+    def sqlite_store(i):
+        storage.store_submission(user(i), snapshot['version'], picks(i)[2])
+
+    cases = {
+        'recommend_workout': (recommend_workout, None),
+        'recommend_meal': (recommend_meal, None),
+        'plan_week': (week, None),
+        'create_schedule': (schedule, picks),
+        'submit': (submit, None),
+        'sqlite_store': (sqlite_store, picks),
+    }
+    return {name: case for name, case in cases.items() if name in selected_cases}
+
+def run_size(size, users, app_module):
+    workouts_path, meals_path = build_catalog('workout', size), build_catalog('meal', size)
+    results = []
+
+    def record(case, mode, times, memory=None):
+        result = {'size': size, 'case': case, 'mode': mode, **percentiles(times), **(memory or {})}
+        results.append(result)
+        print(f"{size:>9} {case:<18} {mode:<5} {result['runs']:>5} {result['ops_per_sec']:>10.1f} "
+              f"{result['p50_ms']:>9.3f} {result['p95_ms']:>9.3f} {result['p99_ms']:>9.3f}"
+              + (f" {result['peak_bytes'] / 1024:>10.1f} {result['net_blocks']:>9.1f}" if memory else ''))
+
+    # Point the app at this size; the snapshot is swapped the same way a catalog reload does it
+    app_module.workouts_path, app_module.meals_path = workouts_path, meals_path
+    app_module.reload_catalog()
+    client = app_module.app.test_client()
+
+    # Cold: a freshly opened catalog (nothing parsed or cached yet) and the first call on it
+    opens = []
+    cold = {}
+    for run in range(args.cold_runs):
+        start = time.perf_counter()
+        snapshot = open_catalog(workouts_path, meals_path)
+        opens.append(time.perf_counter() - start)
+        app_module.catalog = app_module.load_snapshot()
+        if app_module.plan_cache is not None:
+            # Cached plans hold items of the previous snapshot
+            app_module.plan_cache = app_module.PlanCache(app_module.plan_cache.max_size, app_module.plan_cache.ttl)
+        storage.catalog_item.cache_clear()
+        storage._local.conn = None
+        for name, (op, prepare) in make_cases(snapshot, users, client).items():
+            if prepare:
+                prepare(run)
+            cold.setdefault(name, []).extend(timed(op, 1, run))
+    if opens:
+        record('catalog_open', 'cold', opens)
+        for name, times in cold.items():
+            record(name, 'cold', times)
+
+    # Warm: steady state on one snapshot, cycling through distinct users
+    snapshot = app_module.catalog
+    for name, (op, prepare) in make_cases(snapshot, users, client).items():
+        runs = args.warmup + args.iterations + args.memory_runs
+        if prepare:
+            for i in range(runs):
+                prepare(i)
+        timed(op, args.warmup)
+        times = timed(op, args.iterations, args.warmup)
+        record(name, 'warm', times, traced(op, args.memory_runs, args.warmup + args.iterations))
+    return results
+
+def compare(results, baseline, threshold, metrics):
+    previous = {(r['size'], r['case'], r['mode']): r for r in baseline['results']}
+    regressions = []
+    for result in results:
+        before = previous.get((result['size'], result['case'], result['mode']))
+        if before is None:
+            continue
+        for metric in metrics:
+            if not before.get(metric) or metric not in result:
+                continue
+            change = (result[metric] - before[metric]) / before[metric] * 100
+            if metric in HIGHER_IS_BETTER:
+                change = -change
+            if change > threshold:
+                regressions.append((result['size'], result['case'], result['mode'], metric, before[metric],
+                                    result[metric], change))
+    return regressions
+
+sizes = [int(size) for size in args.sizes.split(',')]
+users = GENERATORS['user']((args.seed, 0, 0, args.users, MIX))
+
+# The app reads its catalog paths at import, so the first size is in place before it is imported
+os.environ['WFB_WORKOUTS_PATH'] = build_catalog('workout', sizes[0])
+os.environ['WFB_MEALS_PATH'] = build_catalog('meal', sizes[0])
+import app as app_module
+app_module.start()
+logging.getLogger().setLevel(logging.WARNING)
+
+print(f"{'size':>9} {'case':<18} {'mode':<5} {'runs':>5} {'ops/s':>10} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} "
+      f"{'peak KiB':>10} {'blocks':>9}")
+results = []
+for size in sizes:
+    results.extend(run_size(size, users, app_module))
+
+report = {
+    'meta': {
+        'date': datetime.now().isoformat(timespec='seconds'),
+        'python': sys.version.split()[0],
+        'numpy': np.__version__,
+        'platform': platform.platform(),
+        'seed': args.seed,
+        'iterations': args.iterations,
+        'env': {name: value for name, value in os.environ.items() if name.startswith('WFB_') and name != 'WFB_ADMIN_TOKEN'},
+    },
+    'results': results,
+}
+with open(args.output, 'w') as f:
+    json.dump(report, f, indent=2)
+print(f"Wrote {len(results)} results to {args.output}.")
+
+if args.baseline:
+    with open(args.baseline, 'r') as f:
+        baseline = json.load(f)
+    regressions = compare(results, baseline, args.threshold, args.metrics.split(','))
+    for size, case, mode, metric, before, after, change in regressions:
+        print(f"REGRESSION {size} {case} {mode} {metric}: {before:.3f} -> {after:.3f} (+{change:.1f}%)")
+    print(f"{len(regressions)} regressions above {args.threshold}% against {args.baseline}.")
+    sys.exit(1 if regressions else 0)
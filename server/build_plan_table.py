@@ -0,0 +1,84 @@
+import argparse
+import random
+import sys
+from datetime import datetime, timedelta
+import numpy as np
+from catalog import open_catalog, catalog_positions
+from planner import plan_week
+from plan_table import (bucket_count, bucket_coordinates, representative_profile, encode_week, decode_week,
+                        save_plan_table, load_plan_table, lookup_week,
+                        BMI_EDGES, AGE_EDGES, WORK_EDGES)
+
+parser = argparse.ArgumentParser(description="Materialize the weekly plan for every scoring bucket.")
+parser.add_argument('--workouts', default='workouts.json')
+parser.add_argument('--meals', default='meals.json')
+parser.add_argument('--output', default='plan_table', help="Writes <output>.npy and <output>.json")
+parser.add_argument('--verify', action='store_true', help="Check an existing table against the live planner")
+parser.add_argument('--samples', type=int, default=500,
+                    help="With --verify, also plan this many random in-band profiles and compare them with the table")
+parser.add_argument('--min-agreement', type=float, default=1.0,
+                    help="With --verify, the share of sampled profiles that must get the live planner's plan "
+                         "from the table; lookups are approximate within a band, so lower it to accept that")
+parser.add_argument('--seed', type=int, default=0)
+args = parser.parse_args()
+
+catalog = open_catalog(args.workouts, args.meals)
+workouts, meals, catalog_version = catalog['workouts'], catalog['meals'], catalog['version']
+workout_classes, meal_classes = catalog['workout_classes'], catalog['meal_classes']
+
+def live_week(user_data, week_start):
+    return plan_week(user_data, week_start, workouts, meals, workout_classes, meal_classes)
+
+def picked_ids(week):
+    return [([w['id'] for w in day_workouts], [m['id'] for m in day_meals]) for day_workouts, day_meals in week]
+
+def sample_in_band(bucket, rng):
+    # A random profile from the same bucket as the representative
+    user_data, week_start = representative_profile(bucket)
+    _, _, _, bmi, age, work, _ = bucket_coordinates(bucket)
+    def between(edges, band, low, high):
+        lower = edges[band - 1] if band > 0 else low
+        upper = edges[band] if band < len(edges) else high
+        return rng.uniform(lower, upper - 1e-6)
+    user_data['weight'] = str(between(BMI_EDGES, bmi, 15, 40))
+    user_data['age'] = str(int(between(AGE_EDGES, age, 16, 80)))
+    work_end = datetime(1900, 1, 1, 9, 0) + timedelta(minutes=int(between(WORK_EDGES, work, 4, 14) * 60))
+    user_data['work_end'] = work_end.strftime('%I:%M %p')
+    return user_data, week_start
+
+if not args.verify:
+    positions = catalog_positions(workouts, meals)
+    rows = np.stack([encode_week(live_week(*representative_profile(bucket)), positions['workout'], positions['meal'])
+                     for bucket in range(bucket_count())])
+    save_plan_table(args.output, rows, catalog_version)
+    print(f"Wrote {args.output}.npy with {len(rows)} plans for catalog {catalog_version}.")
+    sys.exit(0)
+
+plan_table = load_plan_table(args.output)
+if plan_table['catalog_version'] != catalog_version:
+    print(f"Table was built for catalog {plan_table['catalog_version']}, current catalog is {catalog_version}.")
+    sys.exit(1)
+
+mismatches = 0
+for bucket in range(bucket_count()):
+    user_data, week_start = representative_profile(bucket)
+    table_week = decode_week(plan_table['rows'][bucket], workouts, meals)
+    if picked_ids(table_week) != picked_ids(live_week(user_data, week_start)):
+        mismatches += 1
+print(f"{bucket_count() - mismatches}/{bucket_count()} bucket plans match the live planner.")
+
+agreement = 1.0
+if args.samples:
+    rng = random.Random(args.seed)
+    agree = 0
+    for _ in range(args.samples):
+        user_data, week_start = sample_in_band(rng.randrange(bucket_count()), rng)
+        table_week = lookup_week(plan_table, user_data, week_start, workouts, meals)
+        agree += picked_ids(table_week) == picked_ids(live_week(user_data, week_start))
+    agreement = agree / args.samples
+    print(f"{agree}/{args.samples} random in-band profiles get the same plan from the table.")
+
+if mismatches or agreement < args.min_agreement:
+    print(f"Verification failed: {mismatches} bucket plans differ, sampled agreement {agreement:.1%} "
+          f"(minimum {args.min_agreement:.1%}).")
+    sys.exit(1)
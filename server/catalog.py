@@ -0,0 +1,442 @@
+import os
+import hashlib
+import json
+import mmap
+import shutil
+import textwrap
+import threading
+import uuid
+from collections.abc import Sequence
+import numpy as np
+
+MAJOR_MUSCLE_GROUPS = ['chest', 'back', 'legs']
+GOAL_WORKOUT_TYPES = ['strength', 'bodyweight']
+
+# Column arrays for the attributes recommend() scores on, built once per catalog load
+def build_workout_columns(workouts):
+    return {
+        'id': np.array([w['id'] for w in workouts]),
+        'type': np.array([w['type'] for w in workouts], dtype=str),
+        'intensity': np.array([w['intensity'] for w in workouts], dtype=str),
+        'calories_burned': np.array([w['calories_burned'] for w in workouts], dtype=float),
+        'duration_minutes': np.array([w.get('duration_minutes', 20) for w in workouts], dtype=float),
+        'sets': np.array([w['sets'] for w in workouts], dtype=float),
+        'split': np.array([w['split'] for w in workouts], dtype=str),
+        'muscle_group': np.array([w['muscle_group'] for w in workouts], dtype=str),
+    }
+
+def build_meal_columns(meals):
+    return {
+        'id': np.array([m['id'] for m in meals]),
+        'type': np.array([m['type'] for m in meals], dtype=str),
+        'protein': np.array([m['protein'] for m in meals], dtype=float),
+        'calories': np.array([m['calories'] for m in meals], dtype=float),
+        'prep_time_minutes': np.array([m.get('prep_time_minutes', 30) for m in meals], dtype=float),
+    }
+
+def _codes(values):
+    return np.unique(values, return_inverse=True)[1]
+
+# Items whose attributes fall on the same side of every scoring threshold get identical
+# feature vectors, so scoring runs once per signature class instead of once per item
+def workout_signatures(columns):
+    intensity = np.where(columns['intensity'] == 'high', 0, np.where(columns['intensity'] == 'medium', 1, 2))
+    return np.column_stack([
+        np.isin(columns['type'], GOAL_WORKOUT_TYPES),
+        intensity,
+        columns['calories_burned'] > 150,
+        columns['duration_minutes'] <= 30,
+        np.isin(columns['muscle_group'], MAJOR_MUSCLE_GROUPS),
+        _codes(columns['split']),
+        columns['sets'] >= 3,
+    ]).astype(np.int64)
+
+def meal_signatures(columns):
+    return np.column_stack([
+        columns['protein'] >= 15,
+        columns['protein'] >= 25,
+        columns['protein'] > 20,
+        columns['calories'] < 600,
+        columns['prep_time_minutes'] <= 20,
+        _codes(columns['type']),
+    ]).astype(np.int64)
+
+def build_classes(columns, signatures):
+    n = len(columns['id'])
+    if n == 0:
+        return {'class_columns': columns, 'inverse': np.zeros(0, dtype=np.int64), 'members': [],
+                'id_order': np.zeros(0, dtype=np.int64), 'sorted_ids': columns['id']}
+    _, first, inverse = np.unique(signatures, axis=0, return_index=True, return_inverse=True)
+    inverse = inverse.reshape(-1)
+    by_class = np.argsort(inverse, kind='stable')
+    id_order = np.argsort(columns['id'], kind='stable')
+    return {
+        # One representative row per class; it scores exactly like every other member
+        'class_columns': {name: values[first] for name, values in columns.items()},
+        'inverse': inverse,
+        'members': np.split(by_class, np.cumsum(np.bincount(inverse))[:-1]),
+        'id_order': id_order,
+        'sorted_ids': columns['id'][id_order],
+    }
+
+def build_workout_classes(columns):
+    return build_classes(columns, workout_signatures(columns))
+
+def build_meal_classes(columns):
+    return build_classes(columns, meal_signatures(columns))
+
+def build_columns(items, item_type):
+    if item_type == 'workout':
+        return build_workout_columns(items)
+    return build_meal_columns(items)
+
+def build_item_classes(items, item_type):
+    if item_type == 'workout':
+        return build_workout_classes(build_workout_columns(items))
+    return build_meal_classes(build_meal_columns(items))
+
+def positions_for_ids(classes, ids):
+    if not ids or len(classes['id_order']) == 0:
+        return np.zeros(0, dtype=np.int64)
+    sorted_ids = classes['sorted_ids']
+    wanted = np.array(sorted(ids))
+    lo = np.searchsorted(sorted_ids, wanted, side='left')
+    hi = np.searchsorted(sorted_ids, wanted, side='right')
+    return np.sort(np.concatenate([classes['id_order'][a:b] for a, b in zip(lo, hi)]))
+
+def top_k_by_class(classes, similarities, k=3, penalized_positions=(), penalized_similarities=None):
+    # Best k items given one similarity per class. Items at penalized_positions score with
+    # their class's penalized similarity instead; ties keep catalog order.
+    penalized = set(int(p) for p in penalized_positions)
+    candidate_positions = []
+    for members in classes['members']:
+        taken = 0
+        for position in members:
+            if taken == k:
+                break
+            if int(position) not in penalized:
+                candidate_positions.append(position)
+                taken += 1
+    candidate_positions = np.array(candidate_positions, dtype=np.int64)
+    candidate_scores = similarities[classes['inverse'][candidate_positions]]
+    if penalized:
+        penalized_positions = np.array(sorted(penalized), dtype=np.int64)
+        candidate_positions = np.concatenate([candidate_positions, penalized_positions])
+        candidate_scores = np.concatenate([candidate_scores,
+                                           penalized_similarities[classes['inverse'][penalized_positions]]])
+    order = np.lexsort((candidate_positions, -candidate_scores))[:k]
+    return candidate_positions[order]
+
+FALLBACK_MEAL_TYPES = ['main course', 'breakfast', 'snack']
+
+# Meals that carry a purpose, partitioned by (meal_type, diet) and sorted by calories so a
+# slot's calorie window is a range query. Positions refer back to the indexed list, and the
+# lowest matching position wins, the same meal a first-match scan would pick.
+def build_meal_index(meals):
+    positions_by_key = {}
+    for position, m in enumerate(meals):
+        if 'purpose' in m:
+            positions_by_key.setdefault((m.get('meal_type'), m.get('type')), []).append(position)
+
+    partitions = {}
+    for key, positions in positions_by_key.items():
+        calories = np.array([meals[p]['calories'] for p in positions], dtype=float)
+        order = np.argsort(calories, kind='stable')
+        partitions[key] = {
+            'positions': np.array(positions)[order],
+            'calories': calories[order],
+            'protein': np.array([meals[p]['protein'] for p in positions], dtype=float)[order],
+            'carbs': np.array([meals[p]['carbs'] for p in positions], dtype=float)[order],
+            'first': positions[0],
+        }
+
+    fallback = [positions[0] for key, positions in positions_by_key.items() if key[0] in FALLBACK_MEAL_TYPES]
+    return {'meals': meals, 'partitions': partitions, 'fallback': min(fallback) if fallback else None}
+
+def find_meal(meal_index, meal_type, diet, calories, protein, carbs):
+    meals = meal_index['meals']
+    partition = meal_index['partitions'].get((meal_type, diet))
+    if partition is not None:
+        lo = np.searchsorted(partition['calories'], calories - 150, side='left')
+        hi = np.searchsorted(partition['calories'], calories + 150, side='right')
+        in_window = ((np.abs(partition['protein'][lo:hi] - protein) <= 15) &
+                     (np.abs(partition['carbs'][lo:hi] - carbs) <= 30))
+        if in_window.any():
+            return meals[partition['positions'][lo:hi][in_window].min()]
+        return meals[partition['first']]
+    if meal_index['fallback'] is not None:
+        return meals[meal_index['fallback']]
+    return meals[0]
+
+# Columnar catalog format: a directory per catalog holding the scoring columns as .npy arrays
+# (string columns as category codes), the precomputed signature classes, and every item's
+# full JSON record in one blob indexed by offsets. Everything is memory-mapped, so worker
+# processes share the pages and only the items actually returned are ever parsed.
+COLUMNAR_FORMAT = 1
+CATEGORICAL_COLUMNS = {'workout': ['type', 'intensity', 'split', 'muscle_group'], 'meal': ['type']}
+
+def _staging_path(path):
+    # A hidden sibling of path, on the same filesystem so it can be renamed over path
+    parent, name = os.path.split(os.path.abspath(path))
+    return os.path.join(parent, f".{name}.{uuid.uuid4().hex[:12]}")
+
+def publish_columnar(version_path, path):
+    # Makes path a symlink to the finished catalog directory version_path in one os.replace, so
+    # readers see the old catalog or the new one and never a partly written one. The files of the
+    # previous version are unlinked, not rewritten: processes that have them mapped keep their pages.
+    parent, name = os.path.split(os.path.abspath(path))
+    link = version_path + '.link'
+    os.symlink(os.path.basename(version_path), link)
+    if os.path.isdir(path) and not os.path.islink(path):
+        # A catalog directory written before catalogs were published through a link
+        os.replace(path, _staging_path(path))
+    os.replace(link, path)
+    for entry in os.listdir(parent):
+        old = os.path.join(parent, entry)
+        if entry.startswith(f".{name}.") and old != version_path and os.path.isdir(old) and not os.path.islink(old):
+            shutil.rmtree(old, ignore_errors=True)
+
+class ColumnarCatalogWriter:
+    # Streams items into a columnar catalog in batches. Records go straight to records.bin and
+    # only the compact scoring columns are kept until close(), which writes them together with
+    # the signature classes. String columns are coded per batch and remapped to sorted
+    # categories at the end, so the result does not depend on how the items were batched.
+    # Everything is written to a new directory that close() publishes at path (publish_columnar).
+    def __init__(self, path, item_type):
+        self.path = path
+        self._version_path = _staging_path(path)
+        os.makedirs(self._version_path)
+        self.item_type = item_type
+        self.count = 0
+        self._columns = {}
+        self._categories = {name: {} for name in CATEGORICAL_COLUMNS[item_type]}
+        self._offsets = [np.zeros(1, dtype=np.int64)]
+        self._size = 0
+        self._digest = hashlib.sha1()
+        self._records = open(os.path.join(self._version_path, 'records.bin'), 'wb')
+
+    def write(self, items):
+        if not items:
+            return
+        for name, values in build_columns(items, self.item_type).items():
+            if name in self._categories:
+                seen = self._categories[name]
+                uniques, codes = np.unique(values, return_inverse=True)
+                lookup = np.array([seen.setdefault(value, len(seen)) for value in uniques.tolist()], dtype=np.int32)
+                values = lookup[codes]
+            self._columns.setdefault(name, []).append(values)
+        records = [json.dumps(item).encode('utf-8') for item in items]
+        blob = b''.join(records)
+        self._records.write(blob)
+        self._digest.update(blob)
+        self._offsets.append(self._size + np.cumsum([len(r) for r in records]))
+        self._size += len(blob)
+        self.count += len(items)
+
+    def close(self):
+        self._records.close()
+        np.save(os.path.join(self._version_path, 'records.offsets.npy'), np.concatenate(self._offsets))
+        empty = build_columns([], self.item_type)
+        columns = {name: np.concatenate(self._columns[name]) if self.count else values
+                   for name, values in empty.items()}
+        meta = {'format': COLUMNAR_FORMAT, 'kind': self.item_type, 'count': self.count, 'numeric': [],
+                'categorical': {}, 'digest': self._digest.hexdigest()}
+        for name, values in columns.items():
+            if name in self._categories:
+                categories = sorted(self._categories[name])
+                rank = {value: i for i, value in enumerate(categories)}
+                remap = np.array([rank[value] for value in self._categories[name]], dtype=np.int32)
+                codes = remap[values] if self.count else values.astype(np.int32)
+                meta['categorical'][name] = categories
+                np.save(os.path.join(self._version_path, f"{name}.npy"), codes)
+                # Strings again for the class signatures
+                columns[name] = np.array(categories, dtype=str)[codes] if self.count else values
+            else:
+                meta['numeric'].append(name)
+                np.save(os.path.join(self._version_path, f"{name}.npy"), values)
+
+        if self.count:
+            build = build_workout_classes if self.item_type == 'workout' else build_meal_classes
+            classes = build(columns)
+            np.save(os.path.join(self._version_path, 'classes.inverse.npy'), classes['inverse'])
+            np.save(os.path.join(self._version_path, 'classes.order.npy'), np.concatenate(classes['members']))
+            np.save(os.path.join(self._version_path, 'classes.counts.npy'), np.array([len(m) for m in classes['members']]))
+            np.save(os.path.join(self._version_path, 'classes.id_order.npy'), classes['id_order'])
+        with open(os.path.join(self._version_path, 'meta.json'), 'w') as f:
+            json.dump(meta, f)
+        publish_columnar(self._version_path, self.path)
+
+class JsonCatalogWriter:
+    # Streams items as a JSON list laid out exactly like json.dump(items, f, indent=2),
+    # or as JSON lines (one item per line) when lines=True. Items go to a temporary file
+    # that close() renames over path, so a reader never sees a partly written catalog.
+    def __init__(self, path, lines=False):
+        self.path = path
+        self.lines = lines
+        self.count = 0
+        self._temp_path = _staging_path(path)
+        self._f = open(self._temp_path, 'w')
+        if not lines:
+            self._f.write('[')
+
+    def write(self, items):
+        for item in items:
+            if self.lines:
+                self._f.write(json.dumps(item) + '\n')
+            else:
+                self._f.write(('\n' if self.count == 0 else ',\n') + textwrap.indent(json.dumps(item, indent=2), '  '))
+            self.count += 1
+
+    def close(self):
+        if not self.lines:
+            self._f.write('\n]' if self.count else ']')
+        self._f.close()
+        os.replace(self._temp_path, self.path)
+
+def load_json_items(raw, path):
+    # A JSON list, or JSON lines for catalogs written with JsonCatalogWriter(lines=True)
+    if path.endswith('.jsonl'):
+        return [json.loads(line) for line in raw.splitlines() if line.strip()]
+    return json.loads(raw)
+
+class ColumnarItems(Sequence):
+    # Read-only list of catalog items backed by the records blob. Indexing parses one record
+    # and keeps it, so the same position always returns the same dict; positions maps those
+    # dicts back to their catalog position. Iterating parses without keeping anything.
+    def __init__(self, path, count):
+        self._count = count
+        self._offsets = np.load(os.path.join(path, 'records.offsets.npy'), mmap_mode='r')
+        self._records = b''
+        if self._offsets[-1] > 0:
+            with open(os.path.join(path, 'records.bin'), 'rb') as f:
+                self._records = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        self._items = {}
+        self.positions = {}
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return self._count
+
+    def record(self, position):
+        return self._records[int(self._offsets[position]):int(self._offsets[position + 1])]
+
+    def __getitem__(self, position):
+        if isinstance(position, slice):
+            return [self[i] for i in range(*position.indices(self._count))]
+        position = int(position)
+        if position < 0:
+            position += self._count
+        if not 0 <= position < self._count:
+            raise IndexError('catalog position out of range')
+        item = self._items.get(position)
+        if item is None:
+            # The position is recorded before the item becomes visible to other threads
+            with self._lock:
+                item = self._items.get(position)
+                if item is None:
+                    item = json.loads(self.record(position))
+                    self.positions[id(item)] = position
+                    self._items[position] = item
+        return item
+
+    def __iter__(self):
+        for position in range(self._count):
+            yield json.loads(self.record(position))
+
+def open_columnar_catalog(path):
+    # Resolved once, so every file comes from the same published version
+    path = os.path.realpath(path)
+    with open(os.path.join(path, 'meta.json'), 'r') as f:
+        meta = json.load(f)
+    if meta['format'] != COLUMNAR_FORMAT:
+        raise ValueError(f"{path} uses columnar format {meta['format']}, expected {COLUMNAR_FORMAT}")
+
+    def column(name):
+        return np.load(os.path.join(path, f"{name}.npy"), mmap_mode='r')
+
+    items = ColumnarItems(path, meta['count'])
+    if meta['count'] == 0:
+        return items, build_item_classes([], meta['kind']), meta['digest']
+    counts = np.load(os.path.join(path, 'classes.counts.npy'))
+    order = column('classes.order')
+    members = np.split(order, np.cumsum(counts)[:-1])
+    # Class representatives are the first member of each class
+    first = np.array([m[0] for m in members])
+    class_columns = {name: np.asarray(column(name)[first]) for name in meta['numeric']}
+    for name, categories in meta['categorical'].items():
+        class_columns[name] = np.array(categories, dtype=str)[column(name)[first]]
+    id_order = column('classes.id_order')
+    classes = {
+        'class_columns': class_columns,
+        'inverse': column('classes.inverse'),
+        'members': members,
+        'id_order': id_order,
+        'sorted_ids': np.asarray(column('id')[id_order]),
+    }
+    return items, classes, meta['digest']
+
+def catalog_fingerprint(path):
+    # Cheap change check (inode, mtime and size) done before a catalog is read again. The writers
+    # publish with a rename, so this only changes once a new catalog is complete.
+    target = os.path.join(path, 'meta.json') if os.path.isdir(path) else path
+    stat = os.stat(target)
+    return [stat.st_ino, stat.st_mtime_ns, stat.st_size]
+
+def item_positions(items):
+    # Maps id() of the item dicts the planner hands out back to their catalog position
+    if isinstance(items, ColumnarItems):
+        return items.positions
+    return {id(item): i for i, item in enumerate(items)}
+
+def catalog_positions(workouts, meals):
+    return {'workout': item_positions(workouts), 'meal': item_positions(meals)}
+
+def open_catalog(workouts_path, meals_path, previous=None):
+    # Builds an immutable catalog snapshot: items, signature classes and position maps for
+    # both catalogs plus a version id. Either path may be a JSON list, a .jsonl file or a
+    # columnar catalog directory. Given the previous snapshot, a catalog whose file is unchanged
+    # (or changed on disk but has the same digest) is reused as is instead of being re-read and
+    # re-indexed.
+    snapshot = {'paths': {'workout': workouts_path, 'meal': meals_path},
+                'fingerprints': {}, 'digests': {}, 'positions': {}}
+    for kind, path in (('workout', workouts_path), ('meal', meals_path)):
+        fingerprint = catalog_fingerprint(path)
+        reuse = (previous is not None and previous['paths'][kind] == path and
+                 previous['fingerprints'][kind] == fingerprint)
+        if not reuse:
+            if os.path.isdir(path):
+                items, classes, digest = open_columnar_catalog(path)
+            else:
+                with open(path, 'rb') as f:
+                    raw = f.read()
+                digest = hashlib.sha1(raw).hexdigest()
+                items = None
+            # Same content under a new fingerprint: keep the previous item objects, since plans
+            # cached for this version hold references to them
+            if previous is not None and previous['digests'][kind] == digest:
+                reuse = True
+            elif items is None:
+                items = load_json_items(raw, path)
+                classes = build_item_classes(items, kind)
+        if reuse:
+            items, classes, digest = previous[f"{kind}s"], previous[f"{kind}_classes"], previous['digests'][kind]
+            positions = previous['positions'][kind]
+        else:
+            positions = item_positions(items)
+        snapshot[f"{kind}s"] = items
+        snapshot[f"{kind}_classes"] = classes
+        snapshot['fingerprints'][kind] = fingerprint
+        snapshot['digests'][kind] = digest
+        snapshot['positions'][kind] = positions
+    # Derived from both digests, so anything built from one catalog (cached plans, plan
+    # tables, stored plan references) can tell when it no longer applies
+    snapshot['version'] = hashlib.sha1((snapshot['digests']['workout'] + snapshot['digests']['meal']).encode()).hexdigest()[:12]
+    return snapshot
+
+def catalog_changed(snapshot):
+    try:
+        return any(catalog_fingerprint(path) != snapshot['fingerprints'][kind]
+                   for kind, path in snapshot['paths'].items())
+    except OSError:
+        # Mid-replace; look again on the next check
+        return False
@@ -0,0 +1,74 @@
+import json
+import os
+import pytest
+import storage
+from catalog import ColumnarCatalogWriter
+from planner import plan_week, create_schedule
+from generate_datasets import GENERATORS, parse_mix, splits, intensities, meal_types, diet_types, goals
+
+MIX = {'split': parse_mix('', splits), 'intensity': parse_mix('', intensities),
+       'meal_type': parse_mix('', meal_types), 'diet': parse_mix('', diet_types), 'goal': parse_mix('', goals)}
+SEED = 7
+
+def generate(kind, count, seed=SEED):
+    items = GENERATORS[kind]((seed, 0, 0, count, MIX))
+    if kind == 'meal':
+        # Only meals with a purpose can be scheduled into a slot by type and calories
+        for item in items[::2]:
+            item['purpose'] = f"{item['meal_type'].capitalize()} for the day"
+    return items
+
+def fresh_plan(app, user_id):
+    # The week a new submission of the stored profile gets, planned from scratch
+    user = storage.load_user(user_id)
+    user_data, snapshot = user['user_data'], app.catalog
+    week = plan_week(user_data, user['week_start'], snapshot['workouts'], snapshot['meals'])
+    return json.loads(json.dumps({day: create_schedule(user_data, workouts, meals)
+                                  for day, (workouts, meals) in enumerate(week)}))
+
+def stored_plan(client, user_id):
+    response = client.get(f'/plan/{user_id}')
+    assert response.status_code == 200
+    return response.get_json()['schedule']
+
+@pytest.fixture(scope='session')
+def catalogs(tmp_path_factory):
+    # Small seeded catalogs as JSON and as columnar directories
+    path = tmp_path_factory.mktemp('catalogs')
+    items = {'workout': generate('workout', 600), 'meal': generate('meal', 400)}
+    paths = {}
+    for kind, kind_items in items.items():
+        paths[kind] = str(path / f'{kind}s.json')
+        with open(paths[kind], 'w') as f:
+            json.dump(kind_items, f)
+        paths[f'{kind}_columnar'] = str(path / f'{kind}s.wfb')
+        writer = ColumnarCatalogWriter(paths[f'{kind}_columnar'], kind)
+        writer.write(kind_items)
+        writer.close()
+    return {'items': items, 'paths': paths}
+
+@pytest.fixture
+def users():
+    return generate('user', 40)
+
+@pytest.fixture
+def server(catalogs, tmp_path, monkeypatch):
+    # The app started against the JSON catalogs and a scratch database; settings are read by
+    # start(), so a test sets WFB_* variables before asking for this fixture
+    import app
+    monkeypatch.setattr(storage, 'DB_PATH', str(tmp_path / 'test.sqlite'))
+    monkeypatch.setattr(storage._local, 'conn', None, raising=False)
+    monkeypatch.setattr(app, 'workouts_path', catalogs['paths']['workout'])
+    monkeypatch.setattr(app, 'meals_path', catalogs['paths']['meal'])
+    monkeypatch.setenv('WFB_CATALOG_WATCH_SECONDS', '0')
+    for name in ('catalog', 'write_queue', 'plan_jobs', 'cohort_planner'):
+        monkeypatch.setattr(app, name, None)
+    if app.plan_cache is not None:
+        monkeypatch.setattr(app, 'plan_cache', app.PlanCache(app.plan_cache.max_size, app.plan_cache.ttl))
+    storage.catalog_item.cache_clear()
+    app.start()
+    yield app
+    for worker in (app.plan_jobs, app.write_queue, app.cohort_planner):
+        if worker is not None:
+            worker.close()
+    storage.get_db_connection().close()
@@ -0,0 +1,64 @@
+import re
+from collections import deque
+from multiprocessing import Pool
+import pandas as pd
+
+# Shared helpers for the chunked dataset converters (convert_workouts.py, convert_meals.py)
+
+def read_csv_chunks(path, chunksize=0):
+    # 0 reads the whole file as one chunk. Chunks keep the file's row numbers as their index.
+    if not chunksize:
+        yield pd.read_csv(path)
+        return
+    yield from pd.read_csv(path, chunksize=chunksize)
+
+def read_excel_chunks(path, chunksize=0):
+    if not chunksize:
+        yield pd.read_excel(path)
+        return
+    # pandas cannot read a workbook in pieces, so stream the rows with openpyxl
+    from openpyxl import load_workbook
+    workbook = load_workbook(path, read_only=True, data_only=True)
+    try:
+        rows = workbook.active.iter_rows(values_only=True)
+        header = next(rows, None)
+        start = 0
+        batch = []
+        for row in rows:
+            batch.append(row)
+            if len(batch) == chunksize:
+                yield pd.DataFrame(batch, columns=header, index=range(start, start + len(batch)))
+                start += len(batch)
+                batch = []
+        if batch:
+            yield pd.DataFrame(batch, columns=header, index=range(start, start + len(batch)))
+    finally:
+        workbook.close()
+
+def map_chunks(convert, chunks, workers=1):
+    # Converts chunks in input order, so the output does not depend on the worker count. At
+    # most two chunks per worker are in flight, which keeps memory bounded on any input size.
+    if workers <= 1:
+        for chunk in chunks:
+            yield convert(chunk)
+        return
+    with Pool(workers) as pool:
+        pending = deque()
+        for chunk in chunks:
+            pending.append(pool.apply_async(convert, (chunk,)))
+            if len(pending) >= 2 * workers:
+                yield pending.popleft().get()
+        while pending:
+            yield pending.popleft().get()
+
+def text(values, default=''):
+    # Missing values replaced by default; works on chunks where a column is entirely empty
+    return values.astype(object).where(values.notna(), default).astype(str)
+
+def contains_any(values, words):
+    return values.str.contains('|'.join(re.escape(word) for word in words), regex=True)
+
+def records(columns, keys):
+    # Plain dicts with native Python values, keys in the given order
+    lists = [columns[key].tolist() for key in keys]
+    return [dict(zip(keys, row)) for row in zip(*lists)]
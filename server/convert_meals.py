@@ -1,53 +1,76 @@
-import pandas as pd
-import json
+import argparse
+import numpy as np
+from pandas.api.types import is_numeric_dtype
+from catalog import JsonCatalogWriter, ColumnarCatalogWriter
+from conversion import read_excel_chunks, map_chunks, text, contains_any, records
 
-df = pd.read_excel('IndianFoodDatasetXLS.xlsx')
+VEGETARIAN_DIETS = ['vegetarian', 'diabetic friendly', 'eggitarian', 'vegan']
+COURSES = {'main course': 'main course', 'starter': 'snack', 'dessert': 'snack', 'side dish': 'main course'}
+LIGHT_COURSES = ['breakfast', 'snack']
+MAIN_COURSES = ['main course', 'lunch', 'dinner']
+# (calories, protein, carbs, fat, purpose) for non-vegetarian then vegetarian meals,
+# each as light course, main course, anything else
+NUTRITION = [
+    (400, 20, 45, 15, 'Moderate for energy'),
+    (650, 35, 70, 20, 'High-protein for recovery'),
+    (450, 25, 50, 18, 'Balanced for sustenance'),
+    (350, 10, 50, 10, 'High-carb for energy'),
+    (500, 20, 60, 15, 'Balanced for sustenance'),
+    (400, 15, 55, 12, 'Moderate for energy'),
+]
+MEAL_KEYS = ['id', 'name', 'type', 'calories', 'protein', 'carbs', 'fat', 'meal_type', 'prep_time_minutes',
+             'instructions', 'purpose']
 
-def assign_nutrition(diet, course):
-    diet = diet.lower() if isinstance(diet, str) else 'non-vegetarian'
-    course = course.lower() if isinstance(course, str) else 'main course'
-    is_vegetarian = any(v in diet for v in ['vegetarian', 'diabetic friendly', 'eggitarian', 'vegan'])
-    diet_type = 'vegetarian' if is_vegetarian else 'non-vegetarian'
-    if diet_type == 'vegetarian':
-        if course in ['breakfast', 'snack']:
-            return {'calories': 350, 'protein': 10, 'carbs': 50, 'fat': 10, 'purpose': 'High-carb for energy'}
-        elif course in ['main course', 'lunch', 'dinner']:
-            return {'calories': 500, 'protein': 20, 'carbs': 60, 'fat': 15, 'purpose': 'Balanced for sustenance'}
-        else:
-            return {'calories': 400, 'protein': 15, 'carbs': 55, 'fat': 12, 'purpose': 'Moderate for energy'}
-    else:
-        if course in ['main course', 'lunch', 'dinner']:
-            return {'calories': 650, 'protein': 35, 'carbs': 70, 'fat': 20, 'purpose': 'High-protein for recovery'}
-        elif course in ['breakfast', 'snack']:
-            return {'calories': 400, 'protein': 20, 'carbs': 45, 'fat': 15, 'purpose': 'Moderate for energy'}
-        else:
-            return {'calories': 450, 'protein': 25, 'carbs': 50, 'fat': 18, 'purpose': 'Balanced for sustenance'}
+def assign_nutrition(vegetarian, courses):
+    courses = text(courses, 'main course')
+    row = np.asarray(vegetarian) * 3 + np.select([courses.isin(LIGHT_COURSES), courses.isin(MAIN_COURSES)], [0, 1], 2)
+    return {key: np.array([n[i] for n in NUTRITION])[row]
+            for i, key in enumerate(['calories', 'protein', 'carbs', 'fat', 'purpose'])}
 
-df = df.dropna(subset=['TranslatedRecipeName', 'Diet', 'Course'])
-df['Diet'] = df['Diet'].str.lower()
-df['Course'] = df['Course'].str.lower().replace({'main course': 'main course', 'starter': 'snack', 'dessert': 'snack', 'side dish': 'main course'})
-df = df[df['TranslatedRecipeName'].str.len() > 3]
-df = df[df['TotalTimeInMins'].apply(lambda x: pd.isna(x) or (isinstance(x, (int, float)) and 5 <= x <= 120))]
+def valid_time(minutes):
+    # Missing, or a number of minutes between 5 and 120; text such as "30 mins" is dropped
+    if is_numeric_dtype(minutes):
+        return minutes.isna() | minutes.between(5, 120)
+    numbers = minutes.map(lambda x: isinstance(x, (int, float)))
+    return minutes.isna() | (numbers & minutes.where(numbers).astype(float).between(5, 120))
 
-meals = []
-for idx, row in df.iterrows():
-    nutrition = assign_nutrition(row['Diet'], row['Course'])
-    meal = {
-        'id': int(row['Srno']),
-        'name': row['TranslatedRecipeName'],
-        'type': 'vegetarian' if any(v in row['Diet'].lower() for v in ['vegetarian', 'diabetic friendly', 'eggitarian', 'vegan']) else 'non-vegetarian',
-        'calories': nutrition['calories'],
-        'protein': nutrition['protein'],
-        'carbs': nutrition['carbs'],
-        'fat': nutrition['fat'],
-        'meal_type': row['Course'],
-        'prep_time_minutes': int(row['TotalTimeInMins']) if pd.notna(row['TotalTimeInMins']) else 30,
-        'instructions': row['TranslatedInstructions'] if pd.notna(row['TranslatedInstructions']) else 'Follow standard recipe.',
-        'purpose': nutrition['purpose']
+def convert_chunk(chunk):
+    chunk = chunk.dropna(subset=['TranslatedRecipeName', 'Diet', 'Course'])
+    chunk = chunk[chunk['TranslatedRecipeName'].str.len() > 3]
+    chunk = chunk[valid_time(chunk['TotalTimeInMins'])]
+    course = chunk['Course'].str.lower().replace(COURSES)
+    vegetarian = contains_any(chunk['Diet'].str.lower(), VEGETARIAN_DIETS)
+    columns = {
+        'id': chunk['Srno'].astype(int),
+        'name': chunk['TranslatedRecipeName'],
+        'type': np.where(vegetarian, 'vegetarian', 'non-vegetarian'),
+        'meal_type': course,
+        'prep_time_minutes': chunk['TotalTimeInMins'].astype(float).fillna(30).astype(int),
+        'instructions': text(chunk['TranslatedInstructions'], 'Follow standard recipe.'),
+        **assign_nutrition(vegetarian, course),
     }
-    meals.append(meal)
+    return records(columns, MEAL_KEYS)
 
-with open('meals.json', 'w') as f:
-    json.dump(meals, f, indent=2)
+def convert(args):
+    writers = [JsonCatalogWriter(args.output, lines=args.output.endswith('.jsonl'))]
+    if args.columnar:
+        # Memory-mapped columnar copy for the server (WFB_MEALS_PATH=meals.wfb)
+        writers.append(ColumnarCatalogWriter(args.columnar, 'meal'))
+    count = 0
+    for batch in map_chunks(convert_chunk, read_excel_chunks(args.input, args.chunksize), args.workers):
+        for writer in writers:
+            writer.write(batch)
+        count += len(batch)
+    for writer in writers:
+        writer.close()
+    print(f"Generated {args.output} with {count} entries.")
 
-print(f"Generated meals.json with {len(meals)} entries.")
\ No newline at end of file
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Convert the Indian food dataset into the meal catalog.")
+    parser.add_argument('--input', default='IndianFoodDatasetXLS.xlsx')
+    parser.add_argument('--output', default='meals.json', help="A .jsonl output is written as JSON lines")
+    parser.add_argument('--columnar', default='meals.wfb', help="Columnar catalog directory; empty to skip it")
+    parser.add_argument('--chunksize', type=int, default=0,
+                        help="Rows read and converted at a time; 0 reads the workbook at once")
+    parser.add_argument('--workers', type=int, default=1, help="Processes converting chunks in parallel")
+    convert(parser.parse_args())
@@ -1,80 +1,120 @@
+import argparse
+import numpy as np
 import pandas as pd
-import json
+from catalog import JsonCatalogWriter, ColumnarCatalogWriter
+from conversion import read_csv_chunks, map_chunks, text, contains_any, records
 
-# Load datasets
-exercise_df = pd.read_csv('exercises.csv')
-mega_df = pd.read_csv('megaGymDataset.csv')
+PUSH_PARTS = ['chest', 'shoulders', 'triceps']
+PULL_PARTS = ['back', 'biceps']
+LEGS_PARTS = ['quads', 'hamstrings', 'glutes', 'calves']
+HIGH_INTENSITY_NAMES = ['squat', 'deadlift', 'bench', 'press', 'pull-up']
+HIGH_INTENSITY_PARTS = ['chest', 'back', 'legs']
+INSTRUCTION_COLUMNS = [f'instructions/{i}' for i in range(11)]
+WORKOUT_KEYS = ['id', 'name', 'type', 'muscle_group', 'split', 'equipment', 'calories_burned',
+                'duration_minutes', 'sets', 'reps', 'intensity', 'instructions', 'youtube_link']
 
-# Function to map body part to split
-def assign_split(body_part):
-    push = ['chest', 'shoulders', 'triceps']
-    pull = ['back', 'biceps']
-    legs = ['quads', 'hamstrings', 'glutes', 'calves']
-    body_part = body_part.lower() if isinstance(body_part, str) else ''
-    if any(part in body_part for part in push):
-        return 'push'
-    elif any(part in body_part for part in pull):
-        return 'pull'
-    elif any(part in body_part for part in legs):
-        return 'legs'
-    return 'push'
+# Map body parts to splits
+def assign_split(body_parts):
+    body_parts = text(body_parts).str.lower()
+    return np.select([contains_any(body_parts, PUSH_PARTS), contains_any(body_parts, PULL_PARTS),
+                      contains_any(body_parts, LEGS_PARTS)], ['push', 'pull', 'legs'], 'push')
 
-# Clean datasets
-exercise_df = exercise_df.dropna(subset=['name', 'bodyPart'])
-mega_df = mega_df.dropna(subset=['Title', 'BodyPart'])
-
-# Process exercises.csv
-workouts = []
-for idx, row in exercise_df.iterrows():
-    instructions = [row[f'instructions/{i}'] for i in range(11) if pd.notna(row[f'instructions/{i}'])]
-    name = row['name'].lower() if pd.notna(row['name']) else ''
-    body_part = row['bodyPart'].lower() if pd.notna(row['bodyPart']) else ''
-    intensity = 'high' if any(kw in name for kw in ['squat', 'deadlift', 'bench', 'press', 'pull-up']) or \
-                         any(bp in body_part for bp in ['chest', 'back', 'legs']) else 'medium'
-    workout = {
-        'id': int(row['id']),
-        'name': row['name'],
-        'type': 'strength',
-        'muscle_group': row['bodyPart'],
-        'split': assign_split(row['bodyPart']),
-        'equipment': row['equipment'] if pd.notna(row['equipment']) else 'none',
-        'calories_burned': 200 if intensity == 'high' else 150,
-        'duration_minutes': 20 if intensity == 'high' else 15,
-        'sets': 4 if intensity == 'high' else 3,
-        'reps': '6-8' if intensity == 'high' else '8-12',
+def effort(intensity, instructions):
+    high = np.asarray(intensity == 'high')
+    return {
+        'calories_burned': np.where(high, 200, 150),
+        'duration_minutes': np.where(high, 20, 15),
+        'sets': np.where(high, 4, 3),
+        'reps': np.where(high, '6-8', '8-12'),
         'intensity': intensity,
-        'instructions': f"{' '.join(instructions)} Use 70-80% 1RM, rest {90 if intensity == 'high' else 60}s.",
-        'youtube_link': row['gifUrl'] if pd.notna(row['gifUrl']) else ''
+        'instructions': instructions + np.where(high, ' Use 70-80% 1RM, rest 90s.', ' Use 70-80% 1RM, rest 60s.'),
     }
-    if len(workout['name']) > 3:
-        workouts.append(workout)
 
-# Process megaGymDataset.csv
-seen_names = {w['name'].lower() for w in workouts}
-for idx, row in mega_df.iterrows():
-    name = row['Title']
-    if name.lower() not in seen_names:
-        intensity = row['Level'].lower() if pd.notna(row['Level']) else 'medium'
-        workout = {
-            'id': len(workouts) + idx + 1,
-            'name': name,
-            'type': row['Type'].lower() if pd.notna(row['Type']) else 'strength',
-            'muscle_group': row['BodyPart'].lower() if pd.notna(row['BodyPart']) else 'unknown',
-            'split': assign_split(row['BodyPart']),
-            'equipment': row['Equipment'].lower() if pd.notna(row['Equipment']) else 'none',
-            'calories_burned': 200 if intensity == 'high' else 150,
-            'duration_minutes': 20 if intensity == 'high' else 15,
-            'sets': 4 if intensity == 'high' else 3,
-            'reps': '6-8' if intensity == 'high' else '8-12',
-            'intensity': intensity,
-            'instructions': f"{row['Desc'] if pd.notna(row['Desc']) else 'Perform with proper form.'} Use 70-80% 1RM, rest {90 if intensity == 'high' else 60}s.",
-            'youtube_link': ''
-        }
-        if len(workout['name']) > 3:
-            workouts.append(workout)
+def join_instructions(chunk):
+    # ' '.join() of the steps that are present, column by column
+    joined = text(chunk[INSTRUCTION_COLUMNS[0]])
+    started = chunk[INSTRUCTION_COLUMNS[0]].notna()
+    for column in INSTRUCTION_COLUMNS[1:]:
+        present = chunk[column].notna()
+        joined = joined.where(~present, (joined + ' ').where(started, '') + text(chunk[column]))
+        started |= present
+    return joined
+
+# Process a chunk of exercises.csv
+def convert_exercises(chunk):
+    chunk = chunk.dropna(subset=['name', 'bodyPart'])
+    chunk = chunk[chunk['name'].str.len() > 3]
+    high = (contains_any(chunk['name'].str.lower(), HIGH_INTENSITY_NAMES) |
+            contains_any(chunk['bodyPart'].str.lower(), HIGH_INTENSITY_PARTS))
+    intensity = pd.Series(np.where(high, 'high', 'medium'), index=chunk.index)
+    columns = {
+        'id': chunk['id'].astype(int),
+        'name': chunk['name'],
+        'type': np.full(len(chunk), 'strength'),
+        'muscle_group': chunk['bodyPart'],
+        'split': assign_split(chunk['bodyPart']),
+        'equipment': text(chunk['equipment'], 'none'),
+        'youtube_link': text(chunk['gifUrl']),
+        **effort(intensity, join_instructions(chunk)),
+    }
+    return records(columns, WORKOUT_KEYS)
+
+# Process a chunk of megaGymDataset.csv. Ids are the row number + 1 here; convert() offsets
+# them by the number of workouts ahead of the row once it knows which titles are duplicates.
+def convert_mega(chunk):
+    chunk = chunk.dropna(subset=['Title', 'BodyPart'])
+    chunk = chunk[chunk['Title'].str.len() > 3]
+    intensity = text(chunk['Level'], 'medium').str.lower()
+    columns = {
+        'id': chunk.index + 1,
+        'name': chunk['Title'],
+        'type': text(chunk['Type'], 'strength').str.lower(),
+        'muscle_group': text(chunk['BodyPart']).str.lower(),
+        'split': assign_split(chunk['BodyPart']),
+        'equipment': text(chunk['Equipment'], 'none').str.lower(),
+        'youtube_link': np.full(len(chunk), ''),
+        **effort(intensity, text(chunk['Desc'], 'Perform with proper form.')),
+    }
+    return records(columns, WORKOUT_KEYS)
+
+def convert(args):
+    writers = [JsonCatalogWriter(args.output, lines=args.output.endswith('.jsonl'))]
+    if args.columnar:
+        # Memory-mapped columnar copy for the server (WFB_WORKOUTS_PATH=workouts.wfb)
+        writers.append(ColumnarCatalogWriter(args.columnar, 'workout'))
+
+    def write(batch):
+        for writer in writers:
+            writer.write(batch)
+
+    count = 0
+    seen_names = set()
+    for batch in map_chunks(convert_exercises, read_csv_chunks(args.exercises, args.chunksize), args.workers):
+        write(batch)
+        seen_names.update(w['name'].lower() for w in batch)
+        count += len(batch)
+
+    # megaGymDataset.csv only adds titles that exercises.csv does not already have
+    for batch in map_chunks(convert_mega, read_csv_chunks(args.mega, args.chunksize), args.workers):
+        kept = []
+        for workout in batch:
+            if workout['name'].lower() not in seen_names:
+                workout['id'] += count
+                kept.append(workout)
+                count += 1
+        write(kept)
 
-# Save to workouts.json
-with open('workouts.json', 'w') as f:
-    json.dump(workouts, f, indent=2)
+    for writer in writers:
+        writer.close()
+    print(f"Generated {args.output} with {count} entries.")
 
-print(f"Generated workouts.json with {len(workouts)} entries.")
\ No newline at end of file
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Convert exercises.csv and megaGymDataset.csv into the workout catalog.")
+    parser.add_argument('--exercises', default='exercises.csv')
+    parser.add_argument('--mega', default='megaGymDataset.csv')
+    parser.add_argument('--output', default='workouts.json', help="A .jsonl output is written as JSON lines")
+    parser.add_argument('--columnar', default='workouts.wfb', help="Columnar catalog directory; empty to skip it")
+    parser.add_argument('--chunksize', type=int, default=0,
+                        help="Rows read and converted at a time; 0 reads each file at once")
+    parser.add_argument('--workers', type=int, default=1, help="Processes converting chunks in parallel")
+    convert(parser.parse_args())
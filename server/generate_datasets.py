@@ -1,5 +1,10 @@
-import json
-import random
+import argparse
+import os
+from datetime import datetime, timedelta
+from multiprocessing import Pool
+import numpy as np
+from catalog import JsonCatalogWriter, ColumnarCatalogWriter
+from conversion import map_chunks
 
 # Workout attributes
 workout_templates = [
@@ -37,55 +42,228 @@ meal_templates = [
 meal_types = ["breakfast", "lunch", "dinner"]
 diet_types = ["vegetarian", "non-vegetarian"]
 
-# Generate workouts
-workouts = []
-for i in range(1, 201):
-    base = random.choice(workout_templates)
-    muscle = random.choice(muscle_groups)
-    split = random.choice(splits)
-    equip = random.choice(equipment)
-    intensity = random.choice(intensities)
-    workout = {
-        "id": i,
-        "name": f"{base['name']} Variation {i}" if i > len(workout_templates) else base['name'],
-        "type": random.choice(types),
-        "muscle_group": muscle,
-        "split": split,
-        "equipment": equip,
-        "calories_burned": base['calories_burned'] + random.randint(-20, 20),
-        "duration_minutes": base['duration_minutes'] + random.randint(-5, 5),
-        "sets": random.randint(2, 4),
-        "reps": random.choice(["8-12", "10-15", "12-20", "failure"]),
-        "intensity": intensity,
-        "instructions": base['instructions'],
-        "youtube_link": base['youtube_link']
+# User profile attributes, in the form the client posts them to /submit
+genders = ["male", "female"]
+goals = ["fitness", "weight loss", "general"]
+
+# Items are generated in blocks, each from its own generator seeded with (seed, kind, block),
+# so the output depends only on the seed and the counts, not on the number of workers or shards
+BLOCK_SIZE = 10000
+KINDS = ["workout", "meal", "user"]
+
+def parse_mix(spec, values):
+    # "push=2,pull=1" -> probabilities over values; unlisted values get weight 0, no spec is uniform
+    if not spec:
+        return np.full(len(values), 1 / len(values))
+    weights = np.zeros(len(values))
+    for part in spec.split(","):
+        name, _, weight = part.partition("=")
+        if name.strip() not in values:
+            raise argparse.ArgumentTypeError(f"{name.strip()!r} is not one of {', '.join(values)}")
+        weights[values.index(name.strip())] = float(weight or 1)
+    if weights.sum() <= 0:
+        raise argparse.ArgumentTypeError(f"{spec!r} gives every value weight 0")
+    return weights / weights.sum()
+
+def block_rng(seed, kind, block):
+    return np.random.default_rng([seed, KINDS.index(kind), block])
+
+def generate_workouts(task):
+    seed, block, start, count, mix = task
+    rng = block_rng(seed, "workout", block)
+    picks = {
+        "base": rng.integers(len(workout_templates), size=count),
+        "muscle": rng.integers(len(muscle_groups), size=count),
+        "split": rng.choice(len(splits), size=count, p=mix["split"]),
+        "equipment": rng.integers(len(equipment), size=count),
+        "intensity": rng.choice(len(intensities), size=count, p=mix["intensity"]),
+        "type": rng.integers(len(types), size=count),
+        "calories": rng.integers(-20, 21, size=count),
+        "duration": rng.integers(-5, 6, size=count),
+        "sets": rng.integers(2, 5, size=count),
+        "reps": rng.choice(["8-12", "10-15", "12-20", "failure"], size=count),
     }
-    workouts.append(workout)
-
-# Generate meals
-meals = []
-for i in range(1, 201):
-    base = random.choice(meal_templates)
-    meal_type = random.choice(meal_types)
-    diet = random.choice(diet_types)
-    meal = {
-        "id": i,
-        "name": f"{base['name']} Variation {i}" if i > len(meal_templates) else base['name'],
-        "type": diet,
-        "calories": base['calories'] + random.randint(-50, 50),
-        "protein": base['protein'] + random.randint(-5, 5),
-        "carbs": base['carbs'] + random.randint(-10, 10),
-        "fat": base['fat'] + random.randint(-5, 5),
-        "meal_type": meal_type,
-        "prep_time_minutes": base['prep_time_minutes'] + random.randint(-5, 5),
-        "instructions": base['instructions']
+    picks = {name: values.tolist() for name, values in picks.items()}
+    workouts = []
+    for j in range(count):
+        i = start + j + 1
+        base = workout_templates[picks["base"][j]]
+        workouts.append({
+            "id": i,
+            "name": f"{base['name']} Variation {i}" if i > len(workout_templates) else base['name'],
+            "type": types[picks["type"][j]],
+            "muscle_group": muscle_groups[picks["muscle"][j]],
+            "split": splits[picks["split"][j]],
+            "equipment": equipment[picks["equipment"][j]],
+            "calories_burned": base['calories_burned'] + picks["calories"][j],
+            "duration_minutes": base['duration_minutes'] + picks["duration"][j],
+            "sets": picks["sets"][j],
+            "reps": picks["reps"][j],
+            "intensity": intensities[picks["intensity"][j]],
+            "instructions": base['instructions'],
+            "youtube_link": base['youtube_link']
+        })
+    return workouts
+
+def generate_meals(task):
+    seed, block, start, count, mix = task
+    rng = block_rng(seed, "meal", block)
+    picks = {
+        "base": rng.integers(len(meal_templates), size=count),
+        "meal_type": rng.choice(len(meal_types), size=count, p=mix["meal_type"]),
+        "diet": rng.choice(len(diet_types), size=count, p=mix["diet"]),
+        "calories": rng.integers(-50, 51, size=count),
+        "protein": rng.integers(-5, 6, size=count),
+        "carbs": rng.integers(-10, 11, size=count),
+        "fat": rng.integers(-5, 6, size=count),
+        "prep_time": rng.integers(-5, 6, size=count),
+    }
+    picks = {name: values.tolist() for name, values in picks.items()}
+    meals = []
+    for j in range(count):
+        i = start + j + 1
+        base = meal_templates[picks["base"][j]]
+        meals.append({
+            "id": i,
+            "name": f"{base['name']} Variation {i}" if i > len(meal_templates) else base['name'],
+            "type": diet_types[picks["diet"][j]],
+            "calories": base['calories'] + picks["calories"][j],
+            "protein": base['protein'] + picks["protein"][j],
+            "carbs": base['carbs'] + picks["carbs"][j],
+            "fat": base['fat'] + picks["fat"][j],
+            "meal_type": meal_types[picks["meal_type"][j]],
+            "prep_time_minutes": base['prep_time_minutes'] + picks["prep_time"][j],
+            "instructions": base['instructions']
+        })
+    return meals
+
+def clock(minutes):
+    return (datetime(1900, 1, 1) + timedelta(minutes=minutes)).strftime('%I:%M %p')
+
+def generate_users(task):
+    # /submit bodies: heights and BMIs roughly follow adult populations, work starts between
+    # 6 and 11 AM and lasts 4-13 hours, and lunch falls within an hour of mid-shift
+    seed, block, start, count, mix = task
+    rng = block_rng(seed, "user", block)
+    gender = rng.integers(len(genders), size=count)
+    height = np.round(rng.normal(np.where(gender == 0, 176, 163), 7).clip(145, 205))
+    bmi = rng.normal(25, 4.5, size=count).clip(16, 42)
+    work_start = 6 * 60 + 15 * rng.integers(0, 21, size=count)
+    work_minutes = 15 * np.round(rng.normal(8.5, 1.5, size=count).clip(4, 13) * 4).astype(int)
+    picks = {
+        "gender": gender,
+        "height": height.astype(int),
+        "weight": np.round(bmi * (height / 100) ** 2, 1),
+        "age": np.round(rng.normal(35, 11, size=count).clip(16, 75)).astype(int),
+        "work_start": work_start,
+        "work_end": work_start + work_minutes,
+        "lunch_time": work_start + 15 * (work_minutes // 30 + rng.integers(-4, 5, size=count)),
+        "diet": rng.choice(len(diet_types), size=count, p=mix["diet"]),
+        "goal": rng.choice(len(goals), size=count, p=mix["goal"]),
     }
-    meals.append(meal)
+    picks = {name: values.tolist() for name, values in picks.items()}
+    users = []
+    for j in range(count):
+        users.append({
+            "age": str(picks["age"][j]),
+            "weight": str(picks["weight"][j]),
+            "height": str(picks["height"][j]),
+            "gender": genders[picks["gender"][j]],
+            "diet": diet_types[picks["diet"][j]],
+            "goal": goals[picks["goal"][j]],
+            "work_start": clock(picks["work_start"][j]),
+            "work_end": clock(picks["work_end"][j]),
+            "lunch_time": clock(picks["lunch_time"][j])
+        })
+    return users
+
+GENERATORS = {"workout": generate_workouts, "meal": generate_meals, "user": generate_users}
+
+def blocks(seed, total, mix):
+    # (seed, block, start, count, mix) tasks covering a total-item output
+    for block in range(-(-total // BLOCK_SIZE)):
+        start = block * BLOCK_SIZE
+        yield seed, block, start, min(BLOCK_SIZE, total - start), mix
+
+def write_shard(task):
+    # Items first..last of the output; blocks straddling the shard edges are generated whole
+    # and trimmed, so every item is the same as in the unsharded output
+    kind, path, seed, total, mix, first, last = task
+    writer = JsonCatalogWriter(path, lines=True)
+    for block in range(first // BLOCK_SIZE, -(-last // BLOCK_SIZE)):
+        start = block * BLOCK_SIZE
+        items = GENERATORS[kind]((seed, block, start, min(BLOCK_SIZE, total - start), mix))
+        writer.write(items[max(first - start, 0):last - start])
+    writer.close()
+    return path, writer.count
+
+def write_sharded(kind, base, seed, total, mix, shards, workers):
+    # Each shard is written by one worker; concatenating the shards in order gives exactly
+    # the single-file .jsonl output
+    tasks = [(kind, f"{base}-{shard:05d}-of-{shards:05d}.jsonl", seed, total, mix,
+              shard * total // shards, (shard + 1) * total // shards) for shard in range(shards)]
+    with Pool(min(workers, shards)) as pool:
+        return pool.map(write_shard, tasks)
+
+def write_single(kind, path, columnar, seed, total, mix, workers):
+    writers = [JsonCatalogWriter(path, lines=path.endswith(".jsonl"))]
+    if columnar:
+        writers.append(ColumnarCatalogWriter(columnar, kind))
+    for items in map_chunks(GENERATORS[kind], blocks(seed, total, mix), workers):
+        for writer in writers:
+            writer.write(items)
+    for writer in writers:
+        writer.close()
+    return [(path, writers[0].count)]
+
+def main():
+    parser = argparse.ArgumentParser(description="Generate seeded synthetic catalogs and /submit user profiles.")
+    parser.add_argument("--workouts", type=int, default=200, help="Number of workouts")
+    parser.add_argument("--meals", type=int, default=200, help="Number of meals")
+    parser.add_argument("--users", type=int, default=0, help="Number of user profiles, written to users.jsonl")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output-dir", default=".")
+    parser.add_argument("--format", choices=["json", "jsonl"], default="json", help="Catalog file format")
+    parser.add_argument("--columnar", action=argparse.BooleanOptionalAction, default=True,
+                        help="Also write the memory-mapped .wfb catalogs (not with --shards)")
+    parser.add_argument("--shards", type=int, default=1,
+                        help="Split every output into this many .jsonl files, written in parallel")
+    parser.add_argument("--workers", type=int, default=1, help="Processes generating blocks in parallel")
+    parser.add_argument("--split-mix", default="", help="Weights such as push=2,pull=1,legs=1; uniform by default")
+    parser.add_argument("--intensity-mix", default="", help="Weights over low, medium, high")
+    parser.add_argument("--meal-type-mix", default="", help="Weights over breakfast, lunch, dinner")
+    parser.add_argument("--diet-mix", default="", help="Weights over vegetarian, non-vegetarian, for meals and users")
+    parser.add_argument("--goal-mix", default="", help="Weights over fitness, weight loss, general")
+    args = parser.parse_args()
+
+    try:
+        mix = {
+            "split": parse_mix(args.split_mix, splits),
+            "intensity": parse_mix(args.intensity_mix, intensities),
+            "meal_type": parse_mix(args.meal_type_mix, meal_types),
+            "diet": parse_mix(args.diet_mix, diet_types),
+            "goal": parse_mix(args.goal_mix, goals),
+        }
+    except argparse.ArgumentTypeError as e:
+        parser.error(str(e))
+
+    os.makedirs(args.output_dir, exist_ok=True)
+    outputs = []
+    for kind, total, name in (("workout", args.workouts, "workouts"), ("meal", args.meals, "meals"),
+                              ("user", args.users, "users")):
+        if kind == "user" and not total:
+            continue
+        base = os.path.join(args.output_dir, name)
+        if args.shards > 1:
+            outputs += write_sharded(kind, base, args.seed, total, mix, args.shards, args.workers)
+        else:
+            # Memory-mapped columnar copies for the server (WFB_WORKOUTS_PATH/WFB_MEALS_PATH)
+            columnar = f"{base}.wfb" if args.columnar and kind != "user" else None
+            extension = "jsonl" if kind == "user" else args.format
+            outputs += write_single(kind, f"{base}.{extension}", columnar, args.seed, total, mix, args.workers)
 
-# Save to files
-with open("workouts.json", "w") as f:
-    json.dump(workouts, f, indent=2)
-with open("meals.json", "w") as f:
-    json.dump(meals, f, indent=2)
+    for path, count in outputs:
+        print(f"Generated {path} with {count} entries.")
 
-print("Generated workouts.json and meals.json with ~200 entries each.")
\ No newline at end of file
+if __name__ == "__main__":
+    main()
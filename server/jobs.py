@@ -0,0 +1,310 @@
+import asyncio
+import logging
+import multiprocessing
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, Future, wait, FIRST_COMPLETED
+from catalog import open_catalog, build_meal_index
+from planner import plan_week, schedule_slots
+from storage import (encode_plan, save_catalog, store_submission, insert_submissions, get_db_connection,
+                     retry_busy)
+
+logger = logging.getLogger(__name__)
+
+EXECUTORS = ['thread', 'process', 'asyncio']
+# Finished submissions remembered in memory for status checks; older ones are looked up in the database
+KEEP_FINISHED = 4096
+
+def week_rows(user_data, week_start, snapshot, days=range(7), used_workouts=()):
+    # encode_plan() rows for the given days of the week, planned against snapshot
+    workouts, meals = snapshot['workouts'], snapshot['meals']
+    week = plan_week(user_data, week_start, workouts, meals, snapshot['workout_classes'], snapshot['meal_classes'],
+                     days=days, used_workouts=used_workouts)
+    meal_index = build_meal_index(week[0][1])
+    weekly_slots = {day: schedule_slots(user_data, selected_workouts, selected_meals, meal_index)
+                    for day, (selected_workouts, selected_meals) in zip(days, week)}
+    return encode_plan(weekly_slots, snapshot['positions'])
+
+def complete_week(task, snapshot):
+    # Plans the days the request left out, then stores the user and the whole week. task['rows'] are
+    # the encode_plan() rows already built for the first days, against snapshot's catalog version.
+    # Returns the user id, the catalog version and the week's rows.
+    rows = list(task['rows'])
+    planned = {row[0] for row in rows}
+    if len(planned) < 7:
+        workouts = snapshot['workouts']
+        used = {workouts[row[4]]['id'] for row in rows if row[3] == 'workout'}
+        rows.extend(week_rows(task['user_data'], task['week_start'], snapshot,
+                              range(max(planned) + 1 if planned else 0, 7), used))
+    user_id = retry_busy(lambda: store_submission(task['user_data'], task['catalog_version'], rows, task['key'],
+                                                  task['week_start']))
+    return user_id, task['catalog_version'], rows
+
+def plan_weeks(tasks, week_start, snapshot):
+    # [(key, user_data)] -> [(key, rows)] with whole weeks of encode_plan() rows
+    return [(key, week_rows(user_data, week_start, snapshot)) for key, user_data in tasks]
+
+# Process workers open the catalog themselves (columnar catalogs share their pages). The last
+# WORKER_SNAPSHOTS versions a worker opened are kept, so tasks planned before a reload still
+# complete on their version once the files on disk hold the next one.
+WORKER_SNAPSHOTS = 2
+_worker = {'paths': None, 'snapshots': OrderedDict()}
+
+def _init_worker(workouts_path, meals_path):
+    _worker['paths'] = (workouts_path, meals_path)
+
+def _worker_snapshot(catalog_version):
+    # The snapshot for catalog_version if the worker has it, else the catalog now on disk
+    snapshots = _worker['snapshots']
+    snapshot = snapshots.get(catalog_version)
+    if snapshot is None:
+        previous = snapshots[next(reversed(snapshots))] if snapshots else None
+        snapshot = open_catalog(*_worker['paths'], previous=previous)
+        if snapshot['version'] not in snapshots:
+            save_catalog(snapshot['version'], snapshot['workouts'], snapshot['meals'])
+            snapshots[snapshot['version']] = snapshot
+    snapshots.move_to_end(snapshot['version'])
+    while len(snapshots) > WORKER_SNAPSHOTS:
+        snapshots.popitem(last=False)
+    return snapshots[snapshot['version']]
+
+def _complete_in_worker(task):
+    snapshot = _worker_snapshot(task['catalog_version'])
+    if snapshot['version'] != task['catalog_version']:
+        # The first days were planned on a catalog this worker can no longer open, so the
+        # whole week is planned again on the current one
+        logger.info("Submission %s planned on catalog %s is completed on %s", task['key'],
+                    task['catalog_version'], snapshot['version'])
+        task = dict(task, catalog_version=snapshot['version'], rows=[])
+    return complete_week(task, snapshot)
+
+def _plan_weeks_in_worker(tasks, week_start, catalog_version):
+    snapshot = _worker_snapshot(catalog_version)
+    if snapshot['version'] != catalog_version:
+        raise RuntimeError(f"Catalog is now {snapshot['version']}, request was planned on {catalog_version}")
+    return plan_weeks(tasks, week_start, snapshot)
+
+def worker_pool(workers, catalog_paths):
+    # spawn, not fork: the server already runs threads. Spawned workers import the main module
+    # again, so it must not load catalogs or start workers at import (see app.start()).
+    return ProcessPoolExecutor(workers, mp_context=multiprocessing.get_context('spawn'),
+                               initializer=_init_worker, initargs=catalog_paths)
+
+class PlanJobsFull(Exception):
+    pass
+
+class PlanJobs:
+    # Completes submitted weeks in the background. Jobs are keyed by submission key; submitting a key
+    # that is pending or done returns the existing job, and a failed one is started again.
+    # on_complete(task, catalog_version, rows) is called with each week stored.
+    def __init__(self, executor='thread', workers=4, max_pending=1024, catalog_paths=None, on_complete=None):
+        if executor not in EXECUTORS:
+            raise ValueError(f"Unknown executor {executor!r}; expected one of {', '.join(EXECUTORS)}")
+        self.executor = executor
+        self.on_complete = on_complete
+        self.max_pending = max_pending
+        self.pending = 0
+        self.completed = 0
+        self.failed = 0
+        self._jobs = OrderedDict()
+        self._futures = set()
+        self._lock = threading.Lock()
+        self._loop = None
+        if executor == 'process':
+            self._pool = worker_pool(workers, catalog_paths)
+        else:
+            self._pool = ThreadPoolExecutor(workers, thread_name_prefix='wfb-plan')
+        if executor == 'asyncio':
+            self._loop = asyncio.new_event_loop()
+            threading.Thread(target=self._loop.run_forever, name='wfb-plan-loop', daemon=True).start()
+
+    def submit(self, key, task, snapshot, schedule):
+        # schedule is the first day as returned to the client, kept for repeated submissions
+        with self._lock:
+            state = self._jobs.get(key)
+            if state is not None and state['status'] != 'failed':
+                return dict(state)
+            if self.pending >= self.max_pending:
+                raise PlanJobsFull(f"{self.pending} submissions already waiting to be completed")
+            state = self._jobs[key] = {'status': 'pending', 'user_id': None, 'error': None, 'schedule': schedule}
+            self._jobs.move_to_end(key)
+            self.pending += 1
+        try:
+            if self.executor == 'process':
+                future = self._pool.submit(_complete_in_worker, task)
+            elif self.executor == 'asyncio':
+                future = asyncio.run_coroutine_threadsafe(self._complete_async(task, snapshot), self._loop)
+            else:
+                future = self._pool.submit(complete_week, task, snapshot)
+        except Exception as e:
+            with self._lock:
+                state.update(status='failed', error=str(e))
+                self.failed += 1
+                self.pending -= 1
+            raise
+        with self._lock:
+            self._futures.add(future)
+        future.add_done_callback(lambda f: self._finish(key, task, state, f))
+        return dict(state)
+
+    async def _complete_async(self, task, snapshot):
+        return await self._loop.run_in_executor(self._pool, complete_week, task, snapshot)
+
+    def _finish(self, key, task, state, future):
+        with self._lock:
+            self._futures.discard(future)
+        try:
+            user_id, catalog_version, rows = future.result()
+        except Exception as e:
+            logger.error("Completing submission %s failed: %s", key, e)
+            with self._lock:
+                state.update(status='failed', error=str(e))
+                self.failed += 1
+                self.pending -= 1
+            return
+        # Before the job reads as complete, so a client that saw it finish finds the week cached
+        if self.on_complete is not None:
+            try:
+                self.on_complete(task, catalog_version, rows)
+            except Exception:
+                logger.exception("Handling completed submission %s failed", key)
+        with self._lock:
+            state.update(status='complete', user_id=user_id)
+            self.completed += 1
+            self.pending -= 1
+            excess = len(self._jobs) - self.max_pending - KEEP_FINISHED
+            if excess > 0:
+                for old_key in [k for k, s in self._jobs.items() if s['status'] != 'pending'][:excess]:
+                    del self._jobs[old_key]
+
+    def status(self, key):
+        with self._lock:
+            state = self._jobs.get(key)
+            return dict(state) if state is not None else None
+
+    def close(self):
+        # Waits for submitted jobs to finish
+        with self._lock:
+            futures = list(self._futures)
+        wait(futures)
+        self._pool.shutdown(wait=True)
+        if self._loop is not None:
+            self._loop.call_soon_threadsafe(self._loop.stop)
+
+class CohortPlanner:
+    # Plans and stores a batch of profiles. Profiles with the same plan key get the same week, so each
+    # key is planned once; unique keys are planned chunk_size at a time in worker processes (in the
+    # calling thread when workers is 0), and users are written batch_size per transaction.
+    def __init__(self, workers=0, chunk_size=16, batch_size=1000, catalog_paths=None):
+        self.chunk_size = chunk_size
+        self.batch_size = batch_size
+        # Chunks in flight per run; enough to keep every worker busy while results are written
+        self.max_chunks = max(workers, 1) * 4
+        self.planned = 0
+        self.written = 0
+        self.failed = 0
+        self._pool = worker_pool(workers, catalog_paths) if workers > 0 else None
+
+    def _plan(self, chunk, week_start, snapshot):
+        if self._pool is not None:
+            return self._pool.submit(_plan_weeks_in_worker, chunk, week_start, snapshot['version'])
+        future = Future()
+        try:
+            future.set_result(plan_weeks(chunk, week_start, snapshot))
+        except Exception as e:
+            future.set_exception(e)
+        return future
+
+    def _write(self, batch, catalog_version, week_start):
+        conn = get_db_connection()
+        def commit():
+            with conn:
+                return insert_submissions(conn, [(user_data, catalog_version, rows, None, week_start)
+                                                 for _, user_data, rows in batch])
+        try:
+            user_ids = retry_busy(commit)
+        except Exception as e:
+            logger.exception("Storing %d cohort users failed", len(batch))
+            self.failed += len(batch)
+            return [{'index': index, 'error': str(e)} for index, _, _ in batch]
+        self.written += len(batch)
+        return [{'index': index, 'user_id': user_id} for (index, _, _), user_id in zip(batch, user_ids)]
+
+    def run(self, profiles, week_start, snapshot, plan_key):
+        # profiles yields (index, user_data, error). Yields {'index', 'user_id'} or {'index', 'error'}
+        # per profile as its transaction commits, then a summary.
+        waiting = {}  # plan key -> [(index, user_data)] whose week is being planned
+        planned = {}  # plan key -> rows
+        ready = []    # (index, user_data, rows) to store
+        failed = []
+        futures = {}  # future -> plan keys in its chunk
+        chunk = []
+        count = 0
+
+        def collect(done):
+            for future in done:
+                keys = futures.pop(future)
+                try:
+                    results = future.result()
+                except Exception as e:
+                    logger.error("Planning %d cohort profiles failed: %s", len(keys), e)
+                    for key in keys:
+                        failed.extend({'index': index, 'error': str(e)} for index, _ in waiting.pop(key))
+                    continue
+                self.planned += len(results)
+                for key, rows in results:
+                    planned[key] = rows
+                    ready.extend((index, user_data, rows) for index, user_data in waiting.pop(key))
+
+        def drain():
+            # Profiles whose chunk failed, then full batches of planned ones
+            self.failed += len(failed)
+            yield from failed
+            failed.clear()
+            while len(ready) >= self.batch_size:
+                yield from self._write(ready[:self.batch_size], snapshot['version'], week_start)
+                del ready[:self.batch_size]
+
+        def dispatch():
+            # A copy, since the pool pickles its arguments after submit() returns
+            tasks = list(chunk)
+            chunk.clear()
+            futures[self._plan(tasks, week_start, snapshot)] = [key for key, _ in tasks]
+
+        for index, user_data, error in profiles:
+            count += 1
+            if error is None:
+                try:
+                    key = plan_key(user_data)
+                except (ValueError, TypeError, AttributeError, ZeroDivisionError) as e:
+                    error = f"Invalid profile: {e}"
+            if error is not None:
+                self.failed += 1
+                yield {'index': index, 'error': error}
+                continue
+            if key in planned:
+                ready.append((index, user_data, planned[key]))
+            elif key in waiting:
+                waiting[key].append((index, user_data))
+            else:
+                waiting[key] = [(index, user_data)]
+                chunk.append((key, user_data))
+                if len(chunk) >= self.chunk_size:
+                    if len(futures) >= self.max_chunks:
+                        collect(wait(futures, return_when=FIRST_COMPLETED).done)
+                    dispatch()
+            collect([future for future in futures if future.done()])
+            yield from drain()
+
+        if chunk:
+            dispatch()
+        while futures:
+            collect(wait(futures, return_when=FIRST_COMPLETED).done)
+            yield from drain()
+        if ready:
+            yield from self._write(ready, snapshot['version'], week_start)
+        yield {'done': True, 'profiles': count, 'plans': len(planned)}
+
+    def close(self):
+        if self._pool is not None:
+            self._pool.shutdown(wait=True)
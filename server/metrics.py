@@ -0,0 +1,145 @@
+import bisect
+import cProfile
+import os
+import random
+import threading
+import time
+
+# In-process counters and histograms rendered in the Prometheus text format. Values that
+# already live elsewhere (catalog size, cache statistics) are read by collectors at scrape time.
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+
+_lock = threading.Lock()
+_metrics = []
+_collectors = []
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+def _labels(names, values, extra=''):
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+def _number(value):
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+class Counter:
+    def __init__(self, name, help_text, labelnames=()):
+        self.name = name
+        self.help_text = help_text
+        self.labelnames = labelnames
+        self._values = {}
+        _metrics.append(self)
+
+    def inc(self, *labels, amount=1):
+        with _lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.help_text}', f'# TYPE {self.name} counter']
+        with _lock:
+            values = sorted(self._values.items())
+        for labels, value in values:
+            lines.append(f'{self.name}{_labels(self.labelnames, labels)} {_number(value)}')
+        return lines
+
+class Histogram:
+    def __init__(self, name, help_text, labelnames=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help_text = help_text
+        self.labelnames = labelnames
+        self.buckets = buckets
+        # labels -> [per-bucket counts with a final +Inf bucket, sum of observations]
+        self._series = {}
+        _metrics.append(self)
+
+    def observe(self, value, *labels):
+        index = bisect.bisect_left(self.buckets, value)
+        with _lock:
+            series = self._series.get(labels)
+            if series is None:
+                series = self._series[labels] = [[0] * (len(self.buckets) + 1), 0.0]
+            series[0][index] += 1
+            series[1] += value
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.help_text}', f'# TYPE {self.name} histogram']
+        with _lock:
+            series = sorted((labels, (list(counts), total)) for labels, (counts, total) in self._series.items())
+        for labels, (counts, total) in series:
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float('inf'),), counts):
+                cumulative += count
+                le = 'le="+Inf"' if bound == float('inf') else f'le="{bound!r}"'
+                lines.append(f'{self.name}_bucket{_labels(self.labelnames, labels, le)} {cumulative}')
+            lines.append(f'{self.name}_sum{_labels(self.labelnames, labels)} {_number(total)}')
+            lines.append(f'{self.name}_count{_labels(self.labelnames, labels)} {cumulative}')
+        return lines
+
+def register_collector(collect):
+    # collect() returns (name, type, help, [(labels dict, value), ...]) tuples read at scrape time
+    _collectors.append(collect)
+
+def render():
+    lines = []
+    for metric in _metrics:
+        lines.extend(metric.render())
+    for collect in _collectors:
+        for name, kind, help_text, samples in collect():
+            lines.extend([f'# HELP {name} {help_text}', f'# TYPE {name} {kind}'])
+            for labels, value in samples:
+                lines.append(f'{name}{_labels(list(labels), list(labels.values()))} {_number(value)}')
+    return '\n'.join(lines) + '\n'
+
+STAGE_SECONDS = Histogram('wfb_stage_seconds', 'Time spent in each planning stage', ('stage',))
+
+class Span:
+    # with Span('meal_scoring'): ... records the block's wall time under that stage
+    __slots__ = ('stage', 'start')
+
+    def __init__(self, stage):
+        self.stage = stage
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        STAGE_SECONDS.observe(time.perf_counter() - self.start, self.stage)
+
+class RequestProfiler:
+    # Profiles a random sample of requests with cProfile and keeps the profile of any that ran
+    # longer than slow_seconds as <directory>/<endpoint>-<timestamp>-<n>-<ms>ms.prof. One request
+    # is profiled at a time, since the interpreter supports a single active profiler.
+    def __init__(self, sample_rate, slow_seconds, directory):
+        self.sample_rate = sample_rate
+        self.slow_seconds = slow_seconds
+        self.directory = directory
+        self.dumped = 0
+        self._busy = threading.Lock()
+
+    def start(self):
+        if random.random() >= self.sample_rate or not self._busy.acquire(blocking=False):
+            return None
+        profiler = cProfile.Profile()
+        profiler.enable()
+        return profiler
+
+    def stop(self, profiler, name, elapsed):
+        profiler.disable()
+        try:
+            if elapsed >= self.slow_seconds:
+                os.makedirs(self.directory, exist_ok=True)
+                safe_name = ''.join(c if c.isalnum() else '_' for c in name).strip('_') or 'request'
+                self.dumped += 1
+                path = os.path.join(self.directory, f"{safe_name}-{time.strftime('%Y%m%dT%H%M%S')}-"
+                                                    f"{self.dumped}-{int(elapsed * 1000)}ms.prof")
+                profiler.dump_stats(path)
+                return path
+        finally:
+            self._busy.release()
+        return None
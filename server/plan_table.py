@@ -0,0 +1,96 @@
+import json
+from bisect import bisect_right
+from datetime import datetime, timedelta
+import numpy as np
+from planner import user_profile
+
+# Axes of the materialized plan table. The user vector is continuous in BMI, age and
+# work duration, so a band's plan is exact only at its representative value; lookups
+# elsewhere in the band are an approximation of the live planner.
+GOALS = ['fitness', 'other']
+GENDERS = ['male', 'other']
+DIETS = ['vegetarian', 'non-vegetarian']
+BMI_EDGES = [18.5, 22, 25, 27.5, 30]
+BMI_REPRESENTATIVES = [17, 20.25, 23.5, 26.25, 28.75, 32]
+AGE_EDGES = [25, 35, 40, 50]
+AGE_REPRESENTATIVES = [20, 30, 37, 45, 55]
+WORK_EDGES = [6, 8, 10, 12]
+WORK_REPRESENTATIVES = [5, 7, 9, 11, 13]
+WEEKDAYS = 7
+
+AXES = [len(GOALS), len(GENDERS), len(DIETS), len(BMI_REPRESENTATIVES), len(AGE_REPRESENTATIVES),
+        len(WORK_REPRESENTATIVES), WEEKDAYS]
+# Per bucket: 3 workout positions for each of the 7 days, then the 3 meal positions (-1 = empty)
+ROW_WIDTH = 7 * 3 + 3
+
+def bucket_count():
+    return int(np.prod(AXES))
+
+def bucket_coordinates(bucket):
+    return [int(c) for c in np.unravel_index(bucket, AXES)]
+
+def bucket_index(profile, weekday):
+    if profile['diet'] not in DIETS:
+        return None
+    coordinates = [
+        0 if profile['goal'] == 'fitness' else 1,
+        0 if profile['gender'] == 'male' else 1,
+        DIETS.index(profile['diet']),
+        bisect_right(BMI_EDGES, profile['bmi']),
+        bisect_right(AGE_EDGES, profile['age']),
+        bisect_right(WORK_EDGES, profile['work_duration']),
+        weekday,
+    ]
+    return int(np.ravel_multi_index(coordinates, AXES))
+
+def representative_profile(bucket):
+    goal, gender, diet, bmi, age, work, weekday = bucket_coordinates(bucket)
+    work_start = datetime(1900, 1, 1, 9, 0)
+    work_end = work_start + timedelta(hours=WORK_REPRESENTATIVES[work])
+    user_data = {
+        'goal': 'fitness' if goal == 0 else 'general',
+        'gender': 'male' if gender == 0 else 'female',
+        'diet': DIETS[diet],
+        'age': str(AGE_REPRESENTATIVES[age]),
+        # A 100 cm height makes the weight equal to the BMI
+        'weight': str(BMI_REPRESENTATIVES[bmi]),
+        'height': '100',
+        'work_start': work_start.strftime('%I:%M %p'),
+        'work_end': work_end.strftime('%I:%M %p'),
+    }
+    # 2024-01-01 was a Monday
+    week_start = datetime(2024, 1, 1) + timedelta(days=weekday)
+    return user_data, week_start
+
+def encode_week(week, workout_positions, meal_positions):
+    row = np.full(ROW_WIDTH, -1, dtype=np.int32)
+    for day, (selected_workouts, _) in enumerate(week):
+        for slot, w in enumerate(selected_workouts):
+            row[day * 3 + slot] = workout_positions[id(w)]
+    for slot, m in enumerate(week[0][1]):
+        row[21 + slot] = meal_positions[id(m)]
+    return row
+
+def decode_week(row, workouts, meals):
+    selected_meals = [meals[p] for p in row[21:] if p >= 0]
+    return [([workouts[p] for p in row[day * 3:day * 3 + 3] if p >= 0], selected_meals) for day in range(7)]
+
+def save_plan_table(path, rows, catalog_version):
+    np.save(f"{path}.npy", rows)
+    with open(f"{path}.json", 'w') as f:
+        json.dump({'catalog_version': catalog_version, 'axes': AXES, 'row_width': ROW_WIDTH}, f)
+
+def load_plan_table(path):
+    with open(f"{path}.json", 'r') as f:
+        header = json.load(f)
+    if header['axes'] != AXES or header['row_width'] != ROW_WIDTH:
+        raise ValueError(f"Plan table {path} was built with different buckets; rebuild it")
+    # Memory-mapped so every worker process shares the same pages
+    header['rows'] = np.load(f"{path}.npy", mmap_mode='r')
+    return header
+
+def lookup_week(plan_table, user_data, week_start, workouts, meals):
+    bucket = bucket_index(user_profile(user_data), week_start.weekday())
+    if bucket is None:
+        return None
+    return decode_week(plan_table['rows'][bucket], workouts, meals)
@@ -0,0 +1,237 @@
+from datetime import datetime, timedelta
+import numpy as np
+from sklearn.metrics.pairwise import cosine_similarity
+import logging
+from catalog import (build_item_classes, positions_for_ids, top_k_by_class, build_meal_index, find_meal,
+                     MAJOR_MUSCLE_GROUPS, GOAL_WORKOUT_TYPES)
+from metrics import Span
+
+logger = logging.getLogger(__name__)
+
+def calculate_bmi(weight, height):
+    weight = float(weight) if weight else 70
+    height = float(height) / 100 if height else 1.7
+    return weight / (height ** 2)
+
+def parse_time(time_str):
+    return datetime.strptime(time_str, '%I:%M %p') if time_str else datetime.strptime('9:00 AM', '%I:%M %p')
+
+WEEKLY_SPLIT = {0: 'push', 1: 'pull', 2: 'legs', 3: 'rest', 4: 'push', 5: 'pull', 6: 'legs'}
+
+def user_profile(user_data):
+    goal = user_data.get('goal', 'fitness').lower()
+    gender = user_data.get('gender', 'male').lower()
+    diet = user_data.get('diet', 'non-vegetarian').lower()
+    age = float(user_data.get('age', '30'))
+    bmi = calculate_bmi(user_data.get('weight', '70'), user_data.get('height', '170'))
+    work_start = parse_time(user_data.get('work_start', '9:00 AM'))
+    work_end = parse_time(user_data.get('work_end', '10:00 PM'))
+    work_duration = (work_end - work_start).seconds / 3600
+
+    user_vector = [
+        1 if goal == 'fitness' else 0.5,
+        min(bmi / 30, 1.0) if bmi < 30 else 0.5,
+        1 - (work_duration / 12) if work_duration < 12 else 0.3,
+        1 - (age / 50) if age <= 50 else 0.4,
+        1 if gender == 'male' else 0.9,
+        1 if diet == 'vegetarian' else 0.8,
+        0.8 if bmi > 25 else 1.0,
+        1.0 if age < 35 else 0.7,
+        1.0 if goal == 'fitness' and bmi < 25 else 0.6
+    ]
+    return {'goal': goal, 'gender': gender, 'diet': diet, 'age': age, 'bmi': bmi,
+            'work_duration': work_duration, 'user_vector': user_vector}
+
+def recommend(user_data, items, item_type, day_of_week, used_workouts, classes=None):
+    logger.debug("Recommending %s for day %s", item_type, day_of_week)
+    target_split = WEEKLY_SPLIT.get(day_of_week, 'rest')
+    if target_split == 'rest' and item_type == 'workout':
+        return []
+
+    with Span('profile'):
+        profile = user_profile(user_data)
+    if classes is None:
+        classes = build_item_classes(items, item_type)
+    if len(items) == 0:
+        return []
+    if item_type == 'workout':
+        with Span('workout_scoring'):
+            similarities, penalized_similarities = workout_similarities(classes, profile, [target_split])[target_split]
+            used = positions_for_ids(classes, used_workouts)
+            ranked = top_k_by_class(classes, similarities, 3, used, penalized_similarities)
+    else:
+        with Span('meal_scoring'):
+            similarities = cosine_similarity([profile['user_vector']], meal_matrix(classes['class_columns'], profile))[0]
+            ranked = top_k_by_class(classes, similarities, 3)
+    return [items[i] for i in ranked]
+
+def plan_week(user_data, week_start, workouts, meals, workout_classes=None, meal_classes=None,
+              days=range(7), used_workouts=()):
+    # Same picks as calling recommend() day by day, with the user-dependent work done once.
+    # days selects which days of the week (offsets from week_start) to plan; used_workouts are
+    # ids already picked on earlier days, for completing a week whose first days are known.
+    with Span('profile'):
+        profile = user_profile(user_data)
+    if workout_classes is None:
+        workout_classes = build_item_classes(workouts, 'workout')
+    if meal_classes is None:
+        meal_classes = build_item_classes(meals, 'meal')
+
+    selected_meals = []
+    if len(meals):
+        with Span('meal_scoring'):
+            meal_similarities = cosine_similarity([profile['user_vector']],
+                                                  meal_matrix(meal_classes['class_columns'], profile))[0]
+            selected_meals = [meals[i] for i in top_k_by_class(meal_classes, meal_similarities, 3)]
+
+    weekdays = [(week_start + timedelta(days=day)).weekday() for day in days]
+    splits = sorted({WEEKLY_SPLIT[d] for d in weekdays} - {'rest'}) if len(workouts) else []
+    week = []
+    with Span('workout_scoring'):
+        split_similarities = workout_similarities(workout_classes, profile, splits)
+        used_workouts = set(used_workouts)
+        for weekday in weekdays:
+            target_split = WEEKLY_SPLIT[weekday]
+            selected_workouts = []
+            if target_split in split_similarities:
+                # The diversity penalty depends on earlier days, so it is applied day by day
+                similarities, penalized_similarities = split_similarities[target_split]
+                used = positions_for_ids(workout_classes, used_workouts)
+                ranked = top_k_by_class(workout_classes, similarities, 3, used, penalized_similarities)
+                selected_workouts = [workouts[i] for i in ranked]
+                for w in selected_workouts:
+                    used_workouts.add(w['id'])
+            week.append((selected_workouts, selected_meals))
+    return week
+
+def workout_similarities(classes, profile, splits):
+    # Per-class similarities for each split, plain and with the used_workouts penalty, in one call
+    if not splits:
+        return {}
+    matrices = []
+    for split in splits:
+        class_matrix = workout_matrix(classes['class_columns'], profile, split)
+        penalized = class_matrix.copy()
+        penalized[:, 7] *= 0.01
+        matrices.extend([class_matrix, penalized])
+    similarities = np.split(cosine_similarity([profile['user_vector']], np.vstack(matrices))[0], len(matrices))
+    return {split: (similarities[2 * i], similarities[2 * i + 1]) for i, split in enumerate(splits)}
+
+def workout_matrix(columns, profile, target_split):
+    goal, gender, age, bmi = profile['goal'], profile['gender'], profile['age'], profile['bmi']
+    work_duration = profile['work_duration']
+    n = len(columns['id'])
+    high = columns['intensity'] == 'high'
+    goal_score = np.zeros(n)
+    if goal == 'fitness':
+        goal_score = np.where(np.isin(columns['type'], GOAL_WORKOUT_TYPES), np.where(high, 1.3, 1.0), 0.0)
+    bmi_score = np.where((columns['calories_burned'] > 150) & (bmi < 25), 1.0, 0.7)
+    duration_score = np.where((columns['duration_minutes'] <= 30) & (work_duration > 8), 1.0, 0.6)
+    age_score = np.where(~high & (age < 40), 1.0, 0.5)
+    gender_score = np.where(np.isin(columns['muscle_group'], MAJOR_MUSCLE_GROUPS) & (gender == 'male'), 1.0, 0.9)
+    diet_score = np.zeros(n)
+    intensity_score = np.where((columns['intensity'] == 'medium') & (bmi > 25), 1.0, 0.8)
+    split_score = np.where(columns['split'] == target_split, 2.0, 0.05)
+    volume_score = np.where(columns['sets'] >= 3, 1.0, 0.7)
+    return np.column_stack([goal_score, bmi_score, duration_score, age_score, gender_score,
+                            diet_score, intensity_score, split_score, volume_score])
+
+def meal_matrix(columns, profile):
+    goal, gender, diet, age, bmi = profile['goal'], profile['gender'], profile['diet'], profile['age'], profile['bmi']
+    work_duration = profile['work_duration']
+    n = len(columns['id'])
+    goal_score = np.zeros(n)
+    if goal == 'fitness':
+        goal_score = np.where(columns['protein'] >= 15, np.where(columns['protein'] >= 25, 1.3, 1.0), 0.0)
+    bmi_score = np.where((columns['calories'] < 600) | (bmi < 25), 1.0, 0.6)
+    duration_score = np.where((columns['prep_time_minutes'] <= 20) & (work_duration > 8), 1.0, 0.7)
+    age_score = np.full(n, 1.0 if age < 40 else 0.8)
+    gender_score = np.where((columns['protein'] > 20) & (gender == 'male'), 1.0, 0.9)
+    diet_score = np.where(columns['type'] == diet, 2.0, 0.0)
+    ones = np.ones(n)
+    return np.column_stack([goal_score, bmi_score, duration_score, age_score, gender_score,
+                            diet_score, ones, ones, ones])
+
+WARMUP = "5 min dynamic stretches (leg swings, arm circles)"
+
+def create_schedule(user_data, workouts, meals, meal_index=None):
+    return render_schedule(schedule_slots(user_data, workouts, meals, meal_index))
+
+def schedule_slots(user_data, workouts, meals, meal_index=None):
+    # A day as (time, kind, item, overrides) references into the catalog;
+    # render_schedule() turns it into the JSON shape the client receives
+    meal_times, workout_slot = slot_times(user_data)
+    meal_plan = [
+        {"time": meal_times[0], "calories": 350, "protein": 10, "carbs": 50, "fat": 10, "meal_type": "breakfast", "purpose": "High-carb for energy"},
+        {"time": meal_times[1], "calories": 600, "protein": 30, "carbs": 70, "fat": 20, "meal_type": "lunch", "purpose": "High-protein for recovery"},
+        {"time": meal_times[2], "calories": 600, "protein": 30, "carbs": 70, "fat": 20, "meal_type": "dinner", "purpose": "High-protein for recovery"}
+    ]
+
+    if meal_index is None:
+        meal_index = build_meal_index(meals)
+    diet = user_data.get('diet', 'non-vegetarian').lower()
+    slots = []
+    for meal in meal_plan:
+        selected_meal = find_meal(meal_index, meal['meal_type'], diet, meal['calories'], meal['protein'], meal['carbs'])
+        overrides = {} if 'purpose' in selected_meal else {'purpose': meal['purpose']}
+        slots.append((meal['time'], 'meal', selected_meal, overrides))
+
+    for w in workouts:
+        slots.append((workout_slot, 'workout', w, {}))
+
+    return slots
+
+def slot_times(user_data):
+    # The times schedule_slots() gives the day's breakfast, lunch and dinner, and its workout window
+    work_end = parse_time(user_data.get('work_end', '10:00 PM'))
+    lunch_time = parse_time(user_data.get('lunch_time', '1:00 PM'))
+    workout_time = (work_end + timedelta(hours=1)).strftime('%I:%M %p')
+    workout_end = (work_end + timedelta(hours=2, minutes=30)).strftime('%I:%M %p')
+    return ["7:00 AM", lunch_time.strftime('%I:%M %p'), "8:00 PM"], f"{workout_time}-{workout_end}"
+
+def scoring_inputs(profile):
+    # Everything the workout and meal rankings read from a profile: the user vector, plus the
+    # thresholds workout_matrix() and meal_matrix() compare profile fields against. A work_end
+    # edit moves the work duration, which is in the user vector, unless work_start moves with it.
+    common = (tuple(profile['user_vector']), profile['goal'], profile['gender'], profile['bmi'] < 25,
+              profile['work_duration'] > 8, profile['age'] < 40)
+    return {'workouts': common + (profile['bmi'] > 25,), 'meals': common + (profile['diet'],)}
+
+def changed_stages(old_data, new_data):
+    # Which parts of a stored plan an edit from old_data to new_data invalidates: 'workouts' and
+    # 'meals' need re-ranking (the meal inputs include the diet the slots' meals are picked by),
+    # 'times' only moves slots
+    old_inputs = scoring_inputs(user_profile(old_data))
+    new_inputs = scoring_inputs(user_profile(new_data))
+    stages = {stage for stage in ('workouts', 'meals') if old_inputs[stage] != new_inputs[stage]}
+    if slot_times(old_data) != slot_times(new_data):
+        stages.add('times')
+    return stages
+
+def render_schedule(slots):
+    daily_schedule = {}
+    for time, kind, item, overrides in slots:
+        if kind == 'meal':
+            daily_schedule[time] = {
+                "type": "meal",
+                "name": item['name'],
+                "calories": item['calories'],
+                "protein": item['protein'],
+                "carbs": item['carbs'],
+                "fat": item['fat'],
+                "purpose": item.get('purpose', overrides.get('purpose'))
+            }
+        else:
+            workout_slot = daily_schedule.get(time)
+            if workout_slot is None or workout_slot['type'] != 'workout':
+                workout_slot = daily_schedule[time] = {
+                    "type": "workout",
+                    "name": f"{item['split'].capitalize()} Day",
+                    "details": [],
+                    "warmup": WARMUP
+                }
+            workout_slot['details'].append({
+                **item,
+                "instructions": f"Use 70-80% 1RM, rest {90 if item['intensity'] == 'high' else 60}s."
+            })
+    return daily_schedule
@@ -0,0 +1,348 @@
+import os
+import sqlite3
+import json
+import queue
+import threading
+import time
+import logging
+from collections import OrderedDict
+from functools import lru_cache
+from concurrent.futures import Future
+from datetime import datetime
+from planner import render_schedule
+
+logger = logging.getLogger(__name__)
+
+DB_PATH = os.environ.get('WFB_DB_PATH', 'data.sqlite')
+# NORMAL is durable across application crashes in WAL mode; FULL also survives power loss
+DB_SYNCHRONOUS = os.environ.get('WFB_DB_SYNCHRONOUS', 'NORMAL')
+
+USER_FIELDS = ['age', 'weight', 'height', 'gender', 'diet', 'goal', 'work_start', 'work_end', 'lunch_time']
+
+# A submission key seen before leaves the existing user in place (client retries are idempotent)
+INSERT_USER = f'''INSERT INTO users ({', '.join(USER_FIELDS)}, catalog_version, week_start, submission_key)
+                  VALUES ({', '.join('?' for _ in USER_FIELDS)}, ?, ?, ?)
+                  ON CONFLICT (submission_key) DO NOTHING'''
+SELECT_USER_BY_KEY = 'SELECT id FROM users WHERE submission_key = ?'
+SELECT_USER = f"SELECT {', '.join(USER_FIELDS)}, catalog_version, week_start, plan_revision FROM users WHERE id = ?"
+# Only matches the revision the edit was computed from, so concurrent edits cannot overwrite each other
+UPDATE_USER = f'''UPDATE users SET {', '.join(f'{field} = ?' for field in USER_FIELDS)}, catalog_version = ?, week_start = ?,
+                   plan_revision = plan_revision + 1 WHERE id = ? AND plan_revision = ?'''
+SELECT_PLAN_REVISION = 'SELECT plan_revision FROM users WHERE id = ?'
+INSERT_PLAN_ITEM = '''INSERT INTO plan_items (user_id, day, seq, slot, kind, position, overrides)
+                       VALUES (?, ?, ?, ?, ?, ?, ?)'''
+INSERT_CATALOG_ITEM = '''INSERT OR IGNORE INTO catalog_items (catalog_version, kind, position, item_id, data)
+                          VALUES (?, ?, ?, ?, ?)'''
+SELECT_USER_CATALOG = 'SELECT catalog_version FROM users WHERE id = ?'
+SELECT_PLAN_ITEMS = '''SELECT day, slot, kind, position, overrides FROM plan_items
+                       WHERE user_id = ? ORDER BY day, seq'''
+SELECT_PLAN_ROWS = '''SELECT day, seq, slot, kind, position, overrides FROM plan_items
+                      WHERE user_id = ? ORDER BY day, seq'''
+UPDATE_PLAN_ITEM = '''UPDATE plan_items SET slot = ?, kind = ?, position = ?, overrides = ?
+                       WHERE user_id = ? AND day = ? AND seq = ?'''
+DELETE_PLAN_ITEM = 'DELETE FROM plan_items WHERE user_id = ? AND day = ? AND seq = ?'
+SELECT_CATALOG_ITEM = 'SELECT data FROM catalog_items WHERE catalog_version = ? AND kind = ? AND position = ?'
+# Plans stored before plan_items existed keep their denormalized JSON
+SELECT_LEGACY_PLAN = 'SELECT day, schedule FROM weekly_plan WHERE user_id = ? ORDER BY day'
+DELETE_LEGACY_PLAN = 'DELETE FROM weekly_plan WHERE user_id = ?'
+
+_local = threading.local()
+
+def connect():
+    # sqlite3 keeps a per-connection cache of prepared statements, so reusing the
+    # connection also reuses the compiled INSERT/SELECT statements above
+    conn = sqlite3.connect(DB_PATH, timeout=30, cached_statements=64)
+    conn.row_factory = sqlite3.Row
+    conn.execute('PRAGMA journal_mode=WAL')
+    conn.execute(f'PRAGMA synchronous={DB_SYNCHRONOUS}')
+    return conn
+
+def get_db_connection():
+    # One long-lived connection per thread
+    conn = getattr(_local, 'conn', None)
+    if conn is None:
+        conn = _local.conn = connect()
+    return conn
+
+def init_db():
+    logger.debug("Initializing database")
+    with get_db_connection() as conn:
+        c = conn.cursor()
+        c.execute('''CREATE TABLE IF NOT EXISTS users
+                     (id INTEGER PRIMARY KEY, age TEXT, weight TEXT, height TEXT,
+                      gender TEXT, diet TEXT, goal TEXT, work_start TEXT,
+                      work_end TEXT, lunch_time TEXT, catalog_version TEXT, submission_key TEXT,
+                      week_start TEXT, plan_revision INTEGER DEFAULT 0)''')
+        columns = [row['name'] for row in c.execute('PRAGMA table_info(users)')]
+        # week_start is the date of day 0, needed to re-plan the same weekdays after a profile edit
+        # plan_revision counts the edits to a user's plan, for the ETag of GET /plan
+        for column, column_type in (('catalog_version', 'TEXT'), ('submission_key', 'TEXT'), ('week_start', 'TEXT'),
+                                    ('plan_revision', 'INTEGER DEFAULT 0')):
+            if column not in columns:
+                c.execute(f'ALTER TABLE users ADD COLUMN {column} {column_type}')
+        # NULL keys never collide, so submissions without a key are unaffected
+        c.execute('CREATE UNIQUE INDEX IF NOT EXISTS users_submission_key ON users (submission_key)')
+        c.execute('''CREATE TABLE IF NOT EXISTS weekly_plan
+                     (user_id INTEGER, day INTEGER, schedule TEXT,
+                      FOREIGN KEY(user_id) REFERENCES users(id))''')
+        c.execute('CREATE INDEX IF NOT EXISTS weekly_plan_user_day ON weekly_plan (user_id, day)')
+        # One row per scheduled item, referencing the catalog instead of copying it
+        c.execute('''CREATE TABLE IF NOT EXISTS plan_items
+                     (user_id INTEGER, day INTEGER, seq INTEGER, slot TEXT, kind TEXT,
+                      position INTEGER, overrides TEXT,
+                      FOREIGN KEY(user_id) REFERENCES users(id))''')
+        c.execute('CREATE INDEX IF NOT EXISTS plan_items_user_day ON plan_items (user_id, day)')
+        # Items are addressed by their position in a catalog version because catalog ids are not unique
+        c.execute('''CREATE TABLE IF NOT EXISTS catalog_items
+                     (catalog_version TEXT, kind TEXT, position INTEGER, item_id INTEGER, data TEXT,
+                      PRIMARY KEY (catalog_version, kind, position)) WITHOUT ROWID''')
+    logger.debug("Database initialized")
+
+# Catalogs plans can be stored against, newest last. Only the items that stored plans reference are
+# copied into catalog_items, by the transaction that stores the first plan using them.
+KEEP_CATALOGS = 4
+_catalogs = OrderedDict()
+_catalogs_lock = threading.Lock()
+
+def save_catalog(catalog_version, workouts, meals):
+    with _catalogs_lock:
+        _catalogs[catalog_version] = {'workout': workouts, 'meal': meals}
+        _catalogs.move_to_end(catalog_version)
+        while len(_catalogs) > KEEP_CATALOGS:
+            _catalogs.popitem(last=False)
+
+@lru_cache(maxsize=65536)
+def catalog_record(catalog_version, kind, position):
+    item = _catalogs[catalog_version][kind][position]
+    return (catalog_version, kind, position, item.get('id'), json.dumps(item))
+
+def insert_catalog_items(conn, catalog_version, plan_rows):
+    # The catalog items plan_rows reference, in the caller's transaction; ones already stored are skipped
+    try:
+        records = [catalog_record(catalog_version, kind, position)
+                   for kind, position in sorted({(row[3], row[4]) for row in plan_rows})]
+    except KeyError:
+        raise RuntimeError(f"Catalog {catalog_version} is not loaded; plans can only be stored against "
+                           f"the last {KEEP_CATALOGS} catalogs") from None
+    conn.executemany(INSERT_CATALOG_ITEM, records)
+
+def encode_plan(weekly_slots, positions):
+    # (day, seq, slot, kind, position, overrides) rows for a week of planner.schedule_slots() output
+    rows = []
+    for day, slots in weekly_slots.items():
+        for seq, (slot, kind, item, overrides) in enumerate(slots):
+            rows.append((day, seq, slot, kind, positions[kind][id(item)], json.dumps(overrides) if overrides else None))
+    return rows
+
+def decode_plan(plan_rows, workouts, meals):
+    # encode_plan() rows back to weekly slots holding the catalog's own item objects
+    items = {'workout': workouts, 'meal': meals}
+    weekly_slots = {}
+    for day, seq, slot, kind, position, overrides in sorted(plan_rows, key=lambda row: row[:2]):
+        weekly_slots.setdefault(day, []).append((slot, kind, items[kind][position],
+                                                 json.loads(overrides) if overrides else {}))
+    return weekly_slots
+
+def user_row(user_data, catalog_version, week_start=None):
+    return tuple(user_data.get(field) for field in USER_FIELDS) + (
+        catalog_version, week_start.date().isoformat() if week_start else None)
+
+def insert_submissions(conn, submissions):
+    # Inserts (user_data, catalog_version, plan_rows, submission_key, week_start) in the caller's transaction and
+    # returns the user ids. A key that is already stored returns its existing user and adds no rows.
+    user_ids = []
+    rows = []
+    referenced = {}
+    for user_data, catalog_version, plan_rows, submission_key, week_start in submissions:
+        cursor = conn.execute(INSERT_USER, user_row(user_data, catalog_version, week_start) + (submission_key,))
+        if cursor.rowcount == 0:
+            user_ids.append(conn.execute(SELECT_USER_BY_KEY, (submission_key,)).fetchone()['id'])
+            continue
+        user_ids.append(cursor.lastrowid)
+        rows.extend((cursor.lastrowid,) + row for row in plan_rows)
+        referenced.setdefault(catalog_version, []).extend(plan_rows)
+    for catalog_version, plan_rows in referenced.items():
+        insert_catalog_items(conn, catalog_version, plan_rows)
+    conn.executemany(INSERT_PLAN_ITEM, rows)
+    return user_ids
+
+def is_busy(error):
+    return isinstance(error, sqlite3.OperationalError) and ('locked' in str(error) or 'busy' in str(error))
+
+def retry_busy(operation, attempts=5, delay=0.05):
+    # Runs operation() again with exponential backoff while SQLite reports the database busy or locked
+    for attempt in range(attempts):
+        try:
+            return operation()
+        except sqlite3.OperationalError as e:
+            if not is_busy(e) or attempt == attempts - 1:
+                raise
+            logger.warning("Database busy, retrying in %.0f ms", delay * 1000)
+            time.sleep(delay)
+            delay *= 2
+
+def store_submission(user_data, catalog_version, plan_rows, submission_key=None, week_start=None):
+    # The user and the whole week in one transaction
+    with get_db_connection() as conn:
+        return insert_submissions(conn, [(user_data, catalog_version, plan_rows, submission_key, week_start)])[0]
+
+def submission_user(submission_key):
+    row = get_db_connection().execute(SELECT_USER_BY_KEY, (submission_key,)).fetchone()
+    return row['id'] if row else None
+
+def load_user(user_id):
+    # The stored profile (fields that were never given are left out), catalog version, week start and plan revision
+    row = get_db_connection().execute(SELECT_USER, (user_id,)).fetchone()
+    if row is None:
+        return None
+    return {'user_data': {field: row[field] for field in USER_FIELDS if row[field] is not None},
+            'catalog_version': row['catalog_version'],
+            'week_start': datetime.fromisoformat(row['week_start']) if row['week_start'] else None,
+            'plan_revision': row['plan_revision']}
+
+def plan_revision(user_id):
+    row = get_db_connection().execute(SELECT_PLAN_REVISION, (user_id,)).fetchone()
+    return row['plan_revision'] if row else None
+
+def load_plan_rows(user_id):
+    # The user's plan as encode_plan() rows; empty for plans stored before plan_items existed
+    return [tuple(row) for row in get_db_connection().execute(SELECT_PLAN_ROWS, (user_id,))]
+
+class PlanConflict(Exception):
+    pass
+
+def update_plan(user_id, user, user_data, catalog_version, week_start, old_rows, new_rows):
+    # Stores an edited profile and rewrites only the plan rows that differ from old_rows, matched by
+    # (day, seq), in one transaction. user and old_rows are what the edit was computed from; if the
+    # user was updated since, nothing is written and PlanConflict is raised. Returns the number of
+    # rows updated, added or deleted. An edit that changes nothing keeps the plan revision.
+    old = {row[:2]: row for row in old_rows}
+    new = {row[:2]: row for row in new_rows}
+    changed = [row for key, row in new.items() if old.get(key) != row]
+    updates = [row[2:] + (user_id,) + row[:2] for row in changed if row[:2] in old]
+    inserts = [(user_id,) + row for row in changed if row[:2] not in old]
+    deletes = [(user_id,) + key for key in old if key not in new]
+    row = user_row(user_data, catalog_version, week_start)
+    if not changed and not deletes and row == user_row(user['user_data'], user['catalog_version'], user['week_start']):
+        return 0
+    with get_db_connection() as conn:
+        if conn.execute(UPDATE_USER, row + (user_id, user['plan_revision'])).rowcount == 0:
+            raise PlanConflict(f"User {user_id} was updated by another request")
+        conn.executemany(UPDATE_PLAN_ITEM, updates)
+        conn.executemany(INSERT_PLAN_ITEM, inserts)
+        conn.executemany(DELETE_PLAN_ITEM, deletes)
+        # Items the old rows reference are already stored, and their catalog may no longer be loaded
+        stored = {(row[3], row[4]) for row in old_rows} if catalog_version == user['catalog_version'] else set()
+        insert_catalog_items(conn, catalog_version, [row for row in changed if (row[3], row[4]) not in stored])
+        if new_rows and not old_rows:
+            # A plan stored before plan_items existed is replaced by the new rows
+            conn.execute(DELETE_LEGACY_PLAN, (user_id,))
+    return len(changed) + len(deletes)
+
+@lru_cache(maxsize=65536)
+def catalog_item(catalog_version, kind, position):
+    row = get_db_connection().execute(SELECT_CATALOG_ITEM, (catalog_version, kind, position)).fetchone()
+    return json.loads(row['data']) if row else None
+
+def load_plan(user_id):
+    conn = get_db_connection()
+    user = conn.execute(SELECT_USER_CATALOG, (user_id,)).fetchone()
+    if user is None:
+        return {}
+    weekly_slots = {}
+    for row in conn.execute(SELECT_PLAN_ITEMS, (user_id,)):
+        item = catalog_item(user['catalog_version'], row['kind'], row['position'])
+        overrides = json.loads(row['overrides']) if row['overrides'] else {}
+        weekly_slots.setdefault(row['day'], []).append((row['slot'], row['kind'], item, overrides))
+    if weekly_slots:
+        return {day: render_schedule(slots) for day, slots in weekly_slots.items()}
+    rows = conn.execute(SELECT_LEGACY_PLAN, (user_id,)).fetchall()
+    return {row['day']: json.loads(row['schedule']) for row in rows}
+
+class WriteQueueFull(Exception):
+    pass
+
+_STOP = object()
+
+class WriteQueue:
+    # Group commit: request threads enqueue submissions, and a single writer thread commits
+    # many of them per transaction. Each submit() future resolves to the user id once the
+    # transaction holding it has committed.
+    def __init__(self, batch_size=128, max_wait=0.005, max_pending=4096, enqueue_timeout=1.0):
+        self.batch_size = batch_size
+        self.max_wait = max_wait
+        self.enqueue_timeout = enqueue_timeout
+        self.batches = 0
+        self.written = 0
+        self._queue = queue.Queue(maxsize=max_pending)
+        self._closed = False
+        # submit() calls between the closed check and their put; close() waits for them so
+        # that nothing is enqueued behind the stop marker
+        self._enqueuing = 0
+        self._state = threading.Condition()
+        self._thread = threading.Thread(target=self._run, name='wfb-writer', daemon=True)
+        self._thread.start()
+
+    def submit(self, user_data, catalog_version, plan_rows, submission_key=None, week_start=None):
+        with self._state:
+            if self._closed:
+                raise RuntimeError("Write queue is closed")
+            self._enqueuing += 1
+        future = Future()
+        try:
+            self._queue.put(((user_data, catalog_version, plan_rows, submission_key, week_start), future),
+                            timeout=self.enqueue_timeout)
+        except queue.Full:
+            raise WriteQueueFull(f"{self._queue.maxsize} submissions already waiting to be written")
+        finally:
+            with self._state:
+                self._enqueuing -= 1
+                self._state.notify_all()
+        return future
+
+    def close(self):
+        # Everything enqueued before close() is still written
+        with self._state:
+            if self._closed:
+                return
+            self._closed = True
+            self._state.wait_for(lambda: self._enqueuing == 0)
+        self._queue.put(_STOP)
+        self._thread.join()
+
+    def _run(self):
+        conn = connect()
+        stopping = False
+        while not stopping:
+            item = self._queue.get()
+            if item is _STOP:
+                break
+            batch = [item]
+            deadline = time.monotonic() + self.max_wait
+            while len(batch) < self.batch_size:
+                try:
+                    item = self._queue.get(timeout=max(deadline - time.monotonic(), 0))
+                except queue.Empty:
+                    break
+                if item is _STOP:
+                    stopping = True
+                    break
+                batch.append(item)
+            self._write(conn, batch)
+        conn.close()
+
+    def _write(self, conn, batch):
+        def commit():
+            with conn:
+                return insert_submissions(conn, [submission for submission, _ in batch])
+        try:
+            user_ids = retry_busy(commit)
+        except Exception as e:
+            logger.exception("Group commit of %d submissions failed", len(batch))
+            for _, future in batch:
+                future.set_exception(e)
+            return
+        self.batches += 1
+        self.written += len(batch)
+        for (_, future), user_id in zip(batch, user_ids):
+            future.set_result(user_id)
@@ -0,0 +1,93 @@
+import json
+import os
+import shutil
+from datetime import datetime
+from conftest import generate
+from catalog import ColumnarCatalogWriter, JsonCatalogWriter, open_catalog, catalog_changed
+from planner import plan_week
+
+def write_columnar(path, kind, items):
+    writer = ColumnarCatalogWriter(path, kind)
+    writer.write(items)
+    return writer
+
+def write_json(path, items):
+    writer = JsonCatalogWriter(path, lines=path.endswith('.jsonl'))
+    writer.write(items)
+    return writer
+
+def picked_ids(week):
+    return [([w['id'] for w in workouts], [m['id'] for m in meals]) for workouts, meals in week]
+
+def test_columnar_catalog_plans_like_json(catalogs, users):
+    paths = catalogs['paths']
+    json_snapshot = open_catalog(paths['workout'], paths['meal'])
+    columnar_snapshot = open_catalog(paths['workout_columnar'], paths['meal_columnar'])
+    week_start = datetime(2026, 1, 5)
+    for user_data in users:
+        weeks = [plan_week(user_data, week_start, snapshot['workouts'], snapshot['meals'],
+                           snapshot['workout_classes'], snapshot['meal_classes'])
+                 for snapshot in (json_snapshot, columnar_snapshot)]
+        assert picked_ids(weeks[0]) == picked_ids(weeks[1])
+
+def test_regenerating_a_catalog_while_it_is_served(tmp_path):
+    workouts_path, meals_path = str(tmp_path / 'workouts.wfb'), str(tmp_path / 'meals.jsonl')
+    workouts, meals = generate('workout', 5000), generate('meal', 300)
+    write_columnar(workouts_path, 'workout', workouts).close()
+    write_json(meals_path, meals).close()
+    served = open_catalog(workouts_path, meals_path)
+    served['workouts'][0]
+
+    # Regenerated in place, smaller: nothing changes for readers until each writer closes
+    new_workouts, new_meals = generate('workout', 100, seed=8), generate('meal', 50, seed=8)
+    workout_writer = write_columnar(workouts_path, 'workout', new_workouts)
+    meal_writer = write_json(meals_path, new_meals)
+    assert not catalog_changed(served)
+    assert open_catalog(workouts_path, meals_path)['version'] == served['version']
+    meal_writer.close()
+    workout_writer.close()
+    assert catalog_changed(served)
+
+    # The served snapshot still reads the catalog it was opened on
+    assert [served['workouts'][i] for i in range(len(workouts))] == workouts
+    assert list(served['workouts']) == workouts
+    assert served['meals'] == meals
+
+    reloaded = open_catalog(workouts_path, meals_path, previous=served)
+    assert reloaded['version'] != served['version']
+    assert list(reloaded['workouts']) == new_workouts
+    assert reloaded['meals'] == new_meals
+    assert not catalog_changed(reloaded)
+    # Only the published version is kept next to the catalog
+    assert sorted(os.listdir(tmp_path)) == sorted(['workouts.wfb', 'meals.jsonl',
+                                                   os.path.basename(os.path.realpath(workouts_path))])
+
+def test_catalog_directory_from_before_links_is_replaced(tmp_path):
+    workouts_path, meals_path = str(tmp_path / 'workouts.json'), str(tmp_path / 'meals.wfb')
+    write_json(workouts_path, generate('workout', 100)).close()
+    # The layout earlier writers left: the catalog files directly in meals.wfb
+    write_columnar(str(tmp_path / 'written.wfb'), 'meal', generate('meal', 200)).close()
+    shutil.copytree(os.path.realpath(tmp_path / 'written.wfb'), meals_path)
+    served = open_catalog(workouts_path, meals_path)
+    write_columnar(meals_path, 'meal', generate('meal', 20, seed=8)).close()
+    assert os.path.islink(meals_path)
+    assert len(served['meals']) == 200 and served['meals'][199]['id'] == 200
+    assert len(open_catalog(workouts_path, meals_path)['meals']) == 20
+
+def test_served_app_reloads_a_regenerated_catalog(server, catalogs, users, tmp_path, monkeypatch):
+    workouts_path = str(tmp_path / 'workouts.wfb')
+    write_columnar(workouts_path, 'workout', catalogs['items']['workout']).close()
+    monkeypatch.setattr(server, 'workouts_path', workouts_path)
+    server.reload_catalog()
+    client = server.app.test_client()
+    user_id = client.post('/submit', json=users[0]).get_json()['user_id']
+    before = client.get(f'/plan/{user_id}').get_json()['schedule']
+    version = server.catalog['version']
+
+    write_columnar(workouts_path, 'workout', generate('workout', 50, seed=8)).close()
+    assert catalog_changed(server.catalog)
+    server.reload_catalog()
+    assert server.catalog['version'] != version and len(server.catalog['workouts']) == 50
+    # Plans stored against the previous catalog keep their items
+    assert json.loads(json.dumps(client.get(f'/plan/{user_id}').get_json()['schedule'])) == before
+    assert client.post('/submit', json=users[1]).status_code == 200
@@ -0,0 +1,32 @@
+import json
+from datetime import datetime
+from conftest import fresh_plan, stored_plan
+
+def test_cohort_stores_the_same_weeks_as_submit(server, users):
+    client = server.app.test_client()
+    profiles = users[:12] * 2 + ['not a profile']
+    response = client.post('/cohort', json=profiles)
+    lines = [json.loads(line) for line in response.get_data(as_text=True).splitlines()]
+    assert lines[-1] == {'done': True, 'profiles': len(profiles), 'plans': 12}
+    results = {line['index']: line for line in lines[:-1]}
+    assert 'error' in results[len(profiles) - 1]
+    for index in range(len(profiles) - 1):
+        user_id = results[index]['user_id']
+        assert stored_plan(client, user_id) == fresh_plan(server, user_id)
+
+def test_cohort_workers_plan_ndjson_in_chunks_and_batches(users, monkeypatch, request):
+    monkeypatch.setenv('WFB_COHORT_WORKERS', '2')
+    monkeypatch.setenv('WFB_COHORT_CHUNK_SIZE', '3')
+    monkeypatch.setenv('WFB_COHORT_BATCH_SIZE', '5')
+    server = request.getfixturevalue('server')
+    client = server.app.test_client()
+    body = '\n'.join([json.dumps(user_data) for user_data in users[:20]] + ['{not json', '[1]', ''])
+    response = client.post('/cohort', data=body, content_type='application/x-ndjson')
+    lines = [json.loads(line) for line in response.get_data(as_text=True).splitlines()]
+    unique = {server.plan_cache_key(user_data, datetime.now()) for user_data in users[:20]}
+    assert lines[-1] == {'done': True, 'profiles': 22, 'plans': len(unique)}
+    results = {line['index']: line for line in lines[:-1]}
+    assert 'error' in results[20] and 'error' in results[21]
+    for index in range(20):
+        user_id = results[index]['user_id']
+        assert stored_plan(client, user_id) == fresh_plan(server, user_id)
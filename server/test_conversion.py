@@ -0,0 +1,189 @@
+import json
+import random
+from argparse import Namespace
+import pandas as pd
+import pytest
+import convert_meals
+import convert_workouts
+
+BODY_PARTS = ['chest', 'upper back', 'Shoulders', 'lower legs', 'waist', 'Quadriceps', 'Hamstrings', 'cardio', None]
+LEVELS = ['Beginner', 'Intermediate', 'Expert', 'High', None]
+DIETS = ['Vegetarian', 'High Protein Non Vegetarian', 'Diabetic Friendly', 'Eggetarian', 'Vegan', 'No Onion No Garlic', None]
+COURSES = ['Main Course', 'Side Dish', 'Breakfast', 'Lunch', 'Dinner', 'Snack', 'Starter', 'Dessert', 'Appetizer', None]
+TIMES = [3, 10, 25, 45.0, 90, 120, 121, 240, '30 mins', None]
+
+# The row-by-row converters the chunked ones replaced, kept as the reference output
+
+def reference_split(body_part):
+    body_part = body_part.lower() if isinstance(body_part, str) else ''
+    if any(part in body_part for part in ['chest', 'shoulders', 'triceps']):
+        return 'push'
+    elif any(part in body_part for part in ['back', 'biceps']):
+        return 'pull'
+    elif any(part in body_part for part in ['quads', 'hamstrings', 'glutes', 'calves']):
+        return 'legs'
+    return 'push'
+
+def reference_workouts(exercise_df, mega_df):
+    exercise_df = exercise_df.dropna(subset=['name', 'bodyPart'])
+    mega_df = mega_df.dropna(subset=['Title', 'BodyPart'])
+    workouts = []
+    for idx, row in exercise_df.iterrows():
+        instructions = [row[f'instructions/{i}'] for i in range(11) if pd.notna(row[f'instructions/{i}'])]
+        name = row['name'].lower()
+        body_part = row['bodyPart'].lower()
+        intensity = 'high' if any(kw in name for kw in ['squat', 'deadlift', 'bench', 'press', 'pull-up']) or \
+                             any(bp in body_part for bp in ['chest', 'back', 'legs']) else 'medium'
+        workout = {
+            'id': int(row['id']),
+            'name': row['name'],
+            'type': 'strength',
+            'muscle_group': row['bodyPart'],
+            'split': reference_split(row['bodyPart']),
+            'equipment': row['equipment'] if pd.notna(row['equipment']) else 'none',
+            'calories_burned': 200 if intensity == 'high' else 150,
+            'duration_minutes': 20 if intensity == 'high' else 15,
+            'sets': 4 if intensity == 'high' else 3,
+            'reps': '6-8' if intensity == 'high' else '8-12',
+            'intensity': intensity,
+            'instructions': f"{' '.join(instructions)} Use 70-80% 1RM, rest {90 if intensity == 'high' else 60}s.",
+            'youtube_link': row['gifUrl'] if pd.notna(row['gifUrl']) else ''
+        }
+        if len(workout['name']) > 3:
+            workouts.append(workout)
+    seen_names = {w['name'].lower() for w in workouts}
+    for idx, row in mega_df.iterrows():
+        name = row['Title']
+        if name.lower() not in seen_names:
+            intensity = row['Level'].lower() if pd.notna(row['Level']) else 'medium'
+            workout = {
+                'id': len(workouts) + idx + 1,
+                'name': name,
+                'type': row['Type'].lower() if pd.notna(row['Type']) else 'strength',
+                'muscle_group': row['BodyPart'].lower(),
+                'split': reference_split(row['BodyPart']),
+                'equipment': row['Equipment'].lower() if pd.notna(row['Equipment']) else 'none',
+                'calories_burned': 200 if intensity == 'high' else 150,
+                'duration_minutes': 20 if intensity == 'high' else 15,
+                'sets': 4 if intensity == 'high' else 3,
+                'reps': '6-8' if intensity == 'high' else '8-12',
+                'intensity': intensity,
+                'instructions': f"{row['Desc'] if pd.notna(row['Desc']) else 'Perform with proper form.'} Use 70-80% 1RM, rest {90 if intensity == 'high' else 60}s.",
+                'youtube_link': ''
+            }
+            if len(workout['name']) > 3:
+                workouts.append(workout)
+    return workouts
+
+def reference_nutrition(diet, course):
+    vegetarian = any(v in diet for v in ['vegetarian', 'diabetic friendly', 'eggitarian', 'vegan'])
+    if vegetarian:
+        if course in ['breakfast', 'snack']:
+            return {'calories': 350, 'protein': 10, 'carbs': 50, 'fat': 10, 'purpose': 'High-carb for energy'}
+        elif course in ['main course', 'lunch', 'dinner']:
+            return {'calories': 500, 'protein': 20, 'carbs': 60, 'fat': 15, 'purpose': 'Balanced for sustenance'}
+        return {'calories': 400, 'protein': 15, 'carbs': 55, 'fat': 12, 'purpose': 'Moderate for energy'}
+    if course in ['main course', 'lunch', 'dinner']:
+        return {'calories': 650, 'protein': 35, 'carbs': 70, 'fat': 20, 'purpose': 'High-protein for recovery'}
+    elif course in ['breakfast', 'snack']:
+        return {'calories': 400, 'protein': 20, 'carbs': 45, 'fat': 15, 'purpose': 'Moderate for energy'}
+    return {'calories': 450, 'protein': 25, 'carbs': 50, 'fat': 18, 'purpose': 'Balanced for sustenance'}
+
+def reference_meals(df):
+    df = df.dropna(subset=['TranslatedRecipeName', 'Diet', 'Course'])
+    df['Diet'] = df['Diet'].str.lower()
+    df['Course'] = df['Course'].str.lower().replace(convert_meals.COURSES)
+    df = df[df['TranslatedRecipeName'].str.len() > 3]
+    df = df[df['TotalTimeInMins'].apply(lambda x: pd.isna(x) or (isinstance(x, (int, float)) and 5 <= x <= 120))]
+    meals = []
+    for idx, row in df.iterrows():
+        nutrition = reference_nutrition(row['Diet'], row['Course'])
+        meals.append({
+            'id': int(row['Srno']),
+            'name': row['TranslatedRecipeName'],
+            'type': 'vegetarian' if any(v in row['Diet'] for v in ['vegetarian', 'diabetic friendly', 'eggitarian', 'vegan']) else 'non-vegetarian',
+            'calories': nutrition['calories'],
+            'protein': nutrition['protein'],
+            'carbs': nutrition['carbs'],
+            'fat': nutrition['fat'],
+            'meal_type': row['Course'],
+            'prep_time_minutes': int(row['TotalTimeInMins']) if pd.notna(row['TotalTimeInMins']) else 30,
+            'instructions': row['TranslatedInstructions'] if pd.notna(row['TranslatedInstructions']) else 'Follow standard recipe.',
+            'purpose': nutrition['purpose']
+        })
+    return meals
+
+def maybe(rng, value, missing=0.15):
+    return None if rng.random() < missing else value
+
+def exercises_frame(count, rng):
+    rows = []
+    for i in range(count):
+        name = rng.choice(['Barbell Squat', 'Bench Press', 'Curl', 'Cable Row', 'Lunge', 'Pull-up', 'Dip'])
+        row = {'id': i + 1, 'name': maybe(rng, f'{name} {i}' if rng.random() < 0.9 else 'Row'),
+               'bodyPart': maybe(rng, rng.choice(BODY_PARTS)), 'equipment': maybe(rng, 'barbell'),
+               'gifUrl': maybe(rng, f'https://example.com/{i}.gif')}
+        steps = rng.randrange(12)
+        for step in range(11):
+            # Steps with gaps, as some rows of exercises.csv have
+            row[f'instructions/{step}'] = maybe(rng, f'Step {step}.', 0.2) if step < steps else None
+        rows.append(row)
+    return pd.DataFrame(rows)
+
+def mega_frame(count, exercises, rng):
+    rows = []
+    for i in range(count):
+        # Some titles repeat a name from exercises.csv in another case
+        title = exercises['name'].dropna().iloc[i].upper() if i % 7 == 0 else f'Mega move {i}'
+        rows.append({'Title': maybe(rng, title if rng.random() < 0.95 else 'Ab'),
+                     'Desc': maybe(rng, f'Description {i}.'), 'Type': maybe(rng, 'Strength'),
+                     'BodyPart': maybe(rng, rng.choice(BODY_PARTS[:-1])), 'Equipment': maybe(rng, 'Dumbbell'),
+                     'Level': rng.choice(LEVELS)})
+    return pd.DataFrame(rows)
+
+def recipes_frame(count, rng):
+    return pd.DataFrame([{'Srno': i + 1, 'TranslatedRecipeName': maybe(rng, f'Recipe {i}' if rng.random() < 0.95 else 'Dal'),
+                          'Diet': maybe(rng, rng.choice(DIETS)), 'Course': rng.choice(COURSES),
+                          'TotalTimeInMins': rng.choice(TIMES),
+                          'TranslatedInstructions': maybe(rng, f'Cook recipe {i}.')} for i in range(count)])
+
+@pytest.fixture(scope='module')
+def datasets(tmp_path_factory):
+    path = tmp_path_factory.mktemp('datasets')
+    rng = random.Random(7)
+    exercises = exercises_frame(300, rng)
+    mega = mega_frame(200, exercises, rng)
+    recipes = recipes_frame(300, rng)
+    paths = {'exercises': str(path / 'exercises.csv'), 'mega': str(path / 'megaGymDataset.csv'),
+             'recipes': str(path / 'recipes.xlsx')}
+    exercises.to_csv(paths['exercises'], index=False)
+    mega.to_csv(paths['mega'], index=False)
+    recipes.to_excel(paths['recipes'], index=False)
+    return paths
+
+def reference_json(items):
+    return json.dumps(items, indent=2)
+
+@pytest.mark.parametrize('chunksize,workers', [(0, 1), (37, 1), (37, 3)])
+def test_workouts_convert_like_the_row_by_row_converter(datasets, tmp_path, chunksize, workers):
+    output = str(tmp_path / 'workouts.json')
+    convert_workouts.convert(Namespace(exercises=datasets['exercises'], mega=datasets['mega'], output=output,
+                                       columnar='', chunksize=chunksize, workers=workers))
+    expected = reference_workouts(pd.read_csv(datasets['exercises']), pd.read_csv(datasets['mega']))
+    with open(output) as f:
+        assert f.read() == reference_json(expected)
+
+@pytest.mark.parametrize('chunksize,workers', [(0, 1), (41, 1), (41, 3)])
+def test_meals_convert_like_the_row_by_row_converter(datasets, tmp_path, chunksize, workers):
+    output = str(tmp_path / 'meals.json')
+    convert_meals.convert(Namespace(input=datasets['recipes'], output=output, columnar='',
+                                    chunksize=chunksize, workers=workers))
+    expected = reference_meals(pd.read_excel(datasets['recipes']))
+    with open(output) as f:
+        assert f.read() == reference_json(expected)
+
+def test_jsonl_output_holds_the_same_items(datasets, tmp_path):
+    output = str(tmp_path / 'meals.jsonl')
+    convert_meals.convert(Namespace(input=datasets['recipes'], output=output, columnar='', chunksize=50, workers=1))
+    with open(output) as f:
+        assert [json.loads(line) for line in f] == reference_meals(pd.read_excel(datasets['recipes']))
@@ -0,0 +1,43 @@
+import glob
+import os
+import subprocess
+import sys
+from catalog import open_catalog
+
+SERVER_DIR = os.path.dirname(os.path.abspath(__file__))
+# Counts that do not fall on generation block edges
+COUNTS = ['--workouts', '25000', '--meals', '12001', '--users', '20999']
+
+def generate_datasets(output_dir, *options):
+    result = subprocess.run([sys.executable, os.path.join(SERVER_DIR, 'generate_datasets.py'), *COUNTS,
+                             '--seed', '3', '--output-dir', str(output_dir), *options], capture_output=True, text=True)
+    assert result.returncode == 0, result.stderr
+    return output_dir
+
+def read(path):
+    with open(path) as f:
+        return f.read()
+
+def test_outputs_do_not_depend_on_the_worker_count(tmp_path):
+    single = generate_datasets(tmp_path / 'single', '--format', 'jsonl')
+    parallel = generate_datasets(tmp_path / 'parallel', '--format', 'jsonl', '--workers', '3')
+    for name in ('workouts.jsonl', 'meals.jsonl', 'users.jsonl'):
+        assert read(parallel / name) == read(single / name)
+    snapshots = [open_catalog(str(output / 'workouts.wfb'), str(output / 'meals.wfb')) for output in (single, parallel)]
+    assert list(snapshots[0]['workouts']) == list(snapshots[1]['workouts'])
+    assert list(snapshots[0]['meals']) == list(snapshots[1]['meals'])
+
+def test_concatenated_shards_match_the_single_file(tmp_path):
+    single = generate_datasets(tmp_path / 'single', '--format', 'jsonl', '--no-columnar')
+    sharded = generate_datasets(tmp_path / 'sharded', '--shards', '4', '--workers', '2')
+    for name in ('workouts', 'meals', 'users'):
+        shards = sorted(glob.glob(str(sharded / f'{name}-*-of-00004.jsonl')))
+        assert len(shards) == 4
+        assert ''.join(read(shard) for shard in shards) == read(single / f'{name}.jsonl')
+
+def test_json_and_jsonl_hold_the_same_items(tmp_path):
+    lines = generate_datasets(tmp_path / 'lines', '--format', 'jsonl', '--no-columnar')
+    listed = generate_datasets(tmp_path / 'listed', '--no-columnar')
+    snapshots = [open_catalog(str(output / f'workouts.{extension}'), str(output / f'meals.{extension}'))
+                 for output, extension in ((lines, 'jsonl'), (listed, 'json'))]
+    assert snapshots[0]['workouts'] == snapshots[1]['workouts'] and snapshots[0]['meals'] == snapshots[1]['meals']
@@ -0,0 +1,113 @@
+import json
+import time
+from collections import OrderedDict
+from datetime import datetime
+import pytest
+import jobs
+import storage
+from catalog import open_catalog
+from conftest import generate, fresh_plan
+from jobs import week_rows
+from planner import plan_week
+
+def picked_ids(week):
+    return [([w['id'] for w in workouts], [m['id'] for m in meals]) for workouts, meals in week]
+
+def test_plan_week_completes_a_started_week(catalogs, users):
+    workouts, meals = catalogs['items']['workout'], catalogs['items']['meal']
+    week_start = datetime(2026, 1, 7)
+    for user_data in users:
+        week = plan_week(user_data, week_start, workouts, meals)
+        used = {w['id'] for selected_workouts, _ in week[:2] for w in selected_workouts}
+        rest = plan_week(user_data, week_start, workouts, meals, days=range(2, 7), used_workouts=used)
+        assert picked_ids(rest) == picked_ids(week[2:])
+
+def test_idempotency_key_returns_the_original_submission(server, users):
+    client = server.app.test_client()
+    first = client.post('/submit', json=users[0], headers={'Idempotency-Key': 'retry-1'}).get_json()
+    again = client.post('/submit', json=users[0], headers={'Idempotency-Key': 'retry-1'}).get_json()
+    assert again == first
+    assert storage.get_db_connection().execute('SELECT COUNT(*) FROM users').fetchone()[0] == 1
+    status = client.get('/submit/retry-1').get_json()
+    assert status['user_id'] == first['user_id'] and status['status'] == 'complete'
+
+@pytest.fixture(params=['thread', 'asyncio', 'process'])
+def async_server(request, tmp_path, monkeypatch):
+    # Process workers read the database path from the environment
+    monkeypatch.setenv('WFB_DB_PATH', str(tmp_path / 'test.sqlite'))
+    monkeypatch.setenv('WFB_SUBMIT_MODE', 'async')
+    monkeypatch.setenv('WFB_SUBMIT_EXECUTOR', request.param)
+    monkeypatch.setenv('WFB_SUBMIT_WORKERS', '2')
+    return request.getfixturevalue('server')
+
+def wait_for_submission(client, submission_id, timeout=60):
+    deadline = time.monotonic() + timeout
+    while True:
+        response = client.get(f'/submit/{submission_id}')
+        if response.status_code != 202 or time.monotonic() > deadline:
+            return response
+        time.sleep(0.02)
+
+def test_async_submit_completes_the_same_week(async_server, users):
+    client = async_server.app.test_client()
+    submitted = {}
+    for index, user_data in enumerate(users[:6]):
+        response = client.post('/submit', json=user_data, headers={'Idempotency-Key': f'async-{index}'})
+        assert response.status_code == 202
+        submitted[f'async-{index}'] = response.get_json()['schedule']
+    for submission_id, first_day in submitted.items():
+        response = wait_for_submission(client, submission_id)
+        assert response.status_code == 200
+        result = response.get_json()
+        assert result['schedule'] == fresh_plan(async_server, result['user_id'])
+        assert result['schedule']['0'] == first_day
+        # A retry after completion returns the stored user
+        retry = client.post('/submit', json={}, headers={'Idempotency-Key': submission_id}).get_json()
+        assert retry['user_id'] == result['user_id']
+    assert storage.get_db_connection().execute('SELECT COUNT(*) FROM users').fetchone()[0] == len(submitted)
+
+def test_completed_weeks_fill_the_plan_cache(async_server, users):
+    client = async_server.app.test_client()
+    client.post('/submit', json=users[0], headers={'Idempotency-Key': 'first'})
+    assert wait_for_submission(client, 'first').status_code == 200
+    hits = async_server.plan_cache.stats()['hits']
+    # The same profile gets its whole week from the cache
+    client.post('/submit', json=users[0], headers={'Idempotency-Key': 'again'})
+    assert async_server.plan_cache.stats()['hits'] == hits + 1
+    result = wait_for_submission(client, 'again').get_json()
+    assert result['schedule'] == fresh_plan(async_server, result['user_id'])
+
+def write_catalog(path, items):
+    with open(path, 'w') as f:
+        json.dump(items, f)
+
+def test_worker_completes_submissions_planned_before_a_reload(server, users, tmp_path, monkeypatch):
+    workouts_path, meals_path = str(tmp_path / 'workouts.json'), str(tmp_path / 'meals.json')
+    write_catalog(workouts_path, generate('workout', 300))
+    write_catalog(meals_path, generate('meal', 200))
+    before = open_catalog(workouts_path, meals_path)
+    storage.save_catalog(before['version'], before['workouts'], before['meals'])
+    week_start = datetime(2026, 1, 5)
+
+    def task(key, user_data):
+        # The first day as /submit planned it before the reload
+        return {'key': key, 'user_data': user_data, 'week_start': week_start, 'catalog_version': before['version'],
+                'rows': week_rows(user_data, week_start, before, range(1))}
+
+    monkeypatch.setattr(jobs, '_worker', {'paths': None, 'snapshots': OrderedDict()})
+    jobs._init_worker(workouts_path, meals_path)
+    jobs._worker_snapshot(before['version'])
+    write_catalog(workouts_path, generate('workout', 300, seed=8))
+    after = open_catalog(workouts_path, meals_path)
+
+    # A worker that opened the previous version completes on it
+    user_id, version, rows = jobs._complete_in_worker(task('kept', users[0]))
+    assert version == before['version'] and rows == week_rows(users[0], week_start, before)
+    # One started after the reload plans the whole week on the current catalog
+    monkeypatch.setattr(jobs, '_worker', {'paths': (workouts_path, meals_path), 'snapshots': OrderedDict()})
+    user_id, version, rows = jobs._complete_in_worker(task('replanned', users[1]))
+    assert version == after['version'] and rows == week_rows(users[1], week_start, after)
+    assert storage.load_user(user_id)['catalog_version'] == after['version'] and len(storage.load_plan(user_id)) == 7
+    # Cohort chunks are written against the parent's version, so they still fail
+    with pytest.raises(RuntimeError):
+        jobs._plan_weeks_in_worker([('key', users[2])], week_start, before['version'])
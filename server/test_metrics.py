@@ -0,0 +1,63 @@
+import re
+import metrics
+from metrics import Counter, Histogram
+
+SAMPLE = re.compile(r'^([a-zA-Z_:][a-zA-Z0-9_:]*)(\{.*\})? (\S+)$')
+
+def parse(text):
+    # {(name, labels): value} for the samples, and the declared type of every metric family
+    samples, types = {}, {}
+    for line in text.splitlines():
+        if line.startswith('# TYPE '):
+            _, _, name, kind = line.split(' ')
+            types[name] = kind
+        elif line and not line.startswith('#'):
+            name, labels, value = SAMPLE.match(line).groups()
+            samples[name, labels or ''] = float(value)
+    return samples, types
+
+def family(name, types):
+    base = re.sub(r'_(bucket|sum|count)$', '', name)
+    return base if types.get(base) == 'histogram' else name
+
+def test_counters_and_histograms_render_in_the_text_format(monkeypatch):
+    monkeypatch.setattr(metrics, '_metrics', [])
+    monkeypatch.setattr(metrics, '_collectors', [])
+    requests = Counter('test_requests_total', 'Requests', ('endpoint', 'status'))
+    latency = Histogram('test_seconds', 'Latency', ('stage',), buckets=(0.1, 1.0))
+    requests.inc('submit', '200')
+    requests.inc('submit', '200', amount=2)
+    requests.inc('plan "x"\n', '404')
+    for value in (0.05, 0.1, 0.5, 3.0):
+        latency.observe(value, 'schedule')
+    metrics.register_collector(lambda: [('test_items', 'gauge', 'Items', [({'kind': 'meal'}, 12), ({}, 1.5)])])
+
+    samples, types = parse(metrics.render())
+    assert types == {'test_requests_total': 'counter', 'test_seconds': 'histogram', 'test_items': 'gauge'}
+    assert samples['test_requests_total', '{endpoint="submit",status="200"}'] == 3
+    assert samples['test_requests_total', '{endpoint="plan \\"x\\"\\n",status="404"}'] == 1
+    # Buckets are cumulative and include observations equal to their bound
+    assert [samples['test_seconds_bucket', f'{{stage="schedule",le="{le}"}}'] for le in ('0.1', '1.0', '+Inf')] == [2, 3, 4]
+    assert samples['test_seconds_count', '{stage="schedule"}'] == 4
+    assert samples['test_seconds_sum', '{stage="schedule"}'] == 3.65
+    assert samples['test_items', '{kind="meal"}'] == 12 and samples['test_items', ''] == 1.5
+
+def test_metrics_endpoint_reports_requests_stages_and_service_state(server, users):
+    client = server.app.test_client()
+    before, _ = parse(client.get('/metrics').get_data(as_text=True))
+    for user_data in users[:3]:
+        assert client.post('/submit', json=user_data).status_code == 200
+    response = client.get('/metrics')
+    assert response.status_code == 200 and response.content_type == metrics.CONTENT_TYPE
+    samples, types = parse(response.get_data(as_text=True))
+
+    def delta(name, labels):
+        return samples[name, labels] - before.get((name, labels), 0)
+
+    assert delta('wfb_requests_total', '{endpoint="/submit",status="200"}') == 3
+    assert delta('wfb_request_seconds_count', '{endpoint="/submit"}') == 3
+    assert delta('wfb_stage_seconds_count', '{stage="schedule"}') >= 3
+    assert samples['wfb_catalog_items', '{kind="workout"}'] == len(server.catalog['workouts'])
+    assert samples['wfb_catalog_info', f'{{version="{server.catalog["version"]}"}}'] == 1
+    # Every sample belongs to a declared family
+    assert {family(name, types) for name, _ in samples} <= set(types)
@@ -0,0 +1,46 @@
+import time
+from app import PlanCache
+
+def test_least_recently_used_plans_are_evicted():
+    cache = PlanCache(max_size=2)
+    cache.put('a', 'v1', 'plan a')
+    cache.put('b', 'v1', 'plan b')
+    assert cache.get('a', 'v1') == 'plan a'
+    cache.put('c', 'v1', 'plan c')
+    assert cache.get('b', 'v1') is None
+    assert cache.get('a', 'v1') == 'plan a' and cache.get('c', 'v1') == 'plan c'
+    assert cache.stats() == {'size': 2, 'max_size': 2, 'hits': 3, 'misses': 1, 'evictions': 1, 'invalidations': 0}
+
+def test_plans_expire_after_the_ttl(monkeypatch):
+    now = [100.0]
+    monkeypatch.setattr(time, 'monotonic', lambda: now[0])
+    cache = PlanCache(ttl=60)
+    cache.put('a', 'v1', 'plan a')
+    now[0] += 60
+    assert cache.get('a', 'v1') == 'plan a'
+    now[0] += 1
+    assert cache.get('a', 'v1') is None
+    assert cache.stats()['size'] == 0 and cache.stats()['evictions'] == 1
+
+def test_a_new_catalog_version_drops_the_cached_plans():
+    cache = PlanCache()
+    cache.put('a', 'v1', 'plan a')
+    assert cache.get('a', 'v2') is None
+    cache.put('b', 'v2', 'plan b')
+    assert cache.get('a', 'v2') is None and cache.get('b', 'v2') == 'plan b'
+    assert cache.stats()['invalidations'] == 1 and cache.stats()['size'] == 1
+
+def test_lookups_for_the_previous_version_keep_the_current_plans():
+    cache = PlanCache()
+    cache.put('a', 'v2', 'plan a')
+    # A request still finishing on the previous snapshot
+    assert cache.get('a', 'v1') is None
+    assert cache.get('a', 'v2') == 'plan a'
+    assert cache.stats()['invalidations'] == 0
+
+def test_identical_profiles_share_a_cached_week(server, users):
+    client = server.app.test_client()
+    first = client.post('/submit', json=users[0]).get_json()
+    again = client.post('/submit', json=users[0]).get_json()
+    assert again['user_id'] != first['user_id'] and again['schedule'] == first['schedule']
+    assert server.plan_cache.stats()['hits'] == 1
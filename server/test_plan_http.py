@@ -0,0 +1,26 @@
+import gzip
+import json
+
+def test_patch_without_changes_keeps_the_etag(server, users):
+    client = server.app.test_client()
+    user_id = client.post('/submit', json=users[0]).get_json()['user_id']
+    etag = client.get(f'/plan/{user_id}').headers['ETag']
+    response = client.patch(f'/user/{user_id}', json={'age': users[0]['age']})
+    assert response.get_json()['rows_changed'] == 0
+    assert client.get(f'/plan/{user_id}', headers={'If-None-Match': etag}).status_code == 304
+    client.patch(f'/user/{user_id}', json={'lunch_time': '2:15 PM'})
+    assert client.get(f'/plan/{user_id}', headers={'If-None-Match': etag}).status_code == 200
+
+def test_plans_are_gzipped_for_clients_that_accept_it(server, users):
+    client = server.app.test_client()
+    user_id = client.post('/submit', json=users[0]).get_json()['user_id']
+    plain = client.get(f'/plan/{user_id}', headers={'Accept-Encoding': 'identity'})
+    compressed = client.get(f'/plan/{user_id}', headers={'Accept-Encoding': 'gzip'})
+    assert 'Content-Encoding' not in plain.headers
+    assert compressed.headers['Content-Encoding'] == 'gzip' and 'Accept-Encoding' in compressed.headers['Vary']
+    assert json.loads(gzip.decompress(compressed.get_data())) == plain.get_json()
+    # Both carry the same weak ETag, so either revalidates the other
+    assert compressed.headers['ETag'] == plain.headers['ETag'] and plain.headers['ETag'].startswith('W/')
+    etag = compressed.headers['ETag']
+    assert client.get(f'/plan/{user_id}', headers={'If-None-Match': etag}).status_code == 304
+    assert client.get('/plan/999999').status_code == 404
@@ -0,0 +1,63 @@
+import os
+import subprocess
+import sys
+import pytest
+from catalog import open_catalog
+from planner import plan_week, user_profile
+from plan_table import (bucket_count, bucket_index, representative_profile, encode_week, decode_week,
+                        load_plan_table, lookup_week)
+
+SERVER_DIR = os.path.dirname(os.path.abspath(__file__))
+
+def build_plan_table(catalogs, output, *options):
+    return subprocess.run([sys.executable, os.path.join(SERVER_DIR, 'build_plan_table.py'),
+                           '--workouts', catalogs['paths']['workout'], '--meals', catalogs['paths']['meal'],
+                           '--output', output, *options], capture_output=True, text=True)
+
+@pytest.fixture(scope='module')
+def plan_table_path(catalogs, tmp_path_factory):
+    output = str(tmp_path_factory.mktemp('plan_table') / 'plan_table')
+    result = build_plan_table(catalogs, output)
+    assert result.returncode == 0, result.stderr
+    return output
+
+def ids(week):
+    return [([w['id'] for w in workouts], [m['id'] for m in meals]) for workouts, meals in week]
+
+def test_representative_profiles_fall_in_their_own_bucket():
+    for bucket in range(0, bucket_count(), 37):
+        user_data, week_start = representative_profile(bucket)
+        assert bucket_index(user_profile(user_data), week_start.weekday()) == bucket
+
+def test_encoded_weeks_decode_to_the_same_picks(catalogs, users):
+    snapshot = open_catalog(catalogs['paths']['workout'], catalogs['paths']['meal'])
+    workouts, meals, positions = snapshot['workouts'], snapshot['meals'], snapshot['positions']
+    for user_data in users[:10]:
+        week = plan_week(user_data, representative_profile(0)[1], workouts, meals)
+        row = encode_week(week, positions['workout'], positions['meal'])
+        assert ids(decode_week(row, workouts, meals)) == ids(week)
+
+def test_lookups_return_the_bucket_plan(catalogs, plan_table_path):
+    snapshot = open_catalog(catalogs['paths']['workout'], catalogs['paths']['meal'])
+    plan_table = load_plan_table(plan_table_path)
+    assert plan_table['catalog_version'] == snapshot['version']
+    for bucket in range(0, bucket_count(), 53):
+        user_data, week_start = representative_profile(bucket)
+        live = plan_week(user_data, week_start, snapshot['workouts'], snapshot['meals'])
+        assert ids(lookup_week(plan_table, user_data, week_start, snapshot['workouts'], snapshot['meals'])) == ids(live)
+    assert lookup_week(plan_table, {'diet': 'vegan'}, week_start, snapshot['workouts'], snapshot['meals']) is None
+
+def test_verify_fails_below_the_sampled_agreement(catalogs, plan_table_path):
+    result = build_plan_table(catalogs, plan_table_path, '--verify', '--samples', '200', '--min-agreement', '0')
+    assert result.returncode == 0, result.stdout
+    agree = int(result.stdout.splitlines()[1].split('/')[0])
+    assert agree < 200
+    # Any disagreement fails by default
+    result = build_plan_table(catalogs, plan_table_path, '--verify', '--samples', '200')
+    assert result.returncode == 1 and 'Verification failed' in result.stdout
+
+def test_verify_rejects_a_table_for_another_catalog(catalogs, plan_table_path):
+    result = subprocess.run([sys.executable, os.path.join(SERVER_DIR, 'build_plan_table.py'),
+                             '--workouts', catalogs['paths']['workout_columnar'], '--meals', catalogs['paths']['meal'],
+                             '--output', plan_table_path, '--verify'], capture_output=True, text=True)
+    assert result.returncode == 1 and 'Table was built for catalog' in result.stdout
@@ -0,0 +1,124 @@
+from datetime import datetime, timedelta
+import pytest
+from sklearn.metrics.pairwise import cosine_similarity
+from planner import user_profile, parse_time, recommend, plan_week, create_schedule, WEEKLY_SPLIT
+
+def reference_recommend(user_data, items, item_type, day_of_week, used_workouts):
+    # The original per-item ranking. Similarities are rounded so that last-bit differences between
+    # BLAS calls do not decide ties, which then keep catalog order like the original stable sort.
+    target_split = WEEKLY_SPLIT.get(day_of_week, 'rest')
+    if target_split == 'rest' and item_type == 'workout':
+        return []
+    profile = user_profile(user_data)
+    goal, gender, diet, age, bmi = profile['goal'], profile['gender'], profile['diet'], profile['age'], profile['bmi']
+    work_duration = profile['work_duration']
+    item_vectors = []
+    for item in items:
+        goal_score = bmi_score = duration_score = age_score = gender_score = diet_score = intensity_score = split_score = volume_score = 0
+        if item_type == 'workout':
+            if goal == 'fitness' and item['type'] in ['strength', 'bodyweight']:
+                goal_score = 1.3 if item['intensity'] == 'high' else 1.0
+            bmi_score = 1.0 if bmi < 25 and item['calories_burned'] > 150 else 0.7
+            duration_score = 1.0 if item.get('duration_minutes', 20) <= 30 and work_duration > 8 else 0.6
+            age_score = 1.0 if age < 40 and item['intensity'] != 'high' else 0.5
+            gender_score = 1.0 if gender == 'male' and item['muscle_group'] in ['chest', 'back', 'legs'] else 0.9
+            intensity_score = 1.0 if item['intensity'] == 'medium' and bmi > 25 else 0.8
+            split_score = 2.0 if target_split == item['split'] else 0.05
+            volume_score = 1.0 if item['sets'] >= 3 else 0.7
+            if item['id'] in used_workouts:
+                split_score *= 0.01
+        else:
+            if goal == 'fitness' and item['protein'] >= 15:
+                goal_score = 1.3 if item['protein'] >= 25 else 1.0
+            bmi_score = 1.0 if bmi < 25 or item['calories'] < 600 else 0.6
+            duration_score = 1.0 if item.get('prep_time_minutes', 30) <= 20 and work_duration > 8 else 0.7
+            age_score = 1.0 if age < 40 else 0.8
+            gender_score = 1.0 if gender == 'male' and item['protein'] > 20 else 0.9
+            diet_score = 2.0 if item['type'] == diet else 0.0
+            intensity_score = split_score = volume_score = 1.0
+        item_vectors.append([goal_score, bmi_score, duration_score, age_score, gender_score, diet_score,
+                             intensity_score, split_score, volume_score])
+    if not item_vectors:
+        return []
+    similarities = cosine_similarity([profile['user_vector']], item_vectors)[0].round(12)
+    ranked = sorted(zip(similarities, items), key=lambda x: x[0], reverse=True)[:3]
+    return [item for _, item in ranked]
+
+def reference_week(user_data, week_start, workouts, meals):
+    used = set()
+    week = []
+    for day in range(7):
+        day_of_week = (week_start + timedelta(days=day)).weekday()
+        selected_workouts = reference_recommend(user_data, workouts, 'workout', day_of_week, used)
+        used.update(w['id'] for w in selected_workouts)
+        week.append((selected_workouts, reference_recommend(user_data, meals, 'meal', day_of_week, used)))
+    return week
+
+def reference_schedule(user_data, workouts, meals):
+    # The original first-match meal scan and slot layout
+    work_end = parse_time(user_data.get('work_end', '10:00 PM'))
+    lunch_time = parse_time(user_data.get('lunch_time', '1:00 PM'))
+    diet = user_data.get('diet', 'non-vegetarian').lower()
+    meal_plan = [("7:00 AM", 350, 10, 50, 'breakfast', "High-carb for energy"),
+                 (lunch_time.strftime('%I:%M %p'), 600, 30, 70, 'lunch', "High-protein for recovery"),
+                 ("8:00 PM", 600, 30, 70, 'dinner', "High-protein for recovery")]
+    daily_schedule = {}
+    for time, calories, protein, carbs, meal_type, purpose in meal_plan:
+        suitable_meals = [m for m in meals if m.get('meal_type') == meal_type and m.get('type') == diet and
+                          'purpose' in m and abs(m['calories'] - calories) <= 150 and
+                          abs(m['protein'] - protein) <= 15 and abs(m['carbs'] - carbs) <= 30]
+        if not suitable_meals:
+            suitable_meals = [m for m in meals if m.get('meal_type') == meal_type and m.get('type') == diet and
+                              'purpose' in m]
+        if not suitable_meals:
+            suitable_meals = [m for m in meals if m.get('meal_type') in ['main course', 'breakfast', 'snack'] and
+                              'purpose' in m]
+        meal = suitable_meals[0] if suitable_meals else meals[0]
+        daily_schedule[time] = {"type": "meal", "name": meal['name'], "calories": meal['calories'],
+                                "protein": meal['protein'], "carbs": meal['carbs'], "fat": meal['fat'],
+                                "purpose": meal.get('purpose', purpose)}
+    if workouts:
+        workout_time = (work_end + timedelta(hours=1)).strftime('%I:%M %p')
+        workout_end = (work_end + timedelta(hours=2, minutes=30)).strftime('%I:%M %p')
+        daily_schedule[f"{workout_time}-{workout_end}"] = {
+            "type": "workout",
+            "name": f"{workouts[0]['split'].capitalize()} Day",
+            "details": [{**w, "instructions": f"Use 70-80% 1RM, rest {90 if w['intensity'] == 'high' else 60}s."}
+                        for w in workouts],
+            "warmup": "5 min dynamic stretches (leg swings, arm circles)"
+        }
+    return daily_schedule
+
+def ids(items):
+    return [item['id'] for item in items]
+
+@pytest.mark.parametrize('item_type', ['workout', 'meal'])
+def test_recommend_matches_reference_ranking(catalogs, users, item_type):
+    items = catalogs['items'][item_type]
+    for index, user_data in enumerate(users):
+        day_of_week = index % 7
+        used = {item['id'] for item in items[index:index + 5]}
+        assert ids(recommend(user_data, items, item_type, day_of_week, used)) == \
+            ids(reference_recommend(user_data, items, item_type, day_of_week, used))
+
+def test_plan_week_matches_day_by_day_recommend(catalogs, users):
+    workouts, meals = catalogs['items']['workout'], catalogs['items']['meal']
+    for index, user_data in enumerate(users):
+        week_start = datetime(2026, 1, 5) + timedelta(days=index % 7)
+        week = plan_week(user_data, week_start, workouts, meals)
+        used = set()
+        for day, (selected_workouts, selected_meals) in enumerate(week):
+            day_of_week = (week_start + timedelta(days=day)).weekday()
+            assert ids(selected_workouts) == ids(recommend(user_data, workouts, 'workout', day_of_week, used))
+            assert ids(selected_meals) == ids(recommend(user_data, meals, 'meal', day_of_week, used))
+            used.update(w['id'] for w in selected_workouts)
+        assert [(ids(w), ids(m)) for w, m in week] == \
+            [(ids(w), ids(m)) for w, m in reference_week(user_data, week_start, workouts, meals)]
+
+def test_create_schedule_matches_reference(catalogs, users):
+    workouts, meals = catalogs['items']['workout'], catalogs['items']['meal']
+    for user_data in users:
+        selected_workouts, selected_meals = plan_week(user_data, datetime(2026, 1, 5), workouts, meals)[0]
+        for day_meals in (selected_meals, meals):
+            assert create_schedule(user_data, selected_workouts, day_meals) == \
+                reference_schedule(user_data, selected_workouts, day_meals)
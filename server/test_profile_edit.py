@@ -0,0 +1,64 @@
+import json
+import threading
+from collections import OrderedDict
+import pytest
+import storage
+from conftest import fresh_plan, stored_plan
+
+EDITS = {
+    'lunch_time': lambda user_data: {'lunch_time': '2:15 PM'},
+    'work_end': lambda user_data: {'work_end': '11:00 PM'},
+    'diet': lambda user_data: {'diet': 'vegetarian' if user_data['diet'] == 'non-vegetarian' else 'non-vegetarian'},
+    'weight': lambda user_data: {'weight': str(float(user_data['weight']) + 15)},
+    'goal': lambda user_data: {'goal': 'weight loss' if user_data['goal'] == 'fitness' else 'fitness'},
+    'age': lambda user_data: {'age': str(int(user_data['age']) + 20)},
+}
+
+@pytest.mark.parametrize('edit', sorted(EDITS))
+def test_patch_replans_like_a_fresh_submit(server, users, edit):
+    client = server.app.test_client()
+    for user_data in users[:8]:
+        user_id = client.post('/submit', json=user_data).get_json()['user_id']
+        response = client.patch(f'/user/{user_id}', json=EDITS[edit](user_data))
+        assert response.status_code == 200
+        plan = stored_plan(client, user_id)
+        assert plan == fresh_plan(server, user_id)
+        assert response.get_json()['schedule'] == plan
+
+def test_concurrent_patches_keep_plan_and_profile_together(server, users):
+    client = server.app.test_client()
+    user_id = client.post('/submit', json=users[0]).get_json()['user_id']
+    statuses = []
+
+    def edit(edits):
+        edit_client = server.app.test_client()
+        for changes in edits:
+            statuses.append(edit_client.patch(f'/user/{user_id}', json=changes).status_code)
+
+    threads = [threading.Thread(target=edit, args=([{'diet': diet} for diet in ('vegetarian', 'non-vegetarian') * 5],)),
+               threading.Thread(target=edit, args=([{'lunch_time': time} for time in ('12:30 PM', '2:00 PM') * 5],)),
+               threading.Thread(target=edit, args=([{'weight': weight} for weight in ('60', '95') * 5],))]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert set(statuses) <= {200, 409}
+    assert stored_plan(client, user_id) == fresh_plan(server, user_id)
+
+def items(plan):
+    return {day: sorted(json.dumps(entry, sort_keys=True) for entry in slots.values()) for day, slots in plan.items()}
+
+def test_times_edit_after_a_restart_onto_another_catalog(server, users, monkeypatch):
+    client = server.app.test_client()
+    user_id = client.post('/submit', json=users[0]).get_json()['user_id']
+    before = stored_plan(client, user_id)
+    # A restarted server has only loaded the catalog it serves now
+    monkeypatch.setattr(storage, '_catalogs', OrderedDict())
+    storage.catalog_record.cache_clear()
+    lunch_time = '12:30 PM' if users[0]['lunch_time'] != '12:30 PM' else '1:30 PM'
+    response = client.patch(f'/user/{user_id}', json={'lunch_time': lunch_time})
+    assert response.status_code == 200 and response.get_json()['stages'] == ['times']
+    plan = stored_plan(client, user_id)
+    assert plan == response.get_json()['schedule'] and plan != before
+    # The same items, only at new times
+    assert items(plan) == items(before)
@@ -0,0 +1,96 @@
+import threading
+import pytest
+import storage
+from conftest import generate, fresh_plan, stored_plan
+from storage import WriteQueue, WriteQueueFull
+
+CATALOG_VERSION = 'test-catalog'
+ROWS = [(0, 0, '7:00 AM', 'meal', 0, None), (0, 1, '06:00 PM-07:30 PM', 'workout', 0, None)]
+
+@pytest.fixture
+def database(tmp_path, monkeypatch):
+    monkeypatch.setattr(storage, 'DB_PATH', str(tmp_path / 'test.sqlite'))
+    monkeypatch.setattr(storage._local, 'conn', None, raising=False)
+    storage.init_db()
+    storage.save_catalog(CATALOG_VERSION, generate('workout', 1), generate('meal', 1))
+    yield storage.get_db_connection()
+    storage.get_db_connection().close()
+
+def profile(index):
+    return {'age': str(20 + index), 'goal': 'fitness'}
+
+def count_users(conn):
+    return conn.execute('SELECT COUNT(*) FROM users').fetchone()[0]
+
+def test_write_queue_commits_submissions_in_batches(database):
+    queue = WriteQueue(batch_size=16, max_wait=0.05)
+    futures = [queue.submit(profile(i), CATALOG_VERSION, ROWS) for i in range(48)]
+    user_ids = [future.result(timeout=10) for future in futures]
+    queue.close()
+    assert len(set(user_ids)) == 48 and count_users(database) == 48
+    assert queue.written == 48 and queue.batches < 48
+    assert storage.load_plan(user_ids[-1])[0]['7:00 AM']['name'] == generate('meal', 1)[0]['name']
+
+def test_write_queue_stores_a_repeated_submission_key_once(database):
+    queue = WriteQueue(batch_size=16, max_wait=0.05)
+    futures = [queue.submit(profile(0), CATALOG_VERSION, ROWS, 'same-key') for _ in range(3)]
+    assert len({future.result(timeout=10) for future in futures}) == 1
+    queue.close()
+    assert count_users(database) == 1
+
+def test_write_queue_rejects_submissions_when_full(database, monkeypatch):
+    release = threading.Event()
+    write = WriteQueue._write
+    monkeypatch.setattr(WriteQueue, '_write', lambda self, conn, batch: release.wait() and write(self, conn, batch))
+    queue = WriteQueue(batch_size=1, max_wait=0, max_pending=2, enqueue_timeout=0.01)
+    accepted = []
+    with pytest.raises(WriteQueueFull):
+        for i in range(10):
+            accepted.append(queue.submit(profile(i), CATALOG_VERSION, ROWS))
+    # One submission held by the blocked writer and two waiting
+    assert len(accepted) == 3
+    release.set()
+    queue.close()
+    assert all(future.result(timeout=10) for future in accepted) and count_users(database) == 3
+
+def test_close_resolves_every_accepted_submission(database):
+    for trial in range(10):
+        queue = WriteQueue(batch_size=8, max_pending=16)
+        futures = []
+
+        def submit():
+            for i in range(50):
+                try:
+                    futures.append(queue.submit(profile(i), CATALOG_VERSION, ROWS))
+                except (RuntimeError, WriteQueueFull):
+                    pass
+
+        threads = [threading.Thread(target=submit) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        queue.close()
+        for thread in threads:
+            thread.join()
+        # Nothing was enqueued behind the stop marker
+        assert all(future.done() for future in futures)
+        with pytest.raises(RuntimeError):
+            queue.submit(profile(0), CATALOG_VERSION, ROWS)
+
+def test_submit_stores_the_planned_week(server, users):
+    client = server.app.test_client()
+    for user_data in users[:10]:
+        response = client.post('/submit', json=user_data)
+        assert response.status_code == 200
+        user_id = response.get_json()['user_id']
+        plan = stored_plan(client, user_id)
+        assert plan == fresh_plan(server, user_id)
+        assert response.get_json()['schedule'] == plan['0']
+
+def test_catalog_items_only_hold_referenced_items(server, users):
+    client = server.app.test_client()
+    for user_data in users[:10]:
+        client.post('/submit', json=user_data)
+    conn = storage.get_db_connection()
+    referenced = conn.execute('''SELECT COUNT(*) FROM (SELECT DISTINCT u.catalog_version, p.kind, p.position
+                                 FROM plan_items p JOIN users u ON u.id = p.user_id)''').fetchone()[0]
+    assert conn.execute('SELECT COUNT(*) FROM catalog_items').fetchone()[0] == referenced